@@ -1,32 +1,127 @@
+import json
+import os
+import re
+import time
+import uuid
 import streamlit as st
-from modules import planner, inquiry_builder, router, scanner, orchestrator, synthesizer, composer
+from modules import jobs
+
+
+@st.cache_resource
+def _start_workers():
+    """Start the embedded job workers once per server process.
+
+    Research runs execute in these processes, so reruns and refreshes never
+    interrupt them.  Set ``JOB_WORKERS=0`` when workers run separately
+    (``python -m modules.jobs``).
+    """
+    return jobs.start_workers(jobs.JOB_WORKERS, parent=os.getpid())
+
+
+_start_workers()
 
 st.title("🔒 Secure R&D Assistant – Test Pilot")
 st.write("Enter a high‑level R&D project description and let the assistant research it securely.")
 
-# Initialize per-session knowledge base for domain answers
-kb = st.session_state.setdefault("knowledge_base", {})  # {domain: answer}
+session_id = st.session_state.setdefault("session_id", uuid.uuid4().hex)  # tags audit records
 
 user_request = st.text_area("Project Description:", placeholder="e.g. Design a drone for wildfire detection", height=100)
 run_clicked = st.button("Run Secure Research")
 
+POLL_INTERVAL = 0.25  # seconds between reads of the job's event log
+
 if run_clicked and user_request:
-    import re
     safe_request = re.sub(r'<[^>]*>', '', user_request).strip()
     if not safe_request:
         st.error("Please enter a valid project description.")
     else:
-        st.info("Starting secure research… this may take a minute.")
-        results, log = orchestrator.run_research(safe_request, kb)
-        st.session_state["knowledge_base"] = kb
-        st.subheader("Activity Log")
-        st.code("\n".join(log))
-        report_md = synthesizer.synthesize(
-            project_name=safe_request,
-            user_prompt=safe_request,
-            data=results,
-            artifacts={}
-        )
-        pdf_bytes = composer.make_pdf(report_md)
-        st.success("Research complete! Download the full report below:")
-        st.download_button(label="📄 Download Report PDF", data=pdf_bytes, file_name="research_report.pdf", mime="application/pdf")
+        job_id, created = jobs.submit(safe_request, session_id)
+        st.session_state["job_id"] = job_id
+        st.query_params["job"] = job_id  # a refreshed page reattaches to the job
+        if not created:
+            st.info("This project is already being researched – following the existing run.")
+
+job_id = st.session_state.get("job_id") or st.query_params.get("job")
+job = jobs.get_store().get(job_id) if job_id else None
+
+if job_id and job is None:
+    st.error(f"Unknown job {job_id}.")
+elif job:
+    st.caption(f"Job `{job['id']}` – {job['request']}")
+    status_box = st.empty()
+    st.subheader("Activity Log")
+    log_box = st.empty()
+    st.subheader("Findings")
+    findings = st.container()
+    panels, buffers = {}, {}
+
+    def panel(key):
+        if key not in panels:
+            with findings.expander(key, expanded=True):
+                panels[key] = st.empty()
+            buffers[key] = ""
+        return panels[key]
+
+    store = jobs.get_store()
+    lines, seq = [], 0
+    while True:
+        batch = store.events(job["id"], seq)
+        dirty = set()
+        for seq, event in batch:
+            kind = event["type"]
+            if kind == "restart":  # a requeued job starts over: drop the lost attempt's output
+                lines[:] = [event["text"]]
+                for key in panels:
+                    buffers[key] = ""
+                    dirty.add(key)
+            elif kind in ("log", "error"):
+                lines.append(event["text"])
+            elif kind == "token":
+                panel(event["key"])
+                buffers[event["key"]] += event["text"]
+                dirty.add(event["key"])
+            elif kind == "reset":
+                panel(event["key"])
+                buffers[event["key"]] = ""
+                dirty.add(event["key"])
+            elif kind == "answer":
+                panel(event["key"])
+                buffers[event["key"]] = event["text"]
+                dirty.add(event["key"])
+        job = store.get(job["id"])
+        finished = job["status"] in jobs.FINISHED and not batch
+        for key in dirty:
+            panels[key].markdown(buffers[key] + ("" if finished else "▌"))
+        if batch:
+            log_box.code("\n".join(lines))
+        if finished:
+            break
+        status_box.info(f"Research {job['status']}… results appear below as they arrive.")
+        time.sleep(POLL_INTERVAL)
+
+    if job["status"] == "failed":
+        status_box.error(f"Research failed: {job['error']}")
+    else:
+        status_box.success("Research complete! Download the full report below:")
+        pdf_path = jobs.artifact(job["id"], "report.pdf")
+        if pdf_path:
+            st.download_button(label="📄 Download Report PDF", data=pdf_path.read_bytes(),
+                               file_name="research_report.pdf", mime="application/pdf")
+        trace_path = jobs.artifact(job["id"], "trace.json")
+        if trace_path:
+            with st.expander("Run timing (waterfall)"):
+                rows = json.loads(trace_path.read_text(encoding="utf-8"))
+                st.vega_lite_chart(
+                    {"values": [{k: v for k, v in r.items() if k != "attrs"} for r in rows]},
+                    {
+                        "mark": {"type": "bar", "tooltip": True},
+                        "encoding": {
+                            "y": {"field": "label", "type": "nominal", "sort": None, "title": None},
+                            "x": {"field": "start_ms", "type": "quantitative", "title": "ms since start"},
+                            "x2": {"field": "end_ms"},
+                            "color": {"field": "span", "type": "nominal", "legend": None},
+                        },
+                        "height": {"step": 14},
+                    },
+                    width="stretch",
+                )
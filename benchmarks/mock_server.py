@@ -0,0 +1,300 @@
+"""
+Local stand-in for the OpenAI and Pinecone HTTP APIs used by the benchmarks.
+
+Serves
+  * ``POST /v1/chat/completions`` – plain and streamed completions; when the
+    request offers ``tools``, a configurable share of first turns answer with
+    ``semantic_search`` and/or ``summarize_text`` tool calls instead;
+  * ``POST /v1/embeddings`` – deterministic vectors derived from the input text;
+  * ``POST /query`` and ``POST /vectors/upsert`` – a Pinecone data-plane index;
+  * ``GET /_stats`` / ``POST /_reset`` – per-endpoint call counters.
+
+Latency, jitter, the share of 429 responses and the answer size are
+configurable, and every random choice is seeded so runs are reproducible.
+
+Usage:  python benchmarks/mock_server.py [--port 0] [--latency 0.2] [--rate-429 0.05]
+Prints ``listening on <port>`` once the server accepts connections.
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "sensor thermal payload endurance battery telemetry airframe firmware latency "
+    "coverage detection redundancy certification supplier prototype integration "
+    "bandwidth calibration resilience thermal mapping autonomy regulation cost"
+).split()
+
+EMBED_DIM = 64
+
+
+class MockConfig:
+    def __init__(self, latency: float = 0.2, jitter: float = 0.05, rate_429: float = 0.0,
+                 words: int = 120, tool_rate: float = 0.3, stream_delay: float = 0.002, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.words = words
+        self.tool_rate = tool_rate
+        self.stream_delay = stream_delay
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+
+    def random(self) -> float:
+        with self.rng_lock:
+            return self.rng.random()
+
+
+def _digest(text: str) -> int:
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+
+
+def _text(seed: str, words: int) -> str:
+    rng = random.Random(_digest(seed))
+    sentences, out = [], []
+    for _ in range(words):
+        out.append(rng.choice(WORDS))
+        if len(out) >= rng.randint(8, 16):
+            sentences.append(" ".join(out).capitalize() + ".")
+            out = []
+    if out:
+        sentences.append(" ".join(out).capitalize() + ".")
+    return " ".join(sentences)
+
+
+def _vector(text: str) -> list[float]:
+    rng = random.Random(_digest(text))
+    return [rng.uniform(-1, 1) for _ in range(EMBED_DIM)]
+
+
+def _usage(messages: list, completion: str) -> dict:
+    prompt = sum(len(str(m.get("content") or "")) for m in messages) // 4 + 4 * len(messages)
+    done = max(1, len(completion) // 4)
+    return {"prompt_tokens": prompt, "completion_tokens": done, "total_tokens": prompt + done}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config: MockConfig = None
+    counters: dict = None
+    lock: threading.Lock = None
+    vectors: dict = None
+
+    def log_message(self, *args):
+        pass
+
+    def _count(self, name: str, amount: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def _send(self, status: int, payload, headers: dict | None = None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _delay(self):
+        cfg = self.config
+        time.sleep(max(0.0, cfg.latency + cfg.jitter * (2 * cfg.random() - 1)))
+
+    def do_GET(self):
+        if self.path.startswith("/_stats"):
+            with self.lock:
+                self._send(200, dict(self.counters))
+        else:
+            self._send(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if self.path.startswith("/_reset"):
+            with self.lock:
+                self.counters.clear()
+            return self._send(200, {})
+        if self.path.endswith("/chat/completions"):
+            return self._chat(body)
+        if self.path.endswith("/embeddings"):
+            return self._embeddings(body)
+        if self.path.endswith("/query"):
+            return self._query(body)
+        if self.path.endswith("/vectors/upsert"):
+            return self._upsert(body)
+        self._send(404, {"error": {"message": f"unknown path {self.path}"}})
+
+    def _rate_limited(self) -> bool:
+        if self.config.rate_429 and self.config.random() < self.config.rate_429:
+            self._count("rate_limited")
+            self._send(
+                429,
+                {"error": {"message": "Rate limit reached (mock)", "type": "requests", "code": "rate_limit_exceeded"}},
+                {"retry-after-ms": "200", "x-ratelimit-remaining-requests": "0"},
+            )
+            return True
+        return False
+
+    # ---------------------------------------------------------------- #
+    # OpenAI
+    # ---------------------------------------------------------------- #
+    def _chat(self, body: dict):
+        self._delay()
+        if self._rate_limited():
+            return
+        messages = body.get("messages", [])
+        last_user = next((m for m in reversed(messages) if m.get("role") == "user"), {})
+        prompt = str(last_user.get("content") or "")
+        answered_tool = messages and messages[-1].get("role") == "tool"
+        calls = []
+        if body.get("tools") and body.get("tool_choice") != "none" and not answered_tool:
+            if (_digest(prompt) % 1000) / 1000 < self.config.tool_rate:
+                pick = _digest("tool" + prompt) % 3  # 2: both tools in one (parallel) turn
+                if pick in (0, 2):
+                    calls.append({"name": "semantic_search", "arguments": json.dumps({"query": prompt[:80]})})
+                if pick in (1, 2):
+                    calls.append({"name": "summarize_text", "arguments": json.dumps({"text": _text(prompt, 60)})})
+        content = None if calls else _text(prompt + str(len(messages)), self.config.words)
+        self._count("chat_completions")
+        for _ in calls:
+            self._count("tool_calls")
+        usage = _usage(messages, content or "".join(c["arguments"] for c in calls))
+        message = {"role": "assistant", "content": content}
+        if calls:
+            message["tool_calls"] = [
+                {"id": f"call_{_digest(prompt + str(i)) % 10**8}", "type": "function", "function": call}
+                for i, call in enumerate(calls)
+            ]
+        if body.get("stream"):
+            self._count("chat_streams")
+            return self._stream(body, message, usage)
+        self._send(200, {
+            "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()),
+            "model": body.get("model"),
+            "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if calls else "stop"}],
+            "usage": usage,
+        }, {"x-ratelimit-remaining-requests": "499", "x-ratelimit-remaining-tokens": "39000"})
+
+    def _stream(self, body: dict, message: dict, usage: dict):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def chunk(delta=None, finish=None, with_usage=False):
+            data = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": body.get("model"),
+                    "choices": [] if with_usage else [{"index": 0, "delta": delta or {}, "finish_reason": finish}]}
+            if with_usage:
+                data["usage"] = usage
+            self.wfile.write(b"data: " + json.dumps(data).encode("utf-8") + b"\n\n")
+            self.wfile.flush()
+
+        calls = message.get("tool_calls")
+        if calls:
+            for index, call in enumerate(calls):
+                chunk({"role": "assistant", "tool_calls": [{
+                    "index": index, "id": call["id"], "type": "function",
+                    "function": {"name": call["function"]["name"], "arguments": ""}}]})
+                args = call["function"]["arguments"]
+                for i in range(0, len(args), 40):
+                    chunk({"tool_calls": [{"index": index, "function": {"arguments": args[i:i + 40]}}]})
+            chunk(finish="tool_calls")
+        else:
+            words = message["content"].split(" ")
+            for i in range(0, len(words), 4):
+                chunk({"content": " ".join(words[i:i + 4]) + (" " if i + 4 < len(words) else "")})
+                if self.config.stream_delay:
+                    time.sleep(self.config.stream_delay)
+            chunk(finish="stop")
+        if (body.get("stream_options") or {}).get("include_usage"):
+            chunk(with_usage=True)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _embeddings(self, body: dict):
+        self._delay()
+        if self._rate_limited():
+            return
+        inputs = body.get("input")
+        inputs = [inputs] if isinstance(inputs, str) else list(inputs or [])
+        self._count("embeddings")
+        self._count("embedding_inputs", len(inputs))
+        self._send(200, {
+            "object": "list", "model": body.get("model"),
+            "data": [{"object": "embedding", "index": i, "embedding": _vector(str(t))} for i, t in enumerate(inputs)],
+            "usage": {"prompt_tokens": sum(len(str(t)) // 4 for t in inputs),
+                      "total_tokens": sum(len(str(t)) // 4 for t in inputs)},
+        })
+
+    # ---------------------------------------------------------------- #
+    # Pinecone data plane
+    # ---------------------------------------------------------------- #
+    def _query(self, body: dict):
+        self._delay()
+        self._count("pinecone_queries")
+        vector = body.get("vector") or []
+        with self.lock:
+            stored = list(self.vectors.items())
+        scored = []
+        for vid, (values, metadata) in stored:
+            score = sum(a * b for a, b in zip(vector, values))
+            scored.append((score, vid, metadata))
+        scored.sort(key=lambda s: -s[0])
+        matches = [{"id": vid, "score": score, "values": [], "metadata": metadata if body.get("includeMetadata") else None}
+                   for score, vid, metadata in scored[:int(body.get("topK", 5))]]
+        if not matches:  # an empty index still returns plausible context
+            matches = [{"id": f"doc-{i}", "score": 0.5 - i / 10, "values": [],
+                        "metadata": {"text": _text(f"doc{i}", 40), "domain": "General"}} for i in range(3)]
+        self._send(200, {"matches": matches, "namespace": body.get("namespace", "")})
+
+    def _upsert(self, body: dict):
+        self._count("pinecone_upserts")
+        vectors = body.get("vectors", [])
+        with self.lock:
+            for v in vectors:
+                self.vectors[v["id"]] = (v.get("values", []), v.get("metadata") or {})
+        self._send(200, {"upsertedCount": len(vectors)})
+
+
+def serve(port: int = 0, **options) -> ThreadingHTTPServer:
+    """Start the stand-in server on a daemon thread and return it."""
+    handler = type("MockHandler", (Handler,), {
+        "config": MockConfig(**options), "counters": {}, "lock": threading.Lock(), "vectors": {},
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-api", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.05, help="+/- seconds of latency jitter")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--words", type=int, default=120, help="words per chat answer")
+    parser.add_argument("--tool-rate", type=float, default=0.3, help="share of first turns that call tools")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = serve(args.port, latency=args.latency, jitter=args.jitter, rate_429=args.rate_429,
+                   words=args.words, tool_rate=args.tool_rate, seed=args.seed)
+    print(f"listening on {server.server_address[1]}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
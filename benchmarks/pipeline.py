@@ -0,0 +1,256 @@
+"""
+Offline end-to-end benchmark: research -> synthesize -> make_pdf.
+
+Drives the orchestrator (the event stream behind ``run_research``),
+``synthesizer.synthesize`` and ``composer.make_pdf`` against the local
+stand-in from ``mock_server.py``, so no API money is spent.  All caches, the
+retrieval index and logs live in a throwaway directory, so every run starts
+cold unless ``--warm`` reuses the same request.
+
+Reports runs/minute, p50/p95 latency per stage (wall-clock stages plus the
+traced spans: LLM completions, tool calls, embeddings, research stages), peak
+RSS and the API calls the stand-in received.  ``--save NAME`` stores the
+report under ``benchmarks/baselines/NAME.json``; ``--compare NAME`` prints the
+change against a stored baseline and exits non-zero on regressions beyond
+``--tolerance``.
+
+Usage:  python benchmarks/pipeline.py [--runs 5] [--latency 0.2] [--rate-429 0.05]
+                                      [--backend local|pinecone] [--save NAME] [--compare NAME]
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_DIR = Path(ROOT) / "benchmarks" / "baselines"
+
+REQUESTS = [
+    "Design a drone for wildfire detection",
+    "Develop a low-cost water purification unit for rural clinics",
+    "Build a wearable sensor that predicts heat stroke in workers",
+    "Create a battery management system for electric cargo bikes",
+]
+
+# stages compared against baselines (lower is better)
+KEY_STAGES = ("research", "synthesize", "make_pdf", "total")
+
+
+def start_mock(args) -> tuple[subprocess.Popen, str]:
+    """Run the stand-in server in its own process and return its base URL."""
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "benchmarks", "mock_server.py"), "--port", "0",
+         "--latency", str(args.latency), "--jitter", str(args.jitter), "--rate-429", str(args.rate_429),
+         "--words", str(args.words), "--tool-rate", str(args.tool_rate), "--seed", str(args.seed)],
+        stdout=subprocess.PIPE, text=True,
+    )
+    line = proc.stdout.readline().strip()
+    if not line.startswith("listening on "):
+        proc.kill()
+        raise RuntimeError(f"Mock server failed to start: {line!r}")
+    return proc, f"http://127.0.0.1:{line.rsplit(' ', 1)[1]}"
+
+
+def mock_call(base_url: str, path: str, method: str = "GET") -> dict:
+    request = urllib.request.Request(base_url + path, data=b"{}" if method == "POST" else None, method=method)
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.loads(response.read())
+
+
+def configure(base_url: str, workdir: str, backend: str):
+    """Point every client, cache and log at the stand-in and ``workdir``.
+
+    Must run before the ``modules`` package is imported: settings are read at
+    import time.
+    """
+    env = {
+        "OPENAI_BASE_URL": base_url + "/v1",
+        "OPENAI_API_KEYS": "mock-key-1,mock-key-2",
+        "OPENAI_BACKOFF_BASE": "0.1",
+        "OPENAI_BACKOFF_MAX": "1",
+        "RETRIEVAL_BACKEND": backend,
+        "PINECONE_API_KEY": "mock",
+        "PINECONE_HOST": base_url,
+        "LLM_CACHE_PATH": os.path.join(workdir, "llm_cache.sqlite"),
+        "EMBED_CACHE_PATH": os.path.join(workdir, "embeddings.sqlite"),
+        "RETRIEVAL_INDEX_DIR": os.path.join(workdir, "index"),
+        "AUDIT_LOG_PATH": os.path.join(workdir, "audit_log.jsonl"),
+        "TELEMETRY_TRACE_PATH": os.path.join(workdir, "traces.jsonl"),
+        "TELEMETRY_METRICS_PATH": os.path.join(workdir, "metrics.prom"),
+        "PDF_CACHE_DIR": os.path.join(workdir, "pdf_cache"),
+        "SECTION_CACHE_PATH": os.path.join(workdir, "sections.sqlite"),
+        "INQUIRY_INDEX_PATH": os.path.join(workdir, "inquiries.sqlite"),
+        "KNOWLEDGE_DB_PATH": os.path.join(workdir, "knowledge.sqlite"),
+        "PLAN_CACHE_PATH": os.path.join(workdir, "plans.sqlite"),
+        "INFLIGHT_PATH": os.path.join(workdir, "inflight.sqlite"),
+        "SUMMARY_CACHE_PATH": os.path.join(workdir, "summaries.sqlite"),
+        "ENABLE_POLISH": "false",
+    }
+    os.environ.update(env)
+    os.chdir(ROOT)  # templates are resolved relative to the repo
+    sys.path.insert(0, ROOT)
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    pos = (len(ordered) - 1) * q
+    low = int(pos)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+def peak_rss_mb() -> dict:
+    scale = 1024 * 1024 if platform.system() == "Darwin" else 1024  # ru_maxrss: bytes on macOS, KiB on Linux
+    return {
+        "main": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+        "largest_child": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1),
+    }
+
+
+def run(args, workdir: str, base_url: str) -> dict:
+    from modules import composer, orchestrator, synthesizer, telemetry
+
+    synthesizer.DRAFT_DIR = Path(workdir) / "drafts"
+    timings: dict[str, list[float]] = {}
+    tokens = {"prompt_tokens": 0, "completion_tokens": 0, "retries": 0, "cache_hit": 0}
+
+    def record(stage: str, seconds: float):
+        timings.setdefault(stage, []).append(seconds)
+
+    started = time.perf_counter()
+    for i in range(args.runs):
+        request = REQUESTS[0] if args.warm else REQUESTS[i % len(REQUESTS)] + ("" if i < len(REQUESTS) else f" #{i}")
+        run_started = time.perf_counter()
+        results, trace = {}, None
+        for event in orchestrator.iter_research(request, {}):
+            if event["type"] == "done":
+                results, trace = event["results"], event["trace"]
+        record("research", time.perf_counter() - run_started)
+
+        with telemetry.activate(trace):
+            t = time.perf_counter()
+            report_md = synthesizer.synthesize(project_name=request, user_prompt=request, data=results, artifacts={})
+            record("synthesize", time.perf_counter() - t)
+            t = time.perf_counter()
+            composer.make_pdf(report_md)
+            record("make_pdf", time.perf_counter() - t)
+        record("total", time.perf_counter() - run_started)
+
+        for row in trace.waterfall():
+            record(f"span:{row['span']}", row["duration_ms"] / 1000)
+        for key, value in trace.totals().items():
+            tokens[key] = tokens.get(key, 0) + value
+        print(f"run {i + 1}/{args.runs}: {timings['total'][-1]:.2f}s", flush=True)
+    elapsed = time.perf_counter() - started
+
+    composer.shutdown()  # so render worker RSS shows up under RUSAGE_CHILDREN
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {k: getattr(args, k) for k in
+                   ("runs", "latency", "jitter", "rate_429", "words", "tool_rate", "backend", "warm", "seed")},
+        "runs_per_minute": round(args.runs / elapsed * 60, 2),
+        "stages": {
+            stage: {"n": len(values), "p50": round(percentile(values, 0.5), 4), "p95": round(percentile(values, 0.95), 4)}
+            for stage, values in sorted(timings.items())
+        },
+        "peak_rss_mb": peak_rss_mb(),
+        "api_calls": mock_call(base_url, "/_stats"),
+        "tokens": tokens,
+    }
+
+
+def print_report(report: dict):
+    print(f"\nruns/minute      : {report['runs_per_minute']:.2f}")
+    print(f"peak RSS         : {report['peak_rss_mb']['main']:.1f} MiB main, "
+          f"{report['peak_rss_mb']['largest_child']:.1f} MiB largest child")
+    print("\nstage                                  n     p50 (s)   p95 (s)")
+    for stage, row in report["stages"].items():
+        print(f"{stage:<36} {row['n']:>4}  {row['p50']:>9.3f} {row['p95']:>9.3f}")
+    print("\nAPI calls        : " + ", ".join(f"{k}={v}" for k, v in sorted(report["api_calls"].items())))
+    print("tokens           : " + ", ".join(f"{k}={v}" for k, v in report["tokens"].items()))
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Print deltas against ``baseline`` and return the regressions found."""
+    regressions = []
+    print(f"\ncompared with baseline from {baseline.get('created', '?')}:")
+    old, new = baseline["runs_per_minute"], report["runs_per_minute"]
+    change = (new - old) / old if old else 0.0
+    print(f"  runs/minute {old:>8.2f} -> {new:>8.2f} ({change:+.1%})")
+    if change < -tolerance:
+        regressions.append("runs/minute")
+    for stage in KEY_STAGES:
+        if stage not in baseline["stages"] or stage not in report["stages"]:
+            continue
+        old, new = baseline["stages"][stage]["p95"], report["stages"][stage]["p95"]
+        change = (new - old) / old if old else 0.0
+        print(f"  {stage + ' p95':<12}{old:>8.3f} -> {new:>8.3f} ({change:+.1%})")
+        if change > tolerance:
+            regressions.append(f"{stage} p95")
+    old, new = baseline["peak_rss_mb"]["main"], report["peak_rss_mb"]["main"]
+    change = (new - old) / old if old else 0.0
+    print(f"  {'peak RSS':<12}{old:>8.1f} -> {new:>8.1f} ({change:+.1%})")
+    if change > tolerance:
+        regressions.append("peak RSS")
+    for name in sorted(set(baseline["api_calls"]) | set(report["api_calls"])):
+        old, new = baseline["api_calls"].get(name, 0), report["api_calls"].get(name, 0)
+        if old != new:
+            print(f"  {name:<12}{old:>8} -> {new:>8} calls")
+    if baseline.get("config") != report["config"]:
+        print("  note: benchmark settings differ from the baseline's")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.2, help="mock seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="share of mock requests answered with 429")
+    parser.add_argument("--words", type=int, default=120, help="words per mock chat answer")
+    parser.add_argument("--tool-rate", type=float, default=0.3, help="share of first turns that call tools")
+    parser.add_argument("--backend", choices=("local", "pinecone"), default="local")
+    parser.add_argument("--warm", action="store_true", help="repeat one request so caches are exercised")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", metavar="NAME", help="store the report as a baseline")
+    parser.add_argument("--compare", metavar="NAME", help="compare against a stored baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    mock, base_url = start_mock(args)
+    try:
+        with tempfile.TemporaryDirectory(prefix="pilot-bench-") as workdir:
+            configure(base_url, workdir, args.backend)
+            report = run(args, workdir, base_url)
+    finally:
+        mock.terminate()
+        mock.wait()
+
+    print(json.dumps(report, indent=2) if args.json else "", end="")
+    print_report(report)
+    if args.save:
+        BASELINE_DIR.mkdir(parents=True, exist_ok=True)
+        path = BASELINE_DIR / f"{args.save}.json"
+        path.write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+        print(f"\nbaseline saved to {os.path.relpath(path, ROOT)}")
+    if args.compare:
+        baseline = json.loads((BASELINE_DIR / f"{args.compare}.json").read_text(encoding="utf-8"))
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print("Regressions beyond tolerance: " + ", ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
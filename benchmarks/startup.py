@@ -0,0 +1,74 @@
+"""
+Startup benchmark for the Streamlit app.
+
+Measures
+  * cold import time of the modules ``app.py`` loads, in a fresh interpreter;
+  * cold first run and warm rerun latency of ``app.py`` via Streamlit's AppTest.
+
+Usage:  python benchmarks/startup.py [--reruns 20] [--budget-ms 600]
+Exits non-zero when the cold import time exceeds ``--budget-ms``.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COLD_IMPORT = (
+    "import time; t = time.perf_counter(); "
+    "import streamlit; from modules import jobs; "
+    "print(time.perf_counter() - t)"
+)
+
+
+def cold_import_seconds(repeats: int = 3) -> float:
+    runs = []
+    for _ in range(repeats):
+        out = subprocess.run(
+            [sys.executable, "-c", COLD_IMPORT], cwd=ROOT, capture_output=True, text=True, check=True
+        )
+        runs.append(float(out.stdout.strip().splitlines()[-1]))
+    return min(runs)
+
+
+def rerun_seconds(reruns: int) -> tuple[float, list[float]]:
+    from streamlit.testing.v1 import AppTest
+
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault("JOB_WORKERS", "0")  # time the page itself, not worker start-up
+    app = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=60)
+    started = time.perf_counter()
+    app.run()
+    cold = time.perf_counter() - started
+    warm = []
+    for _ in range(reruns):
+        started = time.perf_counter()
+        app.run()
+        warm.append(time.perf_counter() - started)
+    return cold, warm
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reruns", type=int, default=20)
+    parser.add_argument("--budget-ms", type=float, default=600.0, help="cold import budget")
+    args = parser.parse_args()
+
+    cold_import = cold_import_seconds()
+    cold_run, warm = rerun_seconds(args.reruns)
+    print(f"cold import      : {cold_import * 1000:8.1f} ms (budget {args.budget_ms:.0f} ms)")
+    print(f"cold first run   : {cold_run * 1000:8.1f} ms")
+    print(f"warm rerun p50   : {statistics.median(warm) * 1000:8.1f} ms")
+    print(f"warm rerun max   : {max(warm) * 1000:8.1f} ms")
+    if cold_import * 1000 > args.budget_ms:
+        print("Import-time budget exceeded.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
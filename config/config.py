@@ -8,6 +8,6 @@ ENABLE_POLISH = "true"
 
 # Optional Pinecone credentials used if not provided via Streamlit secrets.
 PINECONE_API_KEY = ""
-PINECONE_ENV = ""
 PINECONE_INDEX = ""
+PINECONE_HOST = ""  # optional index host URL; skips the index lookup
 
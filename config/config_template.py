@@ -5,5 +5,107 @@ OPENAI_API_KEYS = []
 
 # Optional Pinecone credentials if secrets/environment are not set.
 PINECONE_API_KEY = ""
-PINECONE_ENV = ""
 PINECONE_INDEX = ""
+PINECONE_HOST = ""  # optional index host URL; skips the index lookup
+
+# Persistent LLM response cache (stored under vault/). Environment variables of
+# the same name take precedence.
+LLM_CACHE_ENABLED = "true"
+LLM_CACHE_TTL = 7 * 24 * 3600  # seconds
+LLM_CACHE_MAX_ENTRIES = 5000
+
+# OpenAI client tuning: concurrent in-flight requests per API key and request timeout.
+OPENAI_MAX_CONCURRENCY_PER_KEY = 4
+OPENAI_TIMEOUT = 120
+
+# Key scheduler: fallback per-key limits until response headers report the real
+# ones, retry/backoff policy and how long a repeatedly failing key is benched.
+OPENAI_DEFAULT_RPM = 500
+OPENAI_DEFAULT_TPM = 40000
+OPENAI_MAX_RETRIES = 4
+OPENAI_KEY_COOLDOWN = 60  # seconds
+
+# Retrieval backend for semantic_search: "local" (vault/index) or "pinecone".
+RETRIEVAL_BACKEND = "local"
+RETRIEVAL_MODE = "exact"  # or "ivf" for approximate search on large indexes
+
+# Embedding cache (vault/embeddings.sqlite) and request batching window.
+EMBED_CACHE_MAX_ENTRIES = 50000
+EMBED_CACHE_DTYPE = "float16"
+EMBED_BATCH_WINDOW = 0.02  # seconds
+
+# PDF rendering service: warm worker processes, queue bound and cache size.
+PDF_RENDER_WORKERS = 2
+PDF_RENDER_QUEUE = 8
+PDF_CACHE_MAX_FILES = 200
+
+# Tool-call audit log (vault/audit_log.jsonl): rotation thresholds and compression.
+AUDIT_LOG_MAX_BYTES = 10 * 1024 * 1024
+AUDIT_LOG_MAX_AGE = 24 * 3600  # seconds
+AUDIT_LOG_COMPRESS = "true"
+
+# Tracing: spans go to vault/traces.jsonl, metrics to vault/metrics.prom.
+# Set TELEMETRY_PORT to also serve Prometheus metrics on 127.0.0.1:<port>/metrics.
+TELEMETRY_PORT = 0
+
+# Research job queue (vault/jobs.sqlite). The app starts JOB_WORKERS worker processes;
+# set it to 0 when workers run separately via `python -m modules.jobs --workers N`.
+JOB_WORKERS = 2
+JOB_REUSE_TTL = 3600  # seconds a finished run is shared with identical requests
+JOB_STALE_AFTER = 120  # seconds without a heartbeat before a running job is requeued
+
+# Conversation history per research domain: token budget before older turns are
+# folded into a background summary, and tokens kept free for each completion.
+CONVERSATION_HISTORY_TOKENS = 1500
+LLM_COMPLETION_RESERVE = 1024
+
+# Answered inquiries (vault/inquiries.sqlite) are reused for identical or closely
+# matching prompts; research stops once a round adds nothing new.
+INQUIRY_SIMILARITY = 0.92
+INQUIRY_REUSE_TTL = 7 * 24 * 3600  # seconds
+RESEARCH_MAX_ROUNDS = 3
+RESEARCH_NOVELTY_THRESHOLD = 0.95
+
+# Domain answers persist in vault/knowledge.sqlite, keyed by domain and inquiry,
+# and are reused while younger than KNOWLEDGE_MAX_AGE or the strictest
+# KNOWLEDGE_FRESHNESS entry whose keyword occurs in the domain name. Recently used
+# entries are cached in memory up to KNOWLEDGE_MEMORY_ENTRIES / _BYTES.
+KNOWLEDGE_DB_PATH = "vault/knowledge.sqlite"
+KNOWLEDGE_MAX_AGE = 30 * 24 * 3600  # seconds
+KNOWLEDGE_FRESHNESS = {"regulations": 7 * 24 * 3600, "standards": 14 * 24 * 3600}
+KNOWLEDGE_MAX_ENTRIES = 50000
+KNOWLEDGE_MEMORY_ENTRIES = 256
+KNOWLEDGE_MEMORY_BYTES = 8 * 1024 * 1024
+
+# Planning: topics, domains and inquiry templates live in config/domains.json
+# (or a YAML file with PyYAML installed). Requests matching no topic are split
+# by the LLM (cached in vault/plans.sqlite) unless the fallback is disabled.
+DOMAIN_REGISTRY_PATH = "config/domains.json"
+PLANNER_MAX_DOMAINS = 8
+PLANNER_LLM_FALLBACK = "true"
+
+# Identical LLM requests in flight at the same time share one call: within a
+# process always, across processes through vault/inflight.sqlite and the response
+# cache. Followers wait at most INFLIGHT_MAX_WAIT seconds for another process.
+LLM_COALESCE_ENABLED = "true"
+INFLIGHT_MAX_WAIT = 300
+
+# Tool calls requested in one model turn run concurrently on a thread pool.
+# Each call is bounded by TOOL_TIMEOUT (override per tool, e.g.
+# TOOL_TIMEOUT_SEMANTIC_SEARCH); after MAX_TOOL_ROUNDS the model must answer.
+TOOL_TIMEOUT = 30
+TOOL_WORKERS = 8
+MAX_TOOL_ROUNDS = 4
+
+# Summaries: texts up to SUMMARY_LOCAL_MAX_WORDS are summarized locally
+# (extractive, no network) unless the extract covers the text worse than
+# SUMMARY_MIN_QUALITY; the rest go to the LLM and are cached in vault/summaries.sqlite.
+SUMMARY_LOCAL_MAX_WORDS = 1500
+SUMMARY_MIN_QUALITY = 0.5
+
+# Headless batches (python -m modules.batch requests.jsonl): reports go to
+# BATCH_OUTPUT_DIR/<request hash>/, BATCH_CONCURRENCY requests run at a time.
+# LLM_PRICES overrides the USD per 1K (prompt, completion) token prices used
+# for cost estimates, e.g. {"gpt-4": (0.03, 0.06)}.
+BATCH_OUTPUT_DIR = "vault/batch"
+BATCH_CONCURRENCY = 4
@@ -9,6 +9,7 @@ __all__ = [
     "synthesizer",
     "composer",
     "tools",
+    "polish",  # polishing helper
 ]
 
 import importlib
@@ -17,5 +18,3 @@ def __getattr__(name):
     if name in __all__:
         return importlib.import_module(f"{__name__}.{name}")
     raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
-
-from . import polish  # expose polishing helper
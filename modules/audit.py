@@ -0,0 +1,213 @@
+"""
+audit.py – non-blocking, batched audit log for tool calls.
+
+``record()`` only enqueues; a background writer thread drains the queue and
+appends records in batches, flushing when a batch fills up or the flush
+interval elapses.  Each batch is written with one ``O_APPEND`` write while
+holding an ``flock``, so lines from concurrent processes never interleave.
+The active file is rotated by size or age into timestamped files, optionally
+gzip-compressed.  ``iter_records()`` streams records back, filtered by tool,
+time range or session, without loading whole files into memory.
+"""
+
+import atexit
+import datetime
+import fcntl
+import gzip
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+from pathlib import Path
+
+from modules import settings
+
+LOG_PATH = Path(settings.get("AUDIT_LOG_PATH", "vault/audit_log.jsonl"))
+MAX_BYTES = settings.get_int("AUDIT_LOG_MAX_BYTES", 10 * 1024 * 1024)
+MAX_AGE = settings.get_float("AUDIT_LOG_MAX_AGE", 24 * 3600)  # seconds
+COMPRESS = settings.get_bool("AUDIT_LOG_COMPRESS", True)
+BATCH_SIZE = settings.get_int("AUDIT_LOG_BATCH_SIZE", 200)
+FLUSH_INTERVAL = settings.get_float("AUDIT_LOG_FLUSH_INTERVAL", 1.0)  # seconds
+
+
+def _parse_time(value):
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime.fromisoformat(str(value))
+
+
+class AuditLog:
+    """Append-only JSONL log written by a background thread."""
+
+    def __init__(self, path: Path = LOG_PATH, max_bytes: int = MAX_BYTES, max_age: float = MAX_AGE,
+                 compress: bool = COMPRESS, batch_size: int = BATCH_SIZE,
+                 flush_interval: float = FLUSH_INTERVAL):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.compress = compress
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=100_000)
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    # ---------------------------------------------------------------- #
+    # producer side
+    # ---------------------------------------------------------------- #
+    def record(self, entry: dict):
+        """Queue ``entry`` for writing; never blocks the caller."""
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout: float = 5.0):
+        """Block until everything recorded so far has been written."""
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    # ---------------------------------------------------------------- #
+    # writer thread
+    # ---------------------------------------------------------------- #
+    def _run(self):
+        while True:
+            batch, waiters = [], []
+            item = self._queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    break  # flush requested: write what we have now
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    print(f"Logging error: {e}")
+            for waiter in waiters:
+                waiter.set()
+
+    def _write(self, batch: list[dict]):
+        data = "".join(json.dumps(entry, default=str) + "\n" for entry in batch).encode("utf-8")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        while True:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                # another process may have rotated the file while we waited for the lock
+                try:
+                    current = os.stat(self.path).st_ino
+                except FileNotFoundError:
+                    current = None
+                if current != os.fstat(fd).st_ino:
+                    continue
+                if self._needs_rotation(fd, len(data)):
+                    self._rotate()
+                    continue
+                os.write(fd, data)
+                return
+            finally:
+                os.close(fd)
+
+    def _needs_rotation(self, fd: int, incoming: int) -> bool:
+        size = os.fstat(fd).st_size
+        if not size:
+            return False
+        if self.max_bytes and size + incoming > self.max_bytes:
+            return True
+        if self.max_age:
+            with open(self.path, encoding="utf-8") as f:
+                first = f.readline()
+            try:
+                started = _parse_time(json.loads(first).get("timestamp"))
+            except (ValueError, TypeError, AttributeError):
+                return False
+            if started and (datetime.datetime.now() - started).total_seconds() > self.max_age:
+                return True
+        return False
+
+    def _rotate(self):
+        """Move the active file aside (called with the lock held)."""
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        rotated = self.path.with_name(f"{self.path.stem}.{stamp}{self.path.suffix}")
+        os.replace(self.path, rotated)
+        if self.compress:
+            threading.Thread(target=_compress, args=(rotated,), daemon=True).start()
+
+
+def _compress(path: Path):
+    target = path.with_name(path.name + ".gz")
+    tmp = path.with_name(path.name + ".gz.tmp")
+    with open(path, "rb") as src, gzip.open(tmp, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.replace(tmp, target)
+    path.unlink(missing_ok=True)
+
+
+def _log_files(path: Path) -> list[Path]:
+    """Rotated files oldest first, then the active file."""
+    rotated = {}
+    for p in path.parent.glob(f"{path.stem}.*{path.suffix}*"):
+        if p.name.endswith(".tmp"):
+            continue
+        base = p.name[:-3] if p.name.endswith(".gz") else p.name
+        # prefer the plain file while its compressed copy is being written
+        if base not in rotated or not p.name.endswith(".gz"):
+            rotated[base] = p
+    files = [rotated[name] for name in sorted(rotated)]
+    if path.exists():
+        files.append(path)
+    return files
+
+
+def iter_records(tool: str | None = None, since=None, until=None, session: str | None = None,
+                 path: Path = LOG_PATH):
+    """Stream audit records matching the filters, oldest first."""
+    since, until = _parse_time(since), _parse_time(until)
+    for file in _log_files(Path(path)):
+        opener = gzip.open if file.name.endswith(".gz") else open
+        try:
+            with opener(file, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if tool and f'"{tool}"' not in line:
+                        continue  # cheap pre-filter before parsing
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if tool and entry.get("tool") != tool:
+                        continue
+                    if session and entry.get("session") != session:
+                        continue
+                    if since or until:
+                        ts = _parse_time(entry.get("timestamp"))
+                        if since and ts < since or until and ts > until:
+                            continue
+                    yield entry
+        except FileNotFoundError:
+            continue  # rotated/compressed underneath us
+
+
+_log = None
+_log_lock = threading.Lock()
+
+
+def get_log() -> AuditLog:
+    """Return the process-wide audit log."""
+    global _log
+    with _log_lock:
+        if _log is None:
+            _log = AuditLog()
+            atexit.register(_log.flush)
+    return _log
@@ -0,0 +1,187 @@
+"""
+batch.py – headless batch runs of many research requests.
+
+Reads project descriptions from a JSONL file (or stdin) and runs each through
+research -> synthesis -> PDF, writing every item to
+``<out>/<request hash>/`` (results.json, log.txt, report.md, report.pdf,
+trace.json and, last, status.json).  An item whose research had any failed
+query (outage, key problem) is marked ``failed`` and gets no report.  Items
+whose status.json says ``done`` are skipped, so an interrupted batch resumes
+where it stopped and failed items are retried; duplicate requests in the
+input run once.
+
+Up to ``--concurrency`` requests run at a time.  They share this process's
+router event loop and key pool, so the per-key limit
+(``OPENAI_MAX_CONCURRENCY_PER_KEY``) still bounds calls to the API.
+
+    python -m modules.batch requests.jsonl --out vault/batch --concurrency 4
+    cat requests.jsonl | python -m modules.batch -
+
+Each input line is a JSON object with a ``request`` field (``id`` optional), a
+JSON string, or plain text.
+"""
+
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from modules import jobs, settings, tokens
+
+BATCH_DIR = Path(settings.get("BATCH_OUTPUT_DIR", "vault/batch"))
+BATCH_CONCURRENCY = settings.get_int("BATCH_CONCURRENCY", 4)
+
+
+def read_requests(lines) -> list[dict]:
+    """Parse input lines into ``{"id", "request", "hash"}`` items, dropping duplicates."""
+    items, seen = [], set()
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError:
+            data = line
+        if isinstance(data, dict):
+            request, item_id = str(data.get("request") or "").strip(), data.get("id")
+        else:
+            request, item_id = str(data).strip(), None
+        if not request:
+            print(f"Line {number}: no request, skipped.", file=sys.stderr)
+            continue
+        digest = jobs.request_hash(request)
+        if digest in seen:
+            continue
+        seen.add(digest)
+        items.append({"id": str(item_id or number), "request": request, "hash": digest})
+    return items
+
+
+def item_dir(out: Path, item: dict) -> Path:
+    return out / item["hash"][:16]
+
+
+def load_status(out: Path, item: dict) -> dict | None:
+    try:
+        return json.loads((item_dir(out, item) / "status.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def run_item(item: dict, out: Path) -> dict:
+    """Research, synthesize and render one request; returns its status record."""
+    folder = item_dir(out, item)
+    folder.mkdir(parents=True, exist_ok=True)
+    started = time.perf_counter()
+    status = {"id": item["id"], "request": item["request"], "hash": item["hash"], "status": "failed"}
+    trace = None
+    with open(folder / "log.txt", "w", encoding="utf-8") as log_file:
+
+        def record(event):
+            nonlocal trace
+            if event["type"] == "log":
+                log_file.write(event["text"] + "\n")
+                log_file.flush()
+            elif event["type"] == "done":
+                trace = event["trace"]
+
+        try:
+            jobs.run_pipeline(item["request"], folder, f"batch-{item['hash'][:16]}", record)
+            status["status"] = "done"
+        except Exception as e:
+            status["error"] = f"{type(e).__name__}: {e}"
+            log_file.write(f"Failed: {status['error']}\n")
+    status["seconds"] = round(time.perf_counter() - started, 3)
+    usage = trace.usage_by_model() if trace is not None else {}
+    status["usage"] = usage
+    status["cost"] = round(sum(tokens.cost(model, u["prompt_tokens"], u["completion_tokens"])
+                               for model, u in usage.items()), 6)
+    if trace is not None:
+        status["totals"] = trace.totals()
+    jobs.write_atomic(folder / "status.json", json.dumps(status, indent=2).encode("utf-8"))
+    return status
+
+
+def _percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def summarize(statuses: list[dict], skipped: int, elapsed: float) -> str:
+    """Aggregate throughput, latency, token and cost figures of a batch."""
+    done = [s for s in statuses if s["status"] == "done"]
+    seconds = [s["seconds"] for s in statuses]
+    usage: dict[str, dict] = {}
+    for s in statuses:
+        for model, u in s.get("usage", {}).items():
+            total = usage.setdefault(model, {"prompt_tokens": 0, "completion_tokens": 0})
+            total["prompt_tokens"] += u["prompt_tokens"]
+            total["completion_tokens"] += u["completion_tokens"]
+    cost = sum(s.get("cost", 0.0) for s in statuses)
+    saved = sum(s.get("totals", {}).get("cache_hit", 0) + s.get("totals", {}).get("coalesced", 0) for s in statuses)
+    lines = [
+        f"items        : {len(done)} done, {len(statuses) - len(done)} failed, {skipped} skipped (already done)",
+        f"wall time    : {elapsed:.1f}s, {len(done) / elapsed * 60 if elapsed else 0:.2f} reports/min",
+        f"per request  : p50 {_percentile(seconds, 0.5):.1f}s, p95 {_percentile(seconds, 0.95):.1f}s",
+    ]
+    for model, u in sorted(usage.items()):
+        lines.append(f"{model:<13}: {u['prompt_tokens']} prompt + {u['completion_tokens']} completion tokens")
+    lines.append(f"calls saved  : {saved} (response cache and coalescing)")
+    lines.append(f"est. cost    : ${cost:.4f}" + (f" (${cost / len(done):.4f} per report)" if done else ""))
+    return "\n".join(lines)
+
+
+def run_batch(items: list[dict], out: Path = BATCH_DIR, concurrency: int = BATCH_CONCURRENCY,
+              resume: bool = True) -> tuple[list[dict], int, float]:
+    """Run ``items`` with at most ``concurrency`` in flight; returns (statuses, skipped, seconds)."""
+    out.mkdir(parents=True, exist_ok=True)
+    pending = [i for i in items if not (resume and (load_status(out, i) or {}).get("status") == "done")]
+    skipped = len(items) - len(pending)
+    statuses = []
+    started = time.perf_counter()
+    pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="batch")
+    try:
+        futures = {pool.submit(run_item, item, out): item for item in pending}
+        for future in as_completed(futures):
+            status = future.result()
+            statuses.append(status)
+            mark = "ok" if status["status"] == "done" else f"FAILED ({status.get('error')})"
+            print(f"[{len(statuses)}/{len(pending)}] {status['id']} {mark} in {status['seconds']:.1f}s", flush=True)
+    except KeyboardInterrupt:
+        print("Interrupted: finishing running items; rerun to resume.", file=sys.stderr)
+        pool.shutdown(wait=True, cancel_futures=True)
+        raise
+    finally:
+        pool.shutdown(wait=True)
+    return statuses, skipped, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run research requests from a JSONL file without the UI.")
+    parser.add_argument("input", nargs="?", default="-", help="JSONL file, or - for stdin")
+    parser.add_argument("--out", type=Path, default=BATCH_DIR, help="output directory")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--no-resume", action="store_true", help="rerun items that already finished")
+    args = parser.parse_args()
+
+    if args.input == "-":
+        items = read_requests(sys.stdin)
+    else:
+        with open(args.input, encoding="utf-8") as f:
+            items = read_requests(f)
+    from modules import composer, synthesizer
+
+    synthesizer.load_templates()
+    try:
+        statuses, skipped, elapsed = run_batch(items, args.out, args.concurrency, resume=not args.no_resume)
+    finally:
+        composer.shutdown()
+    print(summarize(statuses, skipped, elapsed))
+    sys.exit(1 if any(s["status"] != "done" for s in statuses) else 0)
+
+
+if __name__ == "__main__":
+    main()
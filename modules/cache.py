@@ -0,0 +1,150 @@
+"""
+cache.py – persistent, content-addressed cache for LLM responses.
+
+Entries live in a SQLite database under ``vault/`` so they are shared by every
+Streamlit session and worker process on the host.  Keys are the SHA256 of the
+request payload (model, messages, tools, tool choice, temperature); entries expire after
+a TTL and the least recently used ones are evicted once the entry or byte budget
+is exceeded.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from modules import db, settings
+
+CACHE_PATH = settings.get("LLM_CACHE_PATH", "vault/llm_cache.sqlite")
+CACHE_TTL = settings.get_float("LLM_CACHE_TTL", 7 * 24 * 3600)  # seconds
+CACHE_MAX_ENTRIES = settings.get_int("LLM_CACHE_MAX_ENTRIES", 5000)
+CACHE_MAX_BYTES = settings.get_int("LLM_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+CACHE_ENABLED = settings.get_bool("LLM_CACHE_ENABLED", True)
+
+
+def make_key(model: str, messages: list, tools=None, temperature=None, tool_choice=None) -> str:
+    """Return the content address of a chat completion request."""
+    payload = json.dumps(
+        {"model": model, "messages": messages, "tools": tools, "tool_choice": tool_choice,
+         "temperature": temperature},
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """SQLite-backed TTL + LRU cache that is safe for concurrent processes."""
+
+    def __init__(self, path: str = CACHE_PATH, ttl: float = CACHE_TTL,
+                 max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = db.ThreadConnections(path)
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                " created REAL NOT NULL, accessed REAL NOT NULL, size INTEGER NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed)")
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key: str, max_age: float | None = None):
+        """Return the cached value for ``key`` or ``None``.
+
+        ``max_age`` (seconds) tightens the TTL for this lookup only, e.g. to a
+        research domain's freshness policy.
+        """
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self._count(False)
+            return None
+        value, created = row
+        if self.ttl and now - created > self.ttl:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._count(False)
+            return None
+        if max_age is not None and now - created > max_age:
+            self._count(False)
+            return None
+        conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+        self._count(True)
+        return json.loads(value)
+
+    def put(self, key: str, value):
+        """Store ``value`` (JSON serialisable) and evict entries over budget."""
+        data = json.dumps(value)
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, created, accessed, size) VALUES (?, ?, ?, ?, ?)",
+                (key, data, now, now, len(data)),
+            )
+            self._evict(conn, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        if self.ttl:
+            conn.execute("DELETE FROM entries WHERE created < ?", (now - self.ttl,))
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        excess = max(0, count - self.max_entries)
+        if excess:
+            conn.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY accessed LIMIT ?)",
+                (excess,),
+            )
+            count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        if total > self.max_bytes:
+            freed = 0
+            victims = []
+            for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed"):
+                victims.append((key,))
+                freed += size
+                if total - freed <= self.max_bytes:
+                    break
+            conn.executemany("DELETE FROM entries WHERE key = ?", victims)
+
+    def clear(self):
+        self._conn().execute("DELETE FROM entries")
+
+    def stats(self) -> dict:
+        count, total = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": count, "bytes": total}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the process-wide response cache, or ``None`` when disabled."""
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+    return _cache
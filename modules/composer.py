@@ -1,45 +1,294 @@
 from markdown2 import markdown
+import functools
+import hashlib
+import multiprocessing
+import os
+import re
+import threading
 import unicodedata
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
 
-try:
-    from weasyprint import HTML, CSS
-    _WEASYPRINT_AVAILABLE = True
-except Exception:  # missing system deps like libpango
-    from fpdf import FPDF
-    _WEASYPRINT_AVAILABLE = False
+from modules import settings, telemetry
+
+RENDER_WORKERS = settings.get_int("PDF_RENDER_WORKERS", 2)
+RENDER_QUEUE = settings.get_int("PDF_RENDER_QUEUE", 8)  # max renders queued or running
+PDF_CACHE_DIR = Path(settings.get("PDF_CACHE_DIR", "vault/pdf_cache"))
+PDF_CACHE_MAX_FILES = settings.get_int("PDF_CACHE_MAX_FILES", 200)
 
-STYLE = None
-if _WEASYPRINT_AVAILABLE:
-    STYLE = CSS(string="""
+STYLE_CSS = """
 h1 { text-align:center; }
 h2 { page-break-before:always; }
 li { margin-bottom:4px; }
-""")
+"""
+
+# WeasyPrint is imported (and the stylesheet compiled) on first use: it pulls in
+# pango/cairo bindings that are too slow to load on every Streamlit rerun.
+_weasy = None  # (HTML, stylesheet) once loaded, False if unavailable
+_weasy_lock = threading.Lock()
+
+
+def _load_weasyprint():
+    global _weasy
+    with _weasy_lock:
+        if _weasy is None:
+            try:
+                from weasyprint import HTML, CSS
+                _weasy = (HTML, CSS(string=STYLE_CSS))
+            except Exception:  # missing system deps like libpango
+                _weasy = False
+    return _weasy
+
+
+def weasyprint_available() -> bool:
+    return bool(_load_weasyprint())
+
+
+def _make_pdf_weasy(html: str, target=None):
+    """Generate a PDF using WeasyPrint if available (written to ``target`` when given)."""
+    HTML, style = _load_weasyprint()
+    return HTML(string=html).write_pdf(target, stylesheets=[style])
+
+
+# --------------------------------------------------------------------- #
+# FPDF fallback: streamed markdown blocks, core fonts only
+# --------------------------------------------------------------------- #
+NORMALIZE_BATCH = 256  # lines normalized per call
+HEADING_SIZES = {1: 18, 2: 15, 3: 13}
+# Typography outside latin-1 that the core fonts' cp1252 encoding still has
+_LATIN1 = str.maketrans({
+    "\u2018": "\x91", "\u2019": "\x92", "\u201c": "\x93", "\u201d": "\x94", "\u2022": "\x95",
+    "\u2013": "\x96", "\u2014": "\x97", "\u2026": "\x85", "\u20ac": "\x80", "\u00a0": " ", "\t": "    ",
+})
+_INLINE = [
+    (re.compile(r"!\[([^\]]*)\]\([^)]*\)"), r"[\1]"),  # images -> alt text
+    (re.compile(r"\[([^\]]+)\]\([^)]*\)"), r"\1"),  # links -> link text
+    (re.compile(r"(\*\*|__|`)"), ""),  # bold / code markers
+]
+_LIST_ITEM = re.compile(r"^(\s*)([-*+\x95]|\d+[.)])\s+(.*)$")
+
 
-def _make_pdf_weasy(html: str) -> bytes:
-    """Generate a PDF using WeasyPrint if available."""
-    return HTML(string=html).write_pdf(stylesheets=[STYLE])
+def _latin1_lines(markdown_text: str):
+    """Yield the draft's lines as latin-1 safe text, normalized in batches."""
+    lines = iter(markdown_text.splitlines())
+    while True:
+        batch = [line for _, line in zip(range(NORMALIZE_BATCH), lines)]
+        if not batch:
+            return
+        text = unicodedata.normalize("NFKC", "\n".join(batch)).translate(_LATIN1)
+        yield from text.encode("latin-1", "replace").decode("latin-1").split("\n")
 
 
-def _make_pdf_fpdf(markdown_text: str) -> bytes:
-    """Simplistic fallback PDF generator using FPDF."""
+def _inline(text: str) -> str:
+    for pattern, repl in _INLINE:
+        text = pattern.sub(repl, text)
+    return text
+
+
+def _blocks(lines):
+    """Parse lines into ``(kind, level, text)`` blocks: heading, item, code, rule, text, blank."""
+    fenced = False
+    for line in lines:
+        if line.lstrip().startswith("```"):
+            fenced = not fenced
+            continue
+        if fenced:
+            yield "code", 0, line
+        elif not line.strip():
+            yield "blank", 0, ""
+        elif re.match(r"#{1,6}\s", line):
+            marks, _, title = line.partition(" ")
+            yield "heading", len(marks), _inline(title.strip().rstrip("#").strip())
+        elif re.match(r"\s*([-*_])(\s*\1){2,}\s*$", line):
+            yield "rule", 0, ""
+        elif _LIST_ITEM.match(line):
+            indent, marker, text = _LIST_ITEM.match(line).groups()
+            bullet = marker if marker[0].isdigit() else "\x95"
+            yield "item", len(indent.expandtabs(4)) // 2, f"{bullet} {_inline(text)}"
+        elif line.startswith("    "):
+            yield "code", 0, line[4:]
+        else:
+            yield "text", 0, _inline(line.strip())
+
+
+def _make_pdf_fpdf(markdown_text: str, target=None):
+    """Fallback PDF generator using FPDF's core fonts.
+
+    Blocks are parsed lazily and laid out as they arrive (headings, lists,
+    code, rules), so no HTML or second copy of the draft is built.  Written to
+    ``target`` when given, otherwise returned as bytes.
+    """
+    from fpdf import FPDF
+
     pdf = FPDF()
-    pdf.add_page()
     pdf.set_auto_page_break(auto=True, margin=15)
-    pdf.set_font("Arial", size=12)
-    for line in markdown_text.splitlines():
-        safe_line = (
-            unicodedata.normalize("NFKD", line)
-            .encode("latin-1", "replace")
-            .decode("latin-1")
-        )
-        pdf.multi_cell(0, 10, safe_line)
+    pdf.add_page()
+    width = pdf.w - pdf.l_margin - pdf.r_margin
+    for kind, level, text in _blocks(_latin1_lines(markdown_text)):
+        if kind == "heading":
+            size = HEADING_SIZES.get(level, 12)
+            pdf.ln(2)
+            pdf.set_font("Arial", "B", size)
+            pdf.multi_cell(0, size * 0.5, text)
+            pdf.ln(1)
+        elif kind == "item":
+            pdf.set_font("Arial", "", 12)
+            indent = min(5 * (level + 1), width / 2)
+            pdf.set_x(pdf.l_margin + indent)
+            pdf.multi_cell(width - indent, 6, text)
+        elif kind == "code":
+            pdf.set_font("Courier", "", 10)
+            pdf.set_fill_color(240, 240, 240)
+            pdf.multi_cell(0, 5, text, fill=True)
+        elif kind == "rule":
+            y = pdf.get_y() + 2
+            pdf.line(pdf.l_margin, y, pdf.w - pdf.r_margin, y)
+            pdf.ln(4)
+        elif kind == "blank":
+            pdf.ln(3)
+        else:
+            pdf.set_font("Arial", "", 12)
+            pdf.multi_cell(0, 6, text)
+    if target is not None:
+        pdf.output(str(target), "F")
+        return None
     return pdf.output(dest="S").encode("latin-1")
 
 
-def make_pdf(markdown_text: str) -> bytes:
-    """Convert markdown text to PDF using WeasyPrint or FPDF."""
-    html = markdown(markdown_text)
-    if _WEASYPRINT_AVAILABLE:
-        return _make_pdf_weasy(html)
-    return _make_pdf_fpdf(markdown_text)
+def _fragments(markdown_text: str) -> list[str]:
+    """Split a draft before each markdown heading (outside code fences)."""
+    fragments, current, fenced = [], [], False
+    for line in markdown_text.splitlines(keepends=True):
+        if line.lstrip().startswith("```"):
+            fenced = not fenced
+        elif current and not fenced and re.match(r"#{1,6}\s", line):
+            fragments.append("".join(current))
+            current = []
+        current.append(line)
+    if current:
+        fragments.append("".join(current))
+    return fragments
+
+
+@functools.lru_cache(maxsize=512)
+def _fragment_html(fragment: str) -> str:
+    return markdown(fragment)
+
+
+def to_html(markdown_text: str) -> str:
+    """HTML for a draft; fragments unchanged since an earlier render are reused."""
+    return "".join(_fragment_html(fragment) for fragment in _fragments(markdown_text))
+
+
+def render_pdf(markdown_text: str, target=None):
+    """Convert markdown text to PDF using WeasyPrint or FPDF (runs in the caller).
+
+    With ``target`` (a path) the PDF is written there and ``None`` returned.
+    """
+    if weasyprint_available():
+        return _make_pdf_weasy(to_html(markdown_text), target)
+    return _make_pdf_fpdf(markdown_text, target)  # the fallback never needs HTML
+
+
+# --------------------------------------------------------------------- #
+# Rendering service: warm worker processes + content-addressed cache
+# --------------------------------------------------------------------- #
+_pool = None
+_pool_lock = threading.Lock()
+_queue_slots = threading.BoundedSemaphore(RENDER_QUEUE)
+_inflight: dict = {}  # sha256 -> Future, so identical concurrent renders share one job
+
+
+def _warm_worker():
+    """Pool initializer: load WeasyPrint, the stylesheet and fonts up front."""
+    if weasyprint_available():
+        _make_pdf_weasy("<h1>warm-up</h1>")
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the Streamlit server process is multi-threaded
+            _pool = ProcessPoolExecutor(
+                max_workers=RENDER_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_warm_worker,
+            )
+    return _pool
+
+
+def shutdown():
+    """Stop the render workers, e.g. before a long-lived worker process exits."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+
+def content_hash(markdown_text: str) -> str:
+    """SHA256 of the draft – the same digest the synthesizer logs in drafts_log.txt."""
+    return hashlib.sha256(markdown_text.encode()).hexdigest()
+
+
+def _cache_path(digest: str) -> Path:
+    return PDF_CACHE_DIR / f"{digest}.pdf"
+
+
+def _cache_store(digest: str, tmp: Path):
+    """Move a rendered file into the cache and evict the oldest entries."""
+    os.replace(tmp, _cache_path(digest))
+    cached = sorted(PDF_CACHE_DIR.glob("*.pdf"), key=lambda p: p.stat().st_mtime)
+    for stale in cached[:max(0, len(cached) - PDF_CACHE_MAX_FILES)]:
+        stale.unlink(missing_ok=True)
+
+
+def _render_in_pool(markdown_text: str, target: Path):
+    """Render into ``target``; workers write the file so no PDF bytes cross the pipe."""
+    with _queue_slots:  # bounded queue: callers wait here when the pool is saturated
+        try:
+            _get_pool().submit(render_pdf, markdown_text, str(target)).result()
+        except BrokenProcessPool:
+            global _pool
+            with _pool_lock:
+                _pool = None
+            render_pdf(markdown_text, str(target))
+
+
+@telemetry.traced("composer.make_pdf")
+def make_pdf(markdown_text: str, digest: str | None = None) -> bytes:
+    """Return the PDF for ``markdown_text``, rendering it in the worker pool on a cache miss."""
+    digest = digest or content_hash(markdown_text)
+    path = _cache_path(digest)
+    try:
+        pdf = path.read_bytes()
+        os.utime(path)
+        telemetry.annotate(cache_hit=1)
+        return pdf
+    except FileNotFoundError:
+        telemetry.annotate(cache_hit=0)
+
+    with _pool_lock:
+        job = _inflight.get(digest)
+        owner = job is None
+        if owner:
+            job = _inflight[digest] = Future()
+    if not owner:
+        return job.result()
+    PDF_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = PDF_CACHE_DIR / f".{digest}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        _render_in_pool(markdown_text, tmp)
+        pdf = tmp.read_bytes()
+        _cache_store(digest, tmp)
+        job.set_result(pdf)
+        return pdf
+    except BaseException as e:
+        job.set_exception(e)
+        tmp.unlink(missing_ok=True)
+        raise
+    finally:
+        with _pool_lock:
+            _inflight.pop(digest, None)
@@ -0,0 +1,35 @@
+"""
+db.py – shared SQLite connection setup for the stores under ``vault/``.
+
+Every store (response cache, jobs, knowledge, inquiries, embeddings, in-flight
+claims) opens its file through ``ThreadConnections``: one connection per thread,
+in WAL mode so readers proceed while another process writes, in autocommit mode
+so callers manage transactions with explicit ``BEGIN IMMEDIATE``.
+"""
+
+import os
+import sqlite3
+import threading
+
+BUSY_TIMEOUT = 30  # seconds a statement waits for another writer's lock
+
+
+class ThreadConnections:
+    """Callable returning this thread's connection to the SQLite file at ``path``."""
+
+    def __init__(self, path: str, row_factory=None):
+        self.path = path
+        self.row_factory = row_factory
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def __call__(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None)
+            if self.row_factory is not None:
+                conn.row_factory = self.row_factory
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
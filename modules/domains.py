@@ -0,0 +1,153 @@
+"""
+domains.py – registry of research domains and their inquiry templates.
+
+Topics, their trigger keywords and the domains they expand to are data
+(``config/domains.json``, or YAML when PyYAML is installed), not code.  Trigger
+keywords are compiled into a token inverted index, so matching a request costs
+one dictionary lookup per request token however many topics are registered.
+Requests that match no topic can be decomposed by an LLM; those plans are
+cached per normalized request in ``vault/plans.sqlite``.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+
+from modules import cache, inquiries, settings
+
+REGISTRY_PATH = settings.get("DOMAIN_REGISTRY_PATH", "config/domains.json")
+PLAN_CACHE_PATH = settings.get("PLAN_CACHE_PATH", "vault/plans.sqlite")
+MAX_DOMAINS = settings.get_int("PLANNER_MAX_DOMAINS", 8)
+LLM_FALLBACK = settings.get_bool("PLANNER_LLM_FALLBACK", True)
+FALLBACK_MODEL = "gpt-3.5-turbo"
+DEFAULT_INQUIRY = "What are the key details about {domain}?"
+
+DECOMPOSE_PROMPT = (
+    "Split the following R&D request into 3 to {limit} distinct research domains that can be "
+    "investigated independently. Reply with a JSON array of short domain names only.\n\nRequest: {request}"
+)
+
+
+def tokens(text: str) -> list[str]:
+    """Lowercase word tokens with a plural "s" removed ("Drones" -> "drone")."""
+    return [
+        t[:-1] if len(t) > 3 and t.endswith("s") and not t.endswith("ss") else t
+        for t in re.findall(r"[a-z0-9]+", text.lower())
+    ]
+
+
+def load(path: str) -> dict:
+    """Parse a registry file (JSON, or YAML for ``.yml``/``.yaml``)."""
+    with open(path, encoding="utf-8") as f:
+        if path.endswith((".yml", ".yaml")):
+            try:
+                import yaml
+            except ModuleNotFoundError:
+                raise ModuleNotFoundError("PyYAML is required for a YAML domain registry.")
+            return yaml.safe_load(f) or {}
+        return json.load(f)
+
+
+class Registry:
+    """Topics -> domains -> inquiry templates, with a precompiled keyword index."""
+
+    def __init__(self, data: dict):
+        self.default_inquiry = data.get("default_inquiry", DEFAULT_INQUIRY)
+        self.fallback_domains = list(data.get("fallback_domains", ["General Research"]))
+        self.inquiries = {name.lower(): text for name, text in data.get("domains", {}).items()}
+        self.topics = [(t["name"], list(t["domains"])) for t in data.get("topics", [])]
+        # first token -> [(keyword tokens, topic id)]; longest phrases are tried first
+        self.index: dict[str, list[tuple[tuple, int]]] = {}
+        for topic_id, topic in enumerate(data.get("topics", [])):
+            for keyword in topic.get("keywords", []):
+                words = tuple(tokens(keyword))
+                if words:
+                    self.index.setdefault(words[0], []).append((words, topic_id))
+        for entries in self.index.values():
+            entries.sort(key=lambda entry: -len(entry[0]))
+
+    def match(self, request: str) -> list[str]:
+        """Domains of the topics whose keywords occur in ``request``, by first occurrence."""
+        words = tokens(request)
+        hits: dict[int, int] = {}  # topic id -> position of first hit
+        for pos, word in enumerate(words):
+            for phrase, topic_id in self.index.get(word, ()):
+                if tuple(words[pos:pos + len(phrase)]) == phrase:
+                    hits.setdefault(topic_id, pos)
+        domains = []
+        for topic_id in sorted(hits, key=hits.get):
+            for domain in self.topics[topic_id][1]:
+                if domain not in domains:
+                    domains.append(domain)
+        return domains[:MAX_DOMAINS]
+
+    def inquiry(self, domain: str, request: str = "") -> str:
+        template = self.inquiries.get(domain.lower(), self.default_inquiry)
+        return template.format(domain=domain, request=request or domain)
+
+
+_registry = None
+_registry_mtime = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> Registry:
+    """Return the registry, reloading it when the file has changed."""
+    global _registry, _registry_mtime
+    try:
+        mtime = os.stat(REGISTRY_PATH).st_mtime
+    except OSError:
+        mtime = None
+    with _registry_lock:
+        if _registry is None or mtime != _registry_mtime:
+            _registry = Registry(load(REGISTRY_PATH) if mtime is not None else {})
+            _registry_mtime = mtime
+    return _registry
+
+
+_plan_cache = None
+
+
+def _get_plan_cache() -> cache.ResponseCache:
+    global _plan_cache
+    if _plan_cache is None:
+        _plan_cache = cache.ResponseCache(path=PLAN_CACHE_PATH)
+    return _plan_cache
+
+
+def _parse_domains(text: str) -> list[str]:
+    match = re.search(r"\[.*\]", text or "", re.S)
+    if not match:
+        return []
+    try:
+        names = json.loads(match.group(0))
+    except ValueError:
+        return []
+    domains = []
+    for name in names:
+        name = str(name).strip()
+        if name and len(name) <= 60 and name not in domains:
+            domains.append(name)
+    return domains[:MAX_DOMAINS]
+
+
+def decompose(request: str) -> list[str]:
+    """LLM decomposition of an unmatched request, cached per normalized request."""
+    key = hashlib.sha256(f"{FALLBACK_MODEL}\0{inquiries.normalize(request)}".encode("utf-8")).hexdigest()
+    store = _get_plan_cache()
+    domains = store.get(key)
+    if domains is not None:
+        return domains
+    from modules import router  # late import: router imports tools, which pull in most modules
+
+    try:
+        prompt = DECOMPOSE_PROMPT.format(limit=MAX_DOMAINS, request=request)
+        domains = _parse_domains(router.complete([{"role": "user", "content": prompt}], FALLBACK_MODEL, temperature=0))
+    except Exception as e:
+        print(f"Domain decomposition skipped: {e}")
+        return []
+    if domains:
+        store.put(key, domains)
+    return domains
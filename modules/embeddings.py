@@ -0,0 +1,218 @@
+"""
+embeddings.py – cached and batched text embeddings.
+
+Vectors are cached on disk by (model, normalized text) as compact float16 (or
+float32) blobs with LRU eviction.  Cache misses from concurrent callers – e.g.
+tool calls issued by parallel ``ask_async`` tasks – are coalesced by a batcher
+into a single ``embeddings.create`` request per short time window.
+"""
+
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from concurrent.futures import Future
+
+import numpy as np
+
+from modules import db, keys, settings, telemetry
+
+EMBED_MODEL = settings.get("EMBED_MODEL", "text-embedding-ada-002")
+CACHE_PATH = settings.get("EMBED_CACHE_PATH", "vault/embeddings.sqlite")
+CACHE_MAX_ENTRIES = settings.get_int("EMBED_CACHE_MAX_ENTRIES", 50000)
+CACHE_DTYPE = np.dtype(settings.get("EMBED_CACHE_DTYPE", "float16"))
+BATCH_WINDOW = settings.get_float("EMBED_BATCH_WINDOW", 0.02)  # seconds
+BATCH_MAX = settings.get_int("EMBED_BATCH_MAX", 256)
+
+
+def normalize_text(text: str) -> str:
+    """Canonical form used for cache keys: NFKC, lower case, collapsed whitespace."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip().lower()
+
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+def _embed_remote(texts: list[str], model: str) -> np.ndarray:
+    """One embeddings.create call on a scheduler-chosen key from the shared pool.
+
+    Throttling and transient errors are retried with the scheduler's backoff,
+    like ``router.complete``, so one 429 does not fail the whole batch.
+    """
+    from modules import router  # late import: router imports tools, which imports us
+
+    api_keys = router._load_api_keys()
+    if not api_keys:
+        raise RuntimeError("No OpenAI API keys found for embeddings.")
+    scheduler = keys.get_scheduler(api_keys)
+    slot = scheduler.acquire()
+    try:
+        client = router.get_client(api_keys[slot])
+        delay = scheduler.wait_time(slot)
+        for attempt in range(keys.MAX_RETRIES + 1):
+            if delay:
+                time.sleep(delay)
+            try:
+                raw = client.embeddings.with_raw_response.create(input=texts, model=model)
+                break
+            except router._retryable() as e:
+                scheduler.record_failure(slot, router._retry_after(e))
+                if attempt == keys.MAX_RETRIES:
+                    raise
+                delay = max(keys.backoff_delay(attempt + 1, router._retry_after(e)), scheduler.wait_time(slot))
+        scheduler.record_headers(slot, raw.headers)
+        response = raw.parse()
+        scheduler.record_success(slot, getattr(getattr(response, "usage", None), "total_tokens", 0) or 0)
+    finally:
+        scheduler.release(slot)
+    return np.asarray([d.embedding for d in response.data], dtype=np.float32)
+
+
+class EmbeddingCache:
+    """SQLite store of embedding vectors with LRU eviction."""
+
+    def __init__(self, path: str = CACHE_PATH, max_entries: int = CACHE_MAX_ENTRIES,
+                 dtype=CACHE_DTYPE):
+        self.path = path
+        self.max_entries = max_entries
+        self.dtype = np.dtype(dtype)
+        self.hits = 0
+        self.misses = 0
+        self._conn = db.ThreadConnections(path)
+        self._puts = 0
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS vectors ("
+            " key TEXT PRIMARY KEY, dtype TEXT NOT NULL, vec BLOB NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn().execute("CREATE INDEX IF NOT EXISTS vectors_accessed ON vectors(accessed)")
+
+    def get_many(self, keys_: list[str]) -> dict:
+        """Return ``{key: float32 vector}`` for the keys present in the cache."""
+        if not keys_:
+            return {}
+        conn = self._conn()
+        found = {}
+        for start in range(0, len(keys_), 500):
+            chunk = keys_[start:start + 500]
+            marks = ",".join("?" * len(chunk))
+            for key, dtype, blob in conn.execute(
+                f"SELECT key, dtype, vec FROM vectors WHERE key IN ({marks})", chunk
+            ):
+                found[key] = np.frombuffer(blob, dtype=dtype).astype(np.float32)
+        if found:
+            conn.executemany(
+                "UPDATE vectors SET accessed = ? WHERE key = ?",
+                [(time.time(), k) for k in found],
+            )
+        self.hits += len(found)
+        self.misses += len(set(keys_)) - len(found)
+        return found
+
+    def put_many(self, items: dict):
+        now = time.time()
+        conn = self._conn()
+        conn.executemany(
+            "INSERT OR REPLACE INTO vectors (key, dtype, vec, accessed) VALUES (?, ?, ?, ?)",
+            [(k, self.dtype.str, np.asarray(v, dtype=self.dtype).tobytes(), now) for k, v in items.items()],
+        )
+        self._puts += len(items)
+        if self._puts >= 100:
+            self._puts = 0
+            self._evict()
+
+    def _evict(self):
+        conn = self._conn()
+        (count,) = conn.execute("SELECT COUNT(*) FROM vectors").fetchone()
+        if count > self.max_entries:
+            conn.execute(
+                "DELETE FROM vectors WHERE key IN (SELECT key FROM vectors ORDER BY accessed LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+
+class EmbeddingBatcher:
+    """Coalesce concurrent embedding requests into one API call per window."""
+
+    def __init__(self, model: str = EMBED_MODEL, window: float = BATCH_WINDOW, max_batch: int = BATCH_MAX):
+        self.model = model
+        self.window = window
+        self.max_batch = max_batch
+        self.calls = 0
+        self._pending: list[tuple[str, Future]] = []
+        self._cond = threading.Condition()
+        threading.Thread(target=self._run, name="embedding-batcher", daemon=True).start()
+
+    def submit(self, text: str) -> Future:
+        future = Future()
+        with self._cond:
+            self._pending.append((text, future))
+            self._cond.notify()
+        return future
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                deadline = time.monotonic() + self.window
+                while len(self._pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+            self._flush(batch)
+
+    def _flush(self, batch):
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            vectors = _embed_remote(texts, self.model)
+            self.calls += 1
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        by_text = dict(zip(texts, vectors))
+        for text, future in batch:
+            future.set_result(by_text[text])
+
+
+_cache = None
+_batcher = None
+_init_lock = threading.Lock()
+
+
+def _shared():
+    global _cache, _batcher
+    with _init_lock:
+        if _cache is None:
+            _cache = EmbeddingCache()
+            _batcher = EmbeddingBatcher()
+    return _cache, _batcher
+
+
+@telemetry.traced("embeddings.embed")
+def embed(texts: list[str], model: str = EMBED_MODEL) -> np.ndarray:
+    """Return float32 embeddings for ``texts``, using the cache and the batcher."""
+    cache, batcher = _shared()
+    text_keys = [cache_key(model, t) for t in texts]
+    found = cache.get_many(text_keys)
+    telemetry.annotate(embedding_cache_hits=len(found))
+    if model == batcher.model:
+        futures = {k: batcher.submit(t) for k, t in zip(text_keys, texts) if k not in found}
+        fresh = {k: f.result() for k, f in futures.items()}
+    else:
+        missing = {k: t for k, t in zip(text_keys, texts) if k not in found}
+        fresh = dict(zip(missing, _embed_remote(list(missing.values()), model))) if missing else {}
+    if fresh:
+        cache.put_many(fresh)
+        found.update(fresh)
+    return np.stack([found[k] for k in text_keys]) if texts else np.empty((0, 0), dtype=np.float32)
+
+
+def stats() -> dict:
+    cache, batcher = _shared()
+    return {"hits": cache.hits, "misses": cache.misses, "api_calls": batcher.calls}
@@ -0,0 +1,114 @@
+"""
+inflight.py – coalescing of identical in-flight LLM requests.
+
+Within a process, callers of an identical request share one ``Future``.
+Across processes on the host (Streamlit sessions and job workers), the first
+caller claims the request key in ``vault/inflight.sqlite``; the others wait
+for the leader's answer to land in the shared response cache instead of
+sending the same prompt again.  A claim whose process has died, or which is
+older than ``INFLIGHT_MAX_WAIT``, is taken over.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from modules import db, settings
+
+INFLIGHT_PATH = settings.get("INFLIGHT_PATH", "vault/inflight.sqlite")
+COALESCE_ENABLED = settings.get_bool("LLM_COALESCE_ENABLED", True)
+MAX_WAIT = settings.get_float("INFLIGHT_MAX_WAIT", 300.0)  # seconds a follower waits for another process
+POLL_INTERVAL = 0.1
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Coalescer:
+    """Shares one result between identical requests issued at the same time."""
+
+    def __init__(self, path: str = INFLIGHT_PATH):
+        self.path = path
+        self._calls: dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._conn = db.ThreadConnections(path)
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS inflight (key TEXT PRIMARY KEY, pid INTEGER NOT NULL, started REAL NOT NULL)"
+        )
+
+    # -- in-process ------------------------------------------------------ #
+    def join(self, key: str) -> tuple[bool, Future]:
+        """Return ``(leader, future)``; only the leader performs the request."""
+        with self._lock:
+            shared = self._calls.get(key)
+            if shared is not None:
+                return False, shared
+            shared = self._calls[key] = Future()
+            return True, shared
+
+    def done(self, key: str):
+        with self._lock:
+            self._calls.pop(key, None)
+
+    # -- across processes ------------------------------------------------ #
+    def claim(self, key: str) -> bool:
+        """Claim ``key`` for this process; False while a live process holds it."""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT pid, started FROM inflight WHERE key = ?", (key,)).fetchone()
+            if row and row[0] != os.getpid() and _alive(row[0]) and now - row[1] < MAX_WAIT:
+                conn.execute("COMMIT")
+                return False
+            conn.execute("INSERT OR REPLACE INTO inflight (key, pid, started) VALUES (?, ?, ?)",
+                         (key, os.getpid(), now))
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def release(self, key: str):
+        self._conn().execute("DELETE FROM inflight WHERE key = ? AND pid = ?", (key, os.getpid()))
+
+    def _held_elsewhere(self, key: str) -> bool:
+        row = self._conn().execute("SELECT pid, started FROM inflight WHERE key = ?", (key,)).fetchone()
+        return bool(row) and row[0] != os.getpid() and _alive(row[0]) and time.time() - row[1] < MAX_WAIT
+
+    async def await_remote(self, key: str, lookup):
+        """Poll ``lookup()`` until another process's result appears; None if that process gave up.
+
+        ``lookup()`` and the claim check hit SQLite, so both run in worker threads.
+        """
+        while True:
+            value = await asyncio.to_thread(lookup)
+            if value is not None:
+                return value
+            if not await asyncio.to_thread(self._held_elsewhere, key):
+                return await asyncio.to_thread(lookup)
+            await asyncio.sleep(POLL_INTERVAL)
+
+
+_coalescer = None
+_coalescer_lock = threading.Lock()
+
+
+def get_coalescer():
+    """Return the process-wide coalescer, or ``None`` when disabled."""
+    global _coalescer
+    if not COALESCE_ENABLED:
+        return None
+    with _coalescer_lock:
+        if _coalescer is None:
+            _coalescer = Coalescer()
+    return _coalescer
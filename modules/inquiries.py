@@ -0,0 +1,154 @@
+"""
+inquiries.py – reuse of previously answered research inquiries.
+
+Every answered inquiry is stored with its normalized text and embedding in
+``vault/inquiries.sqlite``.  ``lookup()`` first tries the normalized text (from
+any domain or an earlier run), so "Part 107" and "part 107" are answered from
+the stored result instead of another completion.  Cosine similarity over the
+stored embeddings then matches other phrasings, but only among inquiries of the
+same normalized domain: templated inquiries for "Part 107" and "Part 91"
+differ in one term and would otherwise look alike.  Entries older than
+``INQUIRY_REUSE_TTL`` are not reused.
+"""
+
+import re
+import threading
+import time
+import unicodedata
+
+import numpy as np
+
+from modules import db, embeddings, settings
+
+INDEX_PATH = settings.get("INQUIRY_INDEX_PATH", "vault/inquiries.sqlite")
+SIMILARITY_THRESHOLD = settings.get_float("INQUIRY_SIMILARITY", 0.92)
+REUSE_TTL = settings.get_float("INQUIRY_REUSE_TTL", 7 * 24 * 3600)  # seconds
+
+
+def normalize(text: str) -> str:
+    """Canonical inquiry text: case, punctuation and spacing are ignored ("Part107" == "part 107")."""
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = re.sub(r"(?<=[a-z])(?=\d)|(?<=\d)(?=[a-z])", " ", text)
+    return re.sub(r"[^\w§]+", " ", text).strip()
+
+
+def _unit(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def similarities(vector, vectors) -> np.ndarray:
+    """Cosine similarity of ``vector`` to each row of ``vectors``."""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    if not vectors.size:
+        return np.zeros(0, dtype=np.float32)
+    return _unit(vectors) @ _unit(np.asarray(vector, dtype=np.float32))
+
+
+class InquiryIndex:
+    """Answered inquiries, matched by normalized text or embedding similarity."""
+
+    def __init__(self, path: str = INDEX_PATH, threshold: float = SIMILARITY_THRESHOLD, ttl: float = REUSE_TTL):
+        self.path = path
+        self.threshold = threshold
+        self.ttl = ttl
+        self.hits = 0
+        self._conn = db.ThreadConnections(path)
+        self._lock = threading.Lock()
+        self._version = None
+        self._rows: list[tuple] = []  # (norm, domain, prompt, answer, created)
+        self._domains = np.zeros(0, dtype=object)  # normalized domain of each row
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS inquiries ("
+            " norm TEXT PRIMARY KEY, domain TEXT NOT NULL, prompt TEXT NOT NULL, answer TEXT NOT NULL,"
+            " vector BLOB, created REAL NOT NULL)"
+        )
+
+    def _refresh(self):
+        """Reload the in-memory matrix when another writer changed the table."""
+        conn = self._conn()
+        version = conn.execute("SELECT COUNT(*), MAX(created) FROM inquiries").fetchone()
+        with self._lock:
+            if version == self._version:
+                return
+            rows, vectors = [], []
+            for norm, domain, prompt, answer, vector, created in conn.execute(
+                "SELECT norm, domain, prompt, answer, vector, created FROM inquiries WHERE vector IS NOT NULL"
+            ):
+                rows.append((norm, domain, prompt, answer, created))
+                vectors.append(np.frombuffer(vector, dtype=np.float32))
+            dims = {len(v) for v in vectors}
+            if len(dims) > 1:  # embedding model changed: keep the most common dimension
+                keep = max(dims, key=lambda d: sum(len(v) == d for v in vectors))
+                pairs = [(r, v) for r, v in zip(rows, vectors) if len(v) == keep]
+                rows, vectors = [r for r, _ in pairs], [v for _, v in pairs]
+            self._rows = list(rows)
+            self._domains = np.array([normalize(r[1]) for r in rows], dtype=object)
+            self._matrix = np.stack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+            self._version = version
+
+    def _embed(self, text: str):
+        try:
+            return embeddings.embed([text])[0]
+        except Exception as e:
+            print(f"Inquiry embedding skipped: {e}")
+            return None
+
+    def lookup(self, prompt: str, max_age: float | None = None, domain: str | None = None) -> dict | None:
+        """Return ``{"prompt", "domain", "answer", "created", "score"}`` of a fresh matching inquiry, if any.
+
+        ``max_age`` (seconds) tightens ``ttl`` for this lookup, e.g. to the
+        asking domain's freshness policy.  With ``domain``, similar (not
+        identical) inquiries only match when asked for the same normalized
+        domain.
+        """
+        cutoff = time.time() - (self.ttl if max_age is None else min(self.ttl, max_age))
+        row = self._conn().execute(
+            "SELECT domain, prompt, answer, created FROM inquiries WHERE norm = ? AND created >= ?",
+            (normalize(prompt), cutoff),
+        ).fetchone()
+        if row:
+            self.hits += 1
+            return {"domain": row[0], "prompt": row[1], "answer": row[2], "created": row[3], "score": 1.0}
+        self._refresh()
+        with self._lock:
+            rows, matrix, domains = self._rows, self._matrix, self._domains
+        eligible = np.array([r[4] >= cutoff for r in rows], dtype=bool)
+        if domain is not None:
+            eligible &= domains == normalize(domain)
+        if not eligible.any():
+            return None
+        vector = self._embed(prompt)
+        if vector is None or len(vector) != matrix.shape[1]:
+            return None
+        scores = np.where(eligible, similarities(vector, matrix), -1.0)
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        self.hits += 1
+        _, domain, matched, answer, created = rows[best]
+        return {"domain": domain, "prompt": matched, "answer": answer, "created": created,
+                "score": float(scores[best])}
+
+    def add(self, prompt: str, domain: str, answer: str):
+        """Store an answered inquiry (replacing an older answer to the same text)."""
+        vector = self._embed(prompt)
+        blob = np.asarray(vector, dtype=np.float32).tobytes() if vector is not None else None
+        self._conn().execute(
+            "INSERT OR REPLACE INTO inquiries (norm, domain, prompt, answer, vector, created) VALUES (?, ?, ?, ?, ?, ?)",
+            (normalize(prompt), domain, prompt, answer, blob, time.time()),
+        )
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> InquiryIndex:
+    """Return the process-wide inquiry index."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = InquiryIndex()
+    return _index
@@ -0,0 +1,387 @@
+"""
+jobs.py – persistent research job queue executed by worker processes.
+
+Jobs live in a SQLite database under ``vault/`` so they outlive Streamlit
+reruns, browser refreshes and the server process itself.  ``submit()`` files a
+job (or returns the job already running – or recently finished – for the same
+project description), workers ``claim()`` queued jobs, and every event of the
+run is appended to the ``events`` table as it happens so the UI can replay and
+follow a job by ID; a ``restart`` event marks where a requeued job's new
+attempt begins.  Results, the markdown report, the PDF and the run's timing
+waterfall are written to ``vault/jobs/<job id>/``.
+
+Run workers with ``python -m modules.jobs --workers 4``; the app starts an
+embedded pool of ``JOB_WORKERS`` processes unless that is set to 0.
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+from modules import db, settings
+
+JOBS_DB_PATH = settings.get("JOBS_DB_PATH", "vault/jobs.sqlite")
+JOBS_DIR = Path(settings.get("JOBS_DIR", "vault/jobs"))
+JOB_WORKERS = settings.get_int("JOB_WORKERS", 2)
+JOB_REUSE_TTL = settings.get_float("JOB_REUSE_TTL", 3600)  # seconds a finished job is reused
+JOB_STALE_AFTER = settings.get_float("JOB_STALE_AFTER", 120)  # seconds without heartbeat
+JOB_MAX_ATTEMPTS = settings.get_int("JOB_MAX_ATTEMPTS", 2)
+JOB_RETENTION = settings.get_float("JOB_RETENTION", 7 * 24 * 3600)  # seconds
+POLL_INTERVAL = 0.5  # seconds between queue polls of an idle worker
+TOKEN_FLUSH_INTERVAL = 0.25  # seconds; streamed tokens are written in batches
+HEARTBEAT_INTERVAL = 10.0
+
+ACTIVE = ("queued", "running")
+FINISHED = ("done", "failed")
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def request_hash(request: str) -> str:
+    """Identity of a project description: case and whitespace are ignored."""
+    normalized = re.sub(r"\s+", " ", request).strip().lower()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def job_dir(job_id: str) -> Path:
+    return JOBS_DIR / job_id
+
+
+class JobStore:
+    """SQLite-backed job table plus the append-only event log of each job."""
+
+    def __init__(self, path: str = JOBS_DB_PATH):
+        self.path = path
+        self._conn = db.ThreadConnections(path, row_factory=sqlite3.Row)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, request_hash TEXT NOT NULL, request TEXT NOT NULL,"
+            " session_id TEXT, status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,"
+            " worker TEXT, error TEXT, created REAL NOT NULL, started REAL, finished REAL,"
+            " heartbeat REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_hash ON jobs(request_hash, created)")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, created)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            " job_id TEXT NOT NULL, seq INTEGER NOT NULL, event TEXT NOT NULL,"
+            " PRIMARY KEY (job_id, seq))"
+        )
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    # ---------------------------------------------------------------- #
+    # submitters / readers
+    # ---------------------------------------------------------------- #
+    def submit(self, request: str, session_id: str | None = None) -> tuple[str, bool]:
+        """Queue ``request`` and return ``(job_id, created)``.
+
+        An identical request that is queued, running or finished within
+        ``JOB_REUSE_TTL`` is shared instead of starting a second run.
+        """
+        digest = request_hash(request)
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE request_hash = ?"
+                " AND (status IN ('queued', 'running') OR (status = 'done' AND finished > ?))"
+                " ORDER BY created DESC LIMIT 1",
+                (digest, now - JOB_REUSE_TTL),
+            ).fetchone()
+            if row:
+                return row["id"], False
+            job_id = uuid.uuid4().hex[:16]
+            conn.execute(
+                "INSERT INTO jobs (id, request_hash, request, session_id, status, created)"
+                " VALUES (?, ?, ?, ?, 'queued', ?)",
+                (job_id, digest, request, session_id, now),
+            )
+        return job_id, True
+
+    def get(self, job_id: str) -> dict | None:
+        row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def events(self, job_id: str, after: int = 0) -> list[tuple[int, dict]]:
+        """Events of ``job_id`` with a sequence number above ``after``."""
+        rows = self._conn().execute(
+            "SELECT seq, event FROM events WHERE job_id = ? AND seq > ? ORDER BY seq", (job_id, after)
+        )
+        return [(seq, json.loads(event)) for seq, event in rows]
+
+    # ---------------------------------------------------------------- #
+    # workers
+    # ---------------------------------------------------------------- #
+    def claim(self, worker: str) -> dict | None:
+        """Take the oldest queued job, first requeueing jobs of dead workers."""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', worker = NULL"
+                " WHERE status = 'running' AND heartbeat < ? AND attempts < ?",
+                (now - JOB_STALE_AFTER, JOB_MAX_ATTEMPTS),
+            )
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', finished = ?, error = 'worker lost'"
+                " WHERE status = 'running' AND heartbeat < ?",
+                (now, now - JOB_STALE_AFTER),
+            )
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1,"
+                " started = ?, heartbeat = ? WHERE id = ?",
+                (worker, now, now, row["id"]),
+            )
+        return dict(row)
+
+    def append(self, job_id: str, events: list[dict]):
+        """Append ``events`` to the job's log and refresh its heartbeat."""
+        if not events:
+            return
+        with self._transaction() as conn:
+            (last,) = conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM events WHERE job_id = ?", (job_id,)
+            ).fetchone()
+            conn.executemany(
+                "INSERT INTO events (job_id, seq, event) VALUES (?, ?, ?)",
+                [(job_id, last + i, json.dumps(e, default=str)) for i, e in enumerate(events, 1)],
+            )
+            conn.execute("UPDATE jobs SET heartbeat = ? WHERE id = ?", (time.time(), job_id))
+
+    def heartbeat(self, job_id: str):
+        self._conn().execute("UPDATE jobs SET heartbeat = ? WHERE id = ?", (time.time(), job_id))
+
+    def finish(self, job_id: str, status: str, error: str | None = None):
+        self._conn().execute(
+            "UPDATE jobs SET status = ?, error = ?, finished = ? WHERE id = ?",
+            (status, error, time.time(), job_id),
+        )
+
+    def prune(self, retention: float = JOB_RETENTION):
+        """Drop finished jobs (rows, events and files) older than ``retention``."""
+        cutoff = time.time() - retention
+        with self._transaction() as conn:
+            old = [r["id"] for r in conn.execute(
+                "SELECT id FROM jobs WHERE status IN ('done', 'failed') AND finished < ?", (cutoff,)
+            )]
+            conn.executemany("DELETE FROM events WHERE job_id = ?", [(i,) for i in old])
+            conn.executemany("DELETE FROM jobs WHERE id = ?", [(i,) for i in old])
+        for job_id in old:
+            for path in job_dir(job_id).glob("*"):
+                path.unlink(missing_ok=True)
+            if job_dir(job_id).exists():
+                job_dir(job_id).rmdir()
+        return len(old)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> JobStore:
+    """Return the process-wide job store."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = JobStore()
+    return _store
+
+
+def submit(request: str, session_id: str | None = None) -> tuple[str, bool]:
+    return get_store().submit(request, session_id)
+
+
+def artifact(job_id: str, name: str) -> Path | None:
+    """Path of a finished job's artifact (``report.pdf``, ``results.json``, ...), if present."""
+    path = job_dir(job_id) / name
+    return path if path.exists() else None
+
+
+# --------------------------------------------------------------------- #
+# execution
+# --------------------------------------------------------------------- #
+class _EventWriter:
+    """Buffers a run's events, coalescing streamed tokens per result key."""
+
+    def __init__(self, store: JobStore, job_id: str):
+        self.store = store
+        self.job_id = job_id
+        self._pending: list[dict] = []
+        self._flushed = time.monotonic()
+
+    def emit(self, event: dict):
+        if event["type"] == "token":
+            last = self._pending[-1] if self._pending else None
+            if last and last["type"] == "token" and last["key"] == event["key"]:
+                last["text"] += event["text"]
+            else:
+                self._pending.append(dict(event))
+            if time.monotonic() - self._flushed < TOKEN_FLUSH_INTERVAL:
+                return
+        else:
+            if event["type"] == "reset":  # unsent tokens of the key are void
+                self._pending = [e for e in self._pending if e["type"] != "token" or e["key"] != event["key"]]
+            self._pending.append(event)
+        self.flush()
+
+    def flush(self):
+        self.store.append(self.job_id, self._pending)
+        self._pending = []
+        self._flushed = time.monotonic()
+
+
+def write_atomic(path: Path, data: bytes):
+    """Write ``data`` to ``path`` through a temp file, so readers never see a partial file."""
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def run_pipeline(request: str, out: Path, session_id: str | None = None, emit=None):
+    """Research, synthesize and render ``request`` into ``out``; returns ``(results, trace)``.
+
+    Every research event, including the final ``done`` event with the results
+    and trace, is passed to ``emit``.  results.json is written first; a run
+    with failed queries then raises ``RuntimeError`` without a report.
+    Otherwise report.md, report.pdf and trace.json follow.  Job workers and
+    ``modules.batch`` both run requests through here.
+    """
+    from modules import composer, orchestrator, synthesizer, telemetry
+
+    emit = emit or (lambda event: None)
+    out.mkdir(parents=True, exist_ok=True)
+    results, trace = {}, None
+    for event in orchestrator.iter_research(request, None, session_id):
+        emit(event)
+        if event["type"] == "done":
+            results, trace = event["results"], event["trace"]
+            write_atomic(out / "results.json", json.dumps(
+                {"results": results, "log": event["log"], "failed": event["failed"]},
+                indent=2).encode("utf-8"))
+            if event["failed"]:
+                raise RuntimeError(f"{len(event['failed'])} queries failed: {', '.join(event['failed'])}")
+    emit({"type": "log", "text": "Compiling report…"})
+    with telemetry.activate(trace):
+        report_md = synthesizer.synthesize(
+            project_name=request, user_prompt=request, data=results, artifacts={}
+        )
+        pdf_bytes = composer.make_pdf(report_md)
+    write_atomic(out / "report.md", report_md.encode("utf-8"))
+    write_atomic(out / "report.pdf", pdf_bytes)
+    write_atomic(out / "trace.json", json.dumps(trace.waterfall(), default=str).encode("utf-8"))
+    return results, trace
+
+
+def execute(store: JobStore, job: dict):
+    """Run one claimed job to completion in this process."""
+    job_id = job["id"]
+    writer = _EventWriter(store, job_id)
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            store.heartbeat(job_id)
+
+    def forward(event):
+        if event["type"] != "done":  # carries the trace; the job writes its own done event
+            writer.emit(event)
+
+    threading.Thread(target=beat, name=f"heartbeat-{job_id}", daemon=True).start()
+    if job["attempts"]:
+        # the lost attempt's events stay in the log; readers discard everything before this
+        writer.emit({"type": "restart", "text": f"Restarting after a lost worker (attempt {job['attempts'] + 1})"})
+    try:
+        run_pipeline(job["request"], job_dir(job_id), job["session_id"], forward)
+        writer.emit({"type": "done"})
+        store.finish(job_id, "done")
+    except Exception as e:
+        # failed jobs are not reused by submit(), so the next identical request reruns
+        writer.emit({"type": "error", "text": f"{type(e).__name__}: {e}"})
+        store.finish(job_id, "failed", f"{type(e).__name__}: {e}")
+    finally:
+        stop.set()
+
+
+def worker_loop(stop=None):
+    """Claim and execute jobs until ``stop`` (a multiprocessing Event) is set."""
+    from modules import composer, orchestrator, synthesizer  # noqa: F401 – pay the import cost before the first job
+
+    synthesizer.load_templates()
+
+    store = get_store()
+    name = f"{os.uname().nodename}:{os.getpid()}"
+    store.prune()
+    try:
+        while stop is None or not stop.is_set():
+            job = store.claim(name)
+            if job is None:
+                time.sleep(POLL_INTERVAL)
+                continue
+            print(f"[{name}] job {job['id']}: {job['request'][:60]}", flush=True)
+            execute(store, job)
+    finally:
+        # multiprocessing joins child processes before interpreter shutdown would stop the pool
+        composer.shutdown()
+
+
+def start_workers(count: int = JOB_WORKERS, parent: int | None = None) -> subprocess.Popen | None:
+    """Launch ``count`` worker processes in the background (tied to ``parent``)."""
+    if count <= 0:
+        return None
+    args = [sys.executable, "-m", "modules.jobs", "--workers", str(count)]
+    if parent:
+        args += ["--parent", str(parent)]
+    return subprocess.Popen(args, cwd=ROOT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run research job workers.")
+    parser.add_argument("--workers", type=int, default=JOB_WORKERS)
+    parser.add_argument("--parent", type=int, help="stop (after the current jobs) once this process is gone")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    stop = ctx.Event()
+    procs = [ctx.Process(target=worker_loop, args=(stop,), name=f"job-worker-{i}")
+             for i in range(max(1, args.workers))]
+    for proc in procs:
+        proc.start()
+    try:
+        while any(proc.is_alive() for proc in procs):
+            # reparented once the launching server exits: let workers finish their job and stop
+            if args.parent and os.getppid() != args.parent:
+                stop.set()
+            for proc in procs:
+                proc.join(timeout=1.0)
+    except KeyboardInterrupt:
+        stop.set()
+        for proc in procs:
+            proc.join()
+
+
+if __name__ == "__main__":
+    main()
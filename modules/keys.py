@@ -0,0 +1,205 @@
+"""
+keys.py – rate-limit-aware API key scheduler.
+
+Each key ("slot") keeps request and token buckets that refill continuously and
+are re-synchronised from the ``x-ratelimit-*`` response headers.  A query is
+pinned to the slot with the most headroom when it starts and keeps that key for
+all of its turns and retries, so every query is still sent under exactly one
+key.  Slots that fail repeatedly are taken out of rotation for a cooldown.
+"""
+
+import random
+import re
+import threading
+import time
+
+from modules import settings
+
+DEFAULT_RPM = settings.get_float("OPENAI_DEFAULT_RPM", 500)
+DEFAULT_TPM = settings.get_float("OPENAI_DEFAULT_TPM", 40000)
+MAX_RETRIES = settings.get_int("OPENAI_MAX_RETRIES", 4)
+BACKOFF_BASE = settings.get_float("OPENAI_BACKOFF_BASE", 1.0)  # seconds
+BACKOFF_MAX = settings.get_float("OPENAI_BACKOFF_MAX", 30.0)
+FAILURE_THRESHOLD = settings.get_int("OPENAI_KEY_FAILURE_THRESHOLD", 3)
+COOLDOWN = settings.get_float("OPENAI_KEY_COOLDOWN", 60.0)
+
+_DURATION = re.compile(r"([\d.]+)(ms|s|m|h)")
+_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value) -> float | None:
+    """Parse OpenAI reset durations such as ``"1m30s"``, ``"250ms"`` or ``"6"``."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION.findall(value)
+    if not parts:
+        return None
+    return sum(float(n) * _UNITS[u] for n, u in parts)
+
+
+class _Bucket:
+    """Token bucket refilling ``capacity`` units per minute."""
+
+    def __init__(self, capacity: float):
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60.0)
+        self.updated = now
+
+    def sync(self, limit, remaining, now: float):
+        if limit:
+            self.capacity = float(limit)
+        if remaining is not None:
+            self.level = min(self.capacity, float(remaining))
+        self.updated = now
+
+    def headroom(self) -> float:
+        return self.level / self.capacity if self.capacity else 0.0
+
+
+class KeyState:
+    def __init__(self, slot: int):
+        self.slot = slot
+        self.requests = _Bucket(DEFAULT_RPM)
+        self.tokens = _Bucket(DEFAULT_TPM)
+        self.inflight = 0
+        self.failures = 0
+        self.cooldown_until = 0.0
+        self.served = 0
+        self.retries = 0
+
+
+class KeyScheduler:
+    """Pick the API key slot with the most rate-limit headroom for each query."""
+
+    def __init__(self, n_keys: int):
+        self.states = [KeyState(i) for i in range(n_keys)]
+        self._lock = threading.Lock()
+
+    def acquire(self, est_tokens: int = 0) -> int:
+        """Reserve a slot for one query and return its index."""
+        with self._lock:
+            now = time.monotonic()
+            for s in self.states:
+                s.requests.refill(now)
+                s.tokens.refill(now)
+            available = [s for s in self.states if s.cooldown_until <= now]
+            if not available:
+                # every key is cooling down: use the one that recovers first
+                available = [min(self.states, key=lambda s: s.cooldown_until)]
+
+            def score(s):
+                return (
+                    min(s.requests.headroom(), s.tokens.headroom()) - 0.05 * s.inflight,
+                    random.random(),  # break ties randomly to keep keys unlinkable
+                )
+
+            state = max(available, key=score)
+            state.requests.level -= 1
+            state.tokens.level -= est_tokens
+            state.inflight += 1
+            state.served += 1
+            return state.slot
+
+    def release(self, slot: int):
+        with self._lock:
+            self.states[slot].inflight -= 1
+
+    def wait_time(self, slot: int) -> float:
+        """Seconds until ``slot``'s buckets have refilled enough to send again.
+
+        Cooldowns only keep a slot away from *new* queries; a query already
+        pinned to the slot relies on backoff instead.
+        """
+        with self._lock:
+            s = self.states[slot]
+            now = time.monotonic()
+            s.requests.refill(now)
+            s.tokens.refill(now)
+            waits = [0.0]
+            if s.requests.level < 0 and s.requests.capacity:
+                waits.append(-s.requests.level * 60.0 / s.requests.capacity)
+            if s.tokens.level < 0 and s.tokens.capacity:
+                waits.append(-s.tokens.level * 60.0 / s.tokens.capacity)
+            return min(max(waits), BACKOFF_MAX)
+
+    def record_headers(self, slot: int, headers):
+        """Update the slot's buckets from ``x-ratelimit-*`` response headers."""
+        if headers is None:
+            return
+        with self._lock:
+            s = self.states[slot]
+            now = time.monotonic()
+            s.requests.sync(
+                headers.get("x-ratelimit-limit-requests"),
+                headers.get("x-ratelimit-remaining-requests"),
+                now,
+            )
+            s.tokens.sync(
+                headers.get("x-ratelimit-limit-tokens"),
+                headers.get("x-ratelimit-remaining-tokens"),
+                now,
+            )
+
+    def record_success(self, slot: int, tokens_used: int = 0, est_tokens: int = 0):
+        with self._lock:
+            s = self.states[slot]
+            s.failures = 0
+            s.tokens.level -= max(0, tokens_used - est_tokens)
+
+    def record_failure(self, slot: int, retry_after: float | None = None):
+        """Register a throttled/failed call; repeated failures bench the slot."""
+        with self._lock:
+            s = self.states[slot]
+            s.failures += 1
+            s.retries += 1
+            now = time.monotonic()
+            if retry_after:
+                s.cooldown_until = max(s.cooldown_until, now + retry_after)
+            if s.failures >= FAILURE_THRESHOLD:
+                s.cooldown_until = max(s.cooldown_until, now + COOLDOWN)
+
+    def snapshot(self) -> list[dict]:
+        """Per-slot counters for logging (never includes the keys themselves)."""
+        with self._lock:
+            now = time.monotonic()
+            return [
+                {
+                    "slot": s.slot,
+                    "served": s.served,
+                    "retries": s.retries,
+                    "inflight": s.inflight,
+                    "cooling_down": s.cooldown_until > now,
+                }
+                for s in self.states
+            ]
+
+
+def backoff_delay(attempt: int, retry_after: float | None = None) -> float:
+    """Full-jitter exponential backoff, never shorter than a server ``Retry-After``."""
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** max(0, attempt - 1)))
+    if retry_after:
+        delay = max(delay, retry_after)
+    return min(delay, BACKOFF_MAX)
+
+
+_schedulers: dict = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(api_keys: list) -> KeyScheduler:
+    """Return the process-wide scheduler for this key pool."""
+    pool = tuple(api_keys)
+    with _schedulers_lock:
+        scheduler = _schedulers.get(pool)
+        if scheduler is None:
+            scheduler = _schedulers[pool] = KeyScheduler(len(pool))
+    return scheduler
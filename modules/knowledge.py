@@ -0,0 +1,279 @@
+"""
+knowledge.py – persistent store of researched domain answers.
+
+Answers are kept in ``vault/knowledge.sqlite`` keyed by (normalized domain,
+hash of the normalized inquiry), with the model that produced them, the
+request they were researched for and when.  Every Streamlit session and job
+worker on the host shares the store (WAL, one connection per thread).
+
+An entry is reused while it is younger than its domain's freshness policy:
+``KNOWLEDGE_MAX_AGE`` by default, overridden per domain keyword by
+``KNOWLEDGE_FRESHNESS`` (e.g. regulations go stale sooner than physics).  An
+FTS5 index over domain, inquiry and answer backs ``search()``, and recently
+used entries are held in a small in-process LRU bounded by entry count and
+bytes.  The LRU only saves re-reading the row: every read checks the row's
+``created`` time in SQLite, so an answer refreshed by another session or
+worker replaces the cached copy.
+"""
+
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from modules import db, inquiries, settings
+
+KNOWLEDGE_PATH = settings.get("KNOWLEDGE_DB_PATH", "vault/knowledge.sqlite")
+MAX_AGE = settings.get_float("KNOWLEDGE_MAX_AGE", 30 * 24 * 3600)  # seconds
+MAX_ENTRIES = settings.get_int("KNOWLEDGE_MAX_ENTRIES", 50000)
+MEMORY_ENTRIES = settings.get_int("KNOWLEDGE_MEMORY_ENTRIES", 256)
+MEMORY_BYTES = settings.get_int("KNOWLEDGE_MEMORY_BYTES", 8 * 1024 * 1024)
+PRUNE_EVERY = 100  # writes between pruning passes
+
+
+def freshness_policies() -> dict[str, float]:
+    """``KNOWLEDGE_FRESHNESS`` as {normalized keyword: max age in seconds}; a JSON string is accepted."""
+    policies = settings.get("KNOWLEDGE_FRESHNESS", {}) or {}
+    if isinstance(policies, str):
+        try:
+            policies = json.loads(policies)
+        except ValueError:
+            print("KNOWLEDGE_FRESHNESS is not valid JSON; using KNOWLEDGE_MAX_AGE only.")
+            policies = {}
+    return {inquiries.normalize(k): float(v) for k, v in policies.items()}
+
+
+def inquiry_hash(inquiry: str) -> str:
+    return hashlib.sha256(inquiries.normalize(inquiry).encode("utf-8")).hexdigest()
+
+
+def _fts_query(text: str) -> str:
+    words = re.findall(r"\w+", text.lower())
+    return " OR ".join(f'"{w}"' for w in words)
+
+
+class KnowledgeStore:
+    """Domain answers keyed by (normalized domain, inquiry hash), shared across processes."""
+
+    def __init__(self, path: str = KNOWLEDGE_PATH, max_age: float = MAX_AGE, policies: dict | None = None,
+                 max_entries: int = MAX_ENTRIES, memory_entries: int = MEMORY_ENTRIES,
+                 memory_bytes: int = MEMORY_BYTES):
+        self.path = path
+        self.max_age = max_age
+        self.policies = freshness_policies() if policies is None else {
+            inquiries.normalize(k): float(v) for k, v in policies.items()
+        }
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.memory_bytes = memory_bytes
+        self.hits = 0
+        self.stale = 0
+        self._memory: OrderedDict[tuple, dict] = OrderedDict()
+        self._memory_size = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = db.ThreadConnections(path)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS knowledge ("
+            " id INTEGER PRIMARY KEY, domain_norm TEXT NOT NULL, inquiry_hash TEXT NOT NULL,"
+            " domain TEXT NOT NULL, inquiry TEXT NOT NULL, answer TEXT NOT NULL,"
+            " model TEXT, request TEXT, created REAL NOT NULL,"
+            " UNIQUE (domain_norm, inquiry_hash))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS knowledge_created ON knowledge(created)")
+        conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS knowledge_fts USING fts5("
+            " domain, inquiry, answer, content='knowledge', content_rowid='id')"
+        )
+        conn.executescript(
+            "CREATE TRIGGER IF NOT EXISTS knowledge_ai AFTER INSERT ON knowledge BEGIN"
+            "  INSERT INTO knowledge_fts (rowid, domain, inquiry, answer) VALUES (new.id, new.domain, new.inquiry, new.answer);"
+            " END;"
+            "CREATE TRIGGER IF NOT EXISTS knowledge_ad AFTER DELETE ON knowledge BEGIN"
+            "  INSERT INTO knowledge_fts (knowledge_fts, rowid, domain, inquiry, answer)"
+            "  VALUES ('delete', old.id, old.domain, old.inquiry, old.answer);"
+            " END;"
+            "CREATE TRIGGER IF NOT EXISTS knowledge_au AFTER UPDATE ON knowledge BEGIN"
+            "  INSERT INTO knowledge_fts (knowledge_fts, rowid, domain, inquiry, answer)"
+            "  VALUES ('delete', old.id, old.domain, old.inquiry, old.answer);"
+            "  INSERT INTO knowledge_fts (rowid, domain, inquiry, answer) VALUES (new.id, new.domain, new.inquiry, new.answer);"
+            " END;"
+        )
+
+    # -- freshness ------------------------------------------------------- #
+    def max_age_for(self, domain: str) -> float:
+        """Freshness limit of ``domain``: the strictest matching policy, else ``max_age``."""
+        padded = f" {inquiries.normalize(domain)} "
+        ages = [age for keyword, age in self.policies.items() if f" {keyword} " in padded]
+        return min(ages) if ages else self.max_age
+
+    def _fresh(self, entry: dict) -> bool:
+        return time.time() - entry["created"] < self.max_age_for(entry["domain"])
+
+    # -- in-process LRU -------------------------------------------------- #
+    def _remember(self, key: tuple, entry: dict):
+        size = len(entry["answer"]) + len(entry["inquiry"])
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_size -= len(old["answer"]) + len(old["inquiry"])
+            if size > self.memory_bytes:
+                return
+            self._memory[key] = entry
+            self._memory_size += size
+            while len(self._memory) > self.memory_entries or self._memory_size > self.memory_bytes:
+                _, dropped = self._memory.popitem(last=False)
+                self._memory_size -= len(dropped["answer"]) + len(dropped["inquiry"])
+
+    def _recall(self, key: tuple) -> dict | None:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+            return entry
+
+    # -- entries --------------------------------------------------------- #
+    def entry(self, domain: str, inquiry: str) -> dict | None:
+        """The stored entry for ``domain``/``inquiry`` (answer, model, request, created), fresh or not."""
+        key = (inquiries.normalize(domain), inquiry_hash(inquiry))
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT created FROM knowledge WHERE domain_norm = ? AND inquiry_hash = ?", key
+        ).fetchone()
+        if row is None:
+            return None
+        entry = self._recall(key)
+        if entry is None or entry["created"] != row[0]:  # not cached, or rewritten elsewhere
+            row = conn.execute(
+                "SELECT domain, inquiry, answer, model, request, created FROM knowledge"
+                " WHERE domain_norm = ? AND inquiry_hash = ?",
+                key,
+            ).fetchone()
+            if row is None:
+                return None
+            entry = dict(zip(("domain", "inquiry", "answer", "model", "request", "created"), row))
+            self._remember(key, entry)
+        return entry
+
+    def get(self, domain: str, inquiry: str) -> dict | None:
+        """The fresh entry for ``domain``/``inquiry``, if any."""
+        entry = self.entry(domain, inquiry)
+        if entry is None:
+            return None
+        if not self._fresh(entry):
+            self.stale += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, domain: str, inquiry: str, answer: str, model: str | None = None, request: str | None = None,
+            created: float | None = None):
+        """Store (or refresh) the answer to ``inquiry`` for ``domain``.
+
+        ``created`` defaults to now; pass the original time when storing an
+        answer produced earlier, so its age keeps counting.
+        """
+        key = (inquiries.normalize(domain), inquiry_hash(inquiry))
+        entry = {"domain": domain, "inquiry": inquiry, "answer": answer, "model": model,
+                 "request": request, "created": time.time() if created is None else created}
+        self._conn().execute(
+            "INSERT INTO knowledge (domain_norm, inquiry_hash, domain, inquiry, answer, model, request, created)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (domain_norm, inquiry_hash) DO UPDATE SET domain = excluded.domain,"
+            " inquiry = excluded.inquiry, answer = excluded.answer, model = excluded.model,"
+            " request = excluded.request, created = excluded.created",
+            (*key, domain, inquiry, answer, model, request, entry["created"]),
+        )
+        self._remember(key, entry)
+        with self._lock:
+            self._writes += 1
+            due = self._writes % PRUNE_EVERY == 0
+        if due:
+            self.prune()
+
+    def search(self, text: str, limit: int = 5, fresh_only: bool = True) -> list[dict]:
+        """Entries matching ``text`` in the full-text index, best first."""
+        query = _fts_query(text)
+        if not query:
+            return []
+        rows = self._conn().execute(
+            "SELECT k.domain, k.inquiry, k.answer, k.model, k.request, k.created, bm25(knowledge_fts) AS score"
+            " FROM knowledge_fts JOIN knowledge k ON k.id = knowledge_fts.rowid"
+            " WHERE knowledge_fts MATCH ? ORDER BY score LIMIT ?",
+            (query, limit * 4 if fresh_only else limit),
+        ).fetchall()
+        entries = [dict(zip(("domain", "inquiry", "answer", "model", "request", "created", "score"), r))
+                   for r in rows]
+        if fresh_only:
+            entries = [e for e in entries if self._fresh(e)]
+        return entries[:limit]
+
+    def prune(self):
+        """Drop entries older than every policy allows, then the oldest beyond ``max_entries``."""
+        longest = max([self.max_age, *self.policies.values()])
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM knowledge WHERE created < ?", (time.time() - longest,))
+            conn.execute(
+                "DELETE FROM knowledge WHERE id IN (SELECT id FROM knowledge ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM knowledge").fetchone()[0]
+
+
+class SessionKnowledge:
+    """``KnowledgeStore`` interface over a plain ``{domain: answer}`` dict (one run or session)."""
+
+    def __init__(self, answers: dict):
+        self.answers = answers
+
+    def max_age_for(self, domain: str) -> float | None:
+        return None
+
+    def entry(self, domain: str, inquiry: str) -> dict | None:
+        return self.get(domain, inquiry)
+
+    def get(self, domain: str, inquiry: str) -> dict | None:
+        if domain not in self.answers:
+            return None
+        return {"domain": domain, "inquiry": inquiry, "answer": self.answers[domain], "model": None,
+                "request": None, "created": None}
+
+    def put(self, domain: str, inquiry: str, answer: str, model: str | None = None, request: str | None = None,
+            created: float | None = None):
+        self.answers[domain] = answer
+
+    def search(self, text: str, limit: int = 5, fresh_only: bool = True) -> list[dict]:
+        return []
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> KnowledgeStore:
+    """Return the process-wide knowledge store."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = KnowledgeStore()
+    return _store
+
+
+def resolve(knowledge_base=None):
+    """The store behind a ``knowledge_base`` argument: shared store, dict wrapper, or as given."""
+    if knowledge_base is None:
+        return get_store()
+    if isinstance(knowledge_base, dict):
+        return SessionKnowledge(knowledge_base)
+    return knowledge_base
@@ -0,0 +1,111 @@
+"""
+memory.py – per-scope conversation history with rolling summaries.
+
+Each scope (one research domain) keeps its own question/answer turns; tool-call
+transcripts are scratch work and are not retained.  ``window()`` returns the
+scope's running summary plus the most recent turns that fit a token budget.
+Once the unsummarized turns outgrow the budget, the older ones are folded into
+the summary on a background thread, so summarizing never delays a request.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from modules import settings, tokens
+
+HISTORY_TOKENS = settings.get_int("CONVERSATION_HISTORY_TOKENS", 1500)
+KEEP_TURNS = 2  # most recent turns are never folded into the summary
+
+_summary_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation-summary")
+
+
+class _Scope:
+    def __init__(self):
+        self.summary = ""
+        self.turns: list[tuple[dict, dict]] = []  # (user message, assistant message)
+        self.rolling = None  # Future of the summary being computed
+
+
+class ConversationMemory:
+    """Conversation history kept per scope and bounded by a token budget.
+
+    ``summarize`` turns a transcript into a short summary; it runs on a
+    background thread and may raise to skip a round.
+    """
+
+    def __init__(self, summarize, budget: int = HISTORY_TOKENS):
+        self.summarize = summarize
+        self.budget = budget
+        self._scopes: dict[str, _Scope] = {}
+        self._lock = threading.Lock()
+
+    def _scope(self, name: str) -> _Scope:
+        if name not in self._scopes:
+            self._scopes[name] = _Scope()
+        return self._scopes[name]
+
+    def window(self, scope: str, model: str, budget: int | None = None) -> list[dict]:
+        """History messages for ``scope`` that fit within ``budget`` tokens."""
+        budget = self.budget if budget is None else min(self.budget, budget)
+        with self._lock:
+            state = self._scope(scope)
+            summary, turns = state.summary, list(state.turns)
+        head = []
+        if summary:
+            head = [{"role": "system", "content": f"(Summary of earlier conversation about {scope}: {summary})"}]
+        used = sum(tokens.count_message(m, model) for m in head)
+        picked = []
+        for user, assistant in reversed(turns):
+            cost = tokens.count_message(user, model) + tokens.count_message(assistant, model)
+            if used + cost > budget:
+                break  # older turns are covered by the summary once it catches up
+            picked.append((user, assistant))
+            used += cost
+        return head + [m for turn in reversed(picked) for m in turn]
+
+    def record(self, scope: str, prompt: str, answer: str, model: str):
+        """Append a finished turn and roll the summary forward if needed."""
+        with self._lock:
+            self._scope(scope).turns.append(
+                ({"role": "user", "content": prompt}, {"role": "assistant", "content": answer})
+            )
+            self._maybe_roll(scope, model)
+
+    def _maybe_roll(self, scope: str, model: str):
+        """Start a background summary of the older turns (called with the lock held)."""
+        state = self._scope(scope)
+        if state.rolling is not None or len(state.turns) <= KEEP_TURNS:
+            return
+        size = sum(tokens.count_message(m, model) for turn in state.turns for m in turn)
+        if size <= self.budget:
+            return
+        fold = state.turns[:-KEEP_TURNS]
+        state.rolling = _summary_pool.submit(self._roll, scope, state.summary, fold, model)
+
+    def _roll(self, scope: str, previous: str, fold: list, model: str):
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for turn in fold for m in turn)
+        if previous:
+            transcript = f"Summary so far: {previous}\n\n{transcript}"
+        try:
+            summary = self.summarize(transcript)
+        except Exception as e:
+            print(f"Conversation summary skipped for {scope}: {e}")
+            summary = None
+        with self._lock:
+            state = self._scope(scope)
+            state.rolling = None
+            if summary:
+                state.summary = summary
+                del state.turns[:len(fold)]  # turns are only appended, so ``fold`` is still the prefix
+                self._maybe_roll(scope, model)
+
+    def summary(self, scope: str) -> str:
+        with self._lock:
+            return self._scope(scope).summary
+
+    def wait(self, scope: str, timeout: float | None = None):
+        """Block until the scope's pending summary (if any) is done."""
+        with self._lock:
+            rolling = self._scope(scope).rolling
+        if rolling is not None:
+            rolling.result(timeout)
@@ -1,102 +1,335 @@
 import asyncio
-from modules import planner, inquiry_builder, router, scanner
+import queue
+import re
+import time
+from modules import embeddings, inquiries, knowledge, planner, inquiry_builder, retrieval, router, scanner, settings, summarizer, telemetry
 
-def run_research(request: str, knowledge_base=None):
-    domains = planner.plan_request(request)
+STAGE_MODEL = "gpt-3.5-turbo"
+FOLLOW_RE = r'(?:Part\s?\d+|14\s*CFR\s*§\s*\d+|waiver)'
+MAX_ROUNDS = settings.get_int("RESEARCH_MAX_ROUNDS", 3)
+NOVELTY_THRESHOLD = settings.get_float("RESEARCH_NOVELTY_THRESHOLD", 0.95)  # answers this similar add nothing
+
+
+def _findings_context(results: dict) -> str:
+    """Render the domain answers as context for the synthesis prompts."""
+    blocks = [f"[{domain}]\n{answer}" for domain, answer in results.items()]
+    return "Domain findings:\n\n" + "\n\n".join(blocks)
+
+
+def _novel(answers: dict, known: dict) -> list[str]:
+    """Keys of ``answers`` that are not near-duplicates of ``known`` answers or of each other."""
+    if not answers:
+        return []
+    keys_, texts = list(answers), list(answers.values())
+    try:
+        vectors = embeddings.embed(texts + list(known.values()))
+    except Exception as e:
+        print(f"Novelty check skipped: {e}")
+        return keys_
+    novel, seen = [], list(vectors[len(texts):])
+    for key, vector in zip(keys_, vectors[:len(texts)]):
+        if seen and inquiries.similarities(vector, seen).max() >= NOVELTY_THRESHOLD:
+            continue
+        novel.append(key)
+        seen.append(vector)
+    return novel
+
+
+def _token_sink(emit, key: str):
+    def sink(text):
+        if text is None:  # the stream is being retried from the start
+            emit({"type": "reset", "key": key})
+        else:
+            emit({"type": "token", "key": key, "text": text})
+    return sink
+
+
+async def run_stages(qr, stages: dict, say, emit, done=None) -> dict:
+    """Run stages as soon as their dependencies finish.
+
+    ``stages`` maps a stage name to ``{"after": [...], "jobs": [(key, prompt, domain), ...]}``.
+    Every stage whose dependencies are satisfied joins the same wave, and all jobs
+    of a wave are issued concurrently through ``qr.ask_async``.  Each job's tokens
+    and final answer are emitted as events; per-stage timings go through ``say``.
+    Returns ``{stage: {key: answer}}``.
+    """
+    done = set(done or ())
+    pending = dict(stages)
+    outputs = {}
+
+    async def run_job(key, prompt, domain):
+        answer, _ = await qr.ask_async(
+            prompt, domain, model_override=STAGE_MODEL, on_token=_token_sink(emit, key)
+        )
+        emit({"type": "answer", "key": key, "text": answer})
+        return answer
+
+    async def run_stage(name):
+        jobs = pending[name]["jobs"]
+        started = time.perf_counter()
+        with telemetry.span("research.stage", key=name):
+            answers = await asyncio.gather(*(run_job(*job) for job in jobs))
+        elapsed = time.perf_counter() - started
+        say(f"Stage [{name}] finished {len(jobs)} calls in {elapsed:.2f}s")
+        return name, {key: answer for (key, _, _), answer in zip(jobs, answers)}
+
+    while pending:
+        ready = [n for n, s in pending.items() if set(s.get("after", ())) <= done]
+        if not ready:
+            raise ValueError(f"Unsatisfiable stage dependencies: {', '.join(pending)}")
+        started = time.perf_counter()
+        for name, result in await asyncio.gather(*(run_stage(n) for n in ready)):
+            outputs[name] = result
+        say(f"Wave [{', '.join(ready)}] completed in {time.perf_counter() - started:.2f}s")
+        done.update(ready)
+        for name in ready:
+            del pending[name]
+    return outputs
+
+
+async def research_events(request: str, knowledge_base=None, session_id: str | None = None):
+    """Run the research loop, yielding events as soon as they happen.
+
+    Events are dicts with a ``type`` of ``log``, ``token``, ``reset``,
+    ``answer``, ``followup`` or ``done``.  ``token``/``answer`` carry the
+    result ``key`` (domain name or stage output) and ``text``; ``reset`` voids
+    the tokens streamed so far for ``key`` (its stream is retried from the
+    start).  The final ``done`` event carries the complete ``results``,
+    ``log``, the keys of queries that ``failed`` (their answers are error
+    messages) and the run's telemetry ``trace``.
+
+    ``knowledge_base`` defaults to the shared persistent store
+    (``knowledge.get_store()``); a plain ``{domain: answer}`` dict keeps
+    answers to that dict only.
+    """
+    events = asyncio.Queue()
+    task = asyncio.ensure_future(_research(request, knowledge_base, events.put_nowait, session_id))
+    task.add_done_callback(lambda _: events.put_nowait(None))
+    while True:
+        event = await events.get()
+        if event is None:
+            break
+        yield event
+    results, log, failed, trace = task.result()
+    yield {"type": "done", "results": results, "log": log, "failed": failed, "trace": trace}
+
+
+def iter_research(request: str, knowledge_base=None, session_id: str | None = None):
+    """Synchronous iterator over ``research_events`` for script-style callers."""
+    inbox = queue.Queue()
+    done = object()
+
+    async def pump():
+        try:
+            async for event in research_events(request, knowledge_base, session_id):
+                inbox.put(event)
+        except BaseException as e:
+            inbox.put(e)
+        finally:
+            inbox.put(done)
+
+    asyncio.run_coroutine_threadsafe(pump(), router._event_loop())
+    while True:
+        event = inbox.get()
+        if event is done:
+            return
+        if isinstance(event, BaseException):
+            raise event
+        yield event
+
+
+def run_research(request: str, knowledge_base=None, session_id: str | None = None):
     results, log = {}, []
-    log.append(f"Task Decomposition -> Domains identified: {', '.join(domains)}")
-    knowledge_base = knowledge_base or {}
-    qr = router.QueryRouter()
+    for event in iter_research(request, knowledge_base, session_id):
+        if event["type"] == "done":
+            results, log = event["results"], event["log"]
+    return results, log
+
+
+async def _research(request: str, knowledge_base, emit, session_id=None):
+    trace = telemetry.Trace("research", request=request)
+    with telemetry.activate(trace), telemetry.span("research.run"):
+        results, log, failed = await _research_loop(request, knowledge_base, emit, session_id)
+    return results, log, failed, trace
+
+
+async def _research_loop(request: str, knowledge_base, emit, session_id=None):
+    results, log = {}, []
+
+    def say(text):
+        log.append(text)
+        emit({"type": "log", "text": text})
+
+    # an unmatched request may go to the LLM; keep that off the shared event loop
+    domains = await asyncio.to_thread(planner.plan_request, request)
+    say(f"Task Decomposition -> Domains identified: {', '.join(domains)}")
+    store = knowledge.resolve(knowledge_base)
+    qr = router.QueryRouter(session_id=session_id)
+    index = inquiries.get_index()
+    asked = set()  # normalized domains / follow-ups of this run
     round_num = 1
+    research_started = time.perf_counter()
+
+    async def query(domain, prompt):
+        answer, model_used = await qr.ask_async(
+            prompt, domain, on_token=_token_sink(emit, domain), max_age=store.max_age_for(domain)
+        )
+        clean = scanner.scan_content(answer)
+        if clean != answer:
+            say(f"[{domain}] response sanitized.")
+        if not router.is_error(clean):
+            retrieval.ingest_in_background(domain, clean, request)
+            await asyncio.to_thread(store.put, domain, prompt, clean, model_used, request)
+            await asyncio.to_thread(index.add, prompt, domain, clean)
+        emit({"type": "answer", "key": domain, "text": clean})
+        say(f"Received [{domain}] (model {model_used}) answer ✓")
+        return clean
+
+    async def reuse(domain, prompt):
+        """Answer from a prior inquiry (any domain or run) when one matches closely enough."""
+        hit = await asyncio.to_thread(index.lookup, prompt, store.max_age_for(domain), domain)
+        if hit is None:
+            return None
+        how = "same inquiry" if hit["score"] >= 1.0 else f"similar inquiry, {hit['score']:.2f}"
+        say(f"Reusing answer for [{domain}] from [{hit['domain']}] ({how})")
+        # Keep the original model, request and age: reuse must not make an answer look fresh.
+        source = await asyncio.to_thread(store.entry, hit["domain"], hit["prompt"])
+        await asyncio.to_thread(
+            store.put, domain, prompt, hit["answer"],
+            source["model"] if source else None,
+            source["request"] if source else request,
+            (source or {}).get("created") or hit["created"],
+        )
+        emit({"type": "answer", "key": domain, "text": hit["answer"]})
+        return hit["answer"]
+
     while domains:
-        log.append(f"--- Round {round_num}: Executing {len(domains)} queries ---")
+        say(f"--- Round {round_num}: Executing {len(domains)} queries ---")
         new_tasks = []
         tasks = []
         task_domains = []
-        for domain in domains:
-            if domain in knowledge_base:
-                log.append(f"Using cached answer for [{domain}]")
-                results[domain] = knowledge_base[domain]
+        fresh = {}
+        lookups = []
+        sources = {}  # answers of this round that follow-ups are drawn from
+        pending = [(domain, inquiry_builder.build_inquiry(domain, request)) for domain in domains]
+        stored = await asyncio.to_thread(lambda: [store.get(domain, prompt) for domain, prompt in pending])
+        for (domain, prompt), entry in zip(pending, stored):
+            asked.add(inquiries.normalize(domain))
+            if entry is not None:
+                age = f", {(time.time() - entry['created']) / 3600:.1f}h old" if entry["created"] else ""
+                say(f"Using stored answer for [{domain}]{age}")
+                results[domain] = sources[domain] = entry["answer"]
+                emit({"type": "answer", "key": domain, "text": results[domain]})
             else:
-                prompt = inquiry_builder.build_inquiry(domain)
-                log.append(f'Querying [{domain}] with GPT-4: "{prompt}"')
-                tasks.append(qr.ask_async(prompt, domain))
+                lookups.append((domain, prompt))
+        # concurrent lookups share one batched embedding request
+        reused = await asyncio.gather(*(reuse(domain, prompt) for domain, prompt in lookups))
+        for (domain, prompt), answer in zip(lookups, reused):
+            if answer is not None:
+                results[domain] = sources[domain] = answer
+            else:
+                say(f'Querying [{domain}] with GPT-4: "{prompt}"')
+                tasks.append(query(domain, prompt))
                 task_domains.append(domain)
         if tasks:
-            async def run_tasks():
-                return await asyncio.gather(*tasks)
-
-            responses = asyncio.run(run_tasks())
-            for dom, (answer, model_used) in zip(task_domains, responses):
-                clean = scanner.scan_content(answer)
-                if clean != answer:
-                    log.append(f"[{dom}] response sanitized.")
+            known = dict(results)
+            with telemetry.span("research.round", key=f"round {round_num}"):
+                responses = await asyncio.gather(*tasks)
+            # record in plan order so downstream prompts stay deterministic
+            for dom, clean in zip(task_domains, responses):
                 results[dom] = clean
-                knowledge_base[dom] = clean
-                log.append(f"Received [{dom}] (model {model_used}) answer ✓")
-                if dom.lower() == "regulations":
-                    import re
-                    follow_re = r'(?:Part\s?\d+|14\s*CFR\s*§\s*\d+|waiver)'
-                    match = re.search(follow_re, clean, flags=re.I)
-                    if match:
-                        follow_up = match.group(0).strip()
-                        if follow_up not in results:
-                            log.append(f"Follow‑up identified: {follow_up}")
-                            new_tasks.append(follow_up)
+                fresh[dom] = clean
+            novel = await asyncio.to_thread(_novel, fresh, known) if round_num > 1 else list(fresh)
+            if not novel and not sources:
+                say("Nothing new learned this round – stopping follow-ups.")
+                break
+            sources.update((dom, fresh[dom]) for dom in novel)
+        # stored and reused answers count too, or a repeat request would never follow up
+        for dom, answer in sources.items():
+            if dom.lower() != "regulations" or router.is_error(answer):
+                continue
+            for match in re.finditer(FOLLOW_RE, answer, flags=re.I):
+                follow_up = match.group(0).strip()
+                if inquiries.normalize(follow_up) in asked:
+                    continue
+                asked.add(inquiries.normalize(follow_up))
+                say(f"Follow‑up identified: {follow_up}")
+                emit({"type": "followup", "key": follow_up, "source": dom})
+                new_tasks.append(follow_up)
         if not new_tasks:
             break
+        if round_num >= MAX_ROUNDS:
+            say(f"Stopping after {MAX_ROUNDS} rounds; {len(new_tasks)} follow-ups left unexplored.")
+            break
         domains = new_tasks
         round_num += 1
-    log.append("--- All queries completed ---")
-
-    # --- summary pass ---
-    summary_log = []
-    # Iterate over a snapshot to avoid 'dictionary changed size' runtime errors
-    summary_items = list(results.items())
-    for domain, answer in summary_items:
-        summary_prompt = (
-            f"Summarize the following text in 3–4 crisp bullet points:\n\n{answer}"
-        )
-        bullets, model_used = qr.ask(summary_prompt, domain, model_override="gpt-3.5-turbo")
-        results[f"{domain}\u2011Summary"] = bullets
-        summary_log.append(f"Summarized [{domain}] into bullets.")
-    log.extend(summary_log)
-
-    # --- generate next steps ---
-    next_steps_prompt = (
-        "Based on all domain findings, list 3 concrete next steps "
-        "to move this R&D project forward."
-    )
-    next_steps, model_used = qr.ask(next_steps_prompt, "roadmap", model_override="gpt-3.5-turbo")
-    results["Next Steps"] = next_steps
-    log.append("Generated recommended next steps.")
-
-    # --- compile technical spec fields ---
-    req_prompt = (
-        f"Using the project request '{request}' and all domain findings, "
-        "list the key system requirements in bullet form."
-    )
-    requirements, model_used = qr.ask(req_prompt, "requirements", model_override="gpt-3.5-turbo")
-    results["requirements"] = requirements
-    log.append("Compiled requirements summary.")
+    say(f"--- All queries completed in {time.perf_counter() - research_started:.2f}s ---")
 
-    comp_prompt = (
-        "Provide a short component breakdown summarizing major subsystems "
-        "and their roles based on the research findings."
+    # --- post-research stages ---
+    findings = _findings_context(results)
+    # domain bullets are extracted locally; only long or poorly covered answers go to the LLM
+    answers, summary_jobs = list(results.items()), []
+    for domain, answer in answers:
+        key = f"{domain}\u2011Summary"
+        local = await asyncio.to_thread(summarizer.bullets, answer, 4)
+        if local is None:
+            summary_jobs.append((key, f"Summarize the following text in 3–4 crisp bullet points:\n\n{answer}", domain))
+        else:
+            results[key] = local
+            emit({"type": "answer", "key": key, "text": local})
+    stages = {
+        "summaries": {"after": ["research"], "jobs": summary_jobs},
+        "synthesis": {
+            "after": ["research"],
+            "jobs": [
+                (
+                    "Next Steps",
+                    "Based on all domain findings, list 3 concrete next steps "
+                    f"to move this R&D project forward.\n\n{findings}",
+                    "roadmap",
+                ),
+                (
+                    "requirements",
+                    f"Using the project request '{request}' and all domain findings, "
+                    f"list the key system requirements in bullet form.\n\n{findings}",
+                    "requirements",
+                ),
+                (
+                    "component_analysis",
+                    "Provide a short component breakdown summarizing major subsystems "
+                    f"and their roles based on the research findings.\n\n{findings}",
+                    "analysis",
+                ),
+                (
+                    "feasibility",
+                    "Assess overall feasibility in 2-3 sentences, including any major "
+                    f"risks or challenges mentioned in the research findings.\n\n{findings}",
+                    "feasibility",
+                ),
+            ],
+        },
+    }
+    if not summary_jobs:
+        del stages["summaries"]
+    stage_results = await run_stages(qr, stages, say, emit, done={"research"})
+    for outputs in stage_results.values():
+        results.update(outputs)
+    say(f"Summarized {len(answers)} domains into bullets "
+        f"({len(answers) - len(summary_jobs)} locally, {len(summary_jobs)} with the LLM).")
+    say("Generated next steps, requirements, component analysis and feasibility.")
+    say(qr.cache_summary())
+    say(qr.key_summary())
+    totals = telemetry.current_trace().totals()
+    say(
+        f"Tokens: {totals['prompt_tokens']} prompt ({totals['cached_tokens']} from the provider's prompt cache) / "
+        f"{totals['completion_tokens']} completion, {totals['retries']} retries; "
+        f"{totals['coalesced']} coalesced calls saved ~{totals['saved_tokens']} tokens"
     )
-    components, model_used = qr.ask(comp_prompt, "analysis", model_override="gpt-3.5-turbo")
-    results["component_analysis"] = components
-    log.append("Generated component analysis.")
-
-    feas_prompt = (
-        "Assess overall feasibility in 2-3 sentences, including any major "
-        "risks or challenges mentioned in the research findings."
-    )
-    feasibility, model_used = qr.ask(feas_prompt, "feasibility", model_override="gpt-3.5-turbo")
-    results["feasibility"] = feasibility
-    log.append("Evaluated feasibility.")
 
     # delete any placeholder that crept in
     results.pop("Next Steps Considerations", None)
 
-    return results, log
+    failed = [key for key, answer in results.items() if router.is_error(answer)]
+    if failed:
+        say(f"{len(failed)} queries failed: {', '.join(failed)}")
+    return results, log, failed
@@ -1,7 +1,14 @@
+from modules import domains
+
 
 def plan_request(request: str) -> list:
-    """Very simple keyword-based planner for demo purposes."""
-    req_lower = request.lower()
-    if "drone" in req_lower:
-        return ["Aerodynamics", "Sensors", "Battery", "Software", "Regulations"]
-    return ["General Research"]
+    """Domains to research for ``request``, from the domain registry.
+
+    Requests that match no registered topic are decomposed by the LLM when
+    ``PLANNER_LLM_FALLBACK`` is on; otherwise they get the fallback domains.
+    """
+    registry = domains.get_registry()
+    planned = registry.match(request)
+    if not planned and domains.LLM_FALLBACK:
+        planned = domains.decompose(request)
+    return planned or list(registry.fallback_domains)
@@ -1,9 +1,22 @@
 """
 polish.py – optional local LLM rewrite helper.
 If transformers / GPU not present it degrades to a no op.
+
+The model is loaded once per process on first use.  Drafts are split into
+paragraphs that fit the model's input window, polished in batches (optionally
+across a thread pool) and memoised by content hash, so unchanged paragraphs are
+never sent through the model twice.
 """
 
+import hashlib
 import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from modules import telemetry
 
 flag = os.environ.get("ENABLE_POLISH")
 if flag is None:
@@ -13,22 +26,140 @@ if flag is None:
         flag = "false"
 USE_POLISH = str(flag).lower() in ("1", "true", "yes")
 
+MODEL_NAME = os.environ.get("POLISH_MODEL", "google/flan-t5-base")
+BATCH_SIZE = int(os.environ.get("POLISH_BATCH_SIZE", "8"))
+WORKERS = int(os.environ.get("POLISH_WORKERS", "1"))
+MAX_WORDS = 300  # keeps prompt + paragraph inside flan-t5's 512 token window
+MIN_WORDS = 8  # headings and short lines are left untouched
+CACHE_SIZE = 4096
 
-def polish(text: str) -> str:
-    if not USE_POLISH:
-        return text  # no op
+PROMPT = (
+    "Rewrite the following text in formal, concise third person style, "
+    "eliminate redundancy, and fix grammar:\n\n"
+)
+
+_rewriter = None
+_load_lock = threading.Lock()
+_cache: "OrderedDict[str, str]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+# Timings of the most recent polish() call
+last_stats = {"load_seconds": 0.0, "inference_seconds": 0.0, "sections": 0, "polished": 0, "cached": 0}
+
+
+def _get_rewriter():
+    """Create the text2text pipeline once per process (thread-safe)."""
+    global _rewriter
+    if _rewriter is None:
+        with _load_lock:
+            if _rewriter is None:
+                from transformers import pipeline
+                started = time.perf_counter()
+                # small, local instr model; change to your own if desired
+                _rewriter = pipeline("text2text-generation", model=MODEL_NAME, device=-1)
+                last_stats["load_seconds"] = time.perf_counter() - started
+    return _rewriter
+
+
+def _split(text: str) -> list[str]:
+    """Split ``text`` into paragraphs, breaking overlong ones on sentence boundaries."""
+    pieces = []
+    for para in re.split(r"(\n\s*\n)", text):
+        if len(para.split()) <= MAX_WORDS:
+            pieces.append(para)
+            continue
+        chunk = []
+        for sentence in re.split(r"(?<=[.!?])\s+", para):
+            if chunk and len(" ".join(chunk + [sentence]).split()) > MAX_WORDS:
+                pieces.append(" ".join(chunk))
+                pieces.append(" ")
+                chunk = []
+            chunk.append(sentence)
+        if chunk:
+            pieces.append(" ".join(chunk))
+    return pieces
+
+
+def _key(text: str) -> str:
+    return hashlib.sha256(f"{MODEL_NAME}\0{text}".encode("utf-8")).hexdigest()
+
+
+def _cached(key: str):
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    return None
+
+
+def _remember(key: str, value: str):
+    with _cache_lock:
+        _cache[key] = value
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _rewrite_batch(rewriter, batch: list[str]) -> list[str]:
+    max_len = max(len(p.split()) for p in batch) + 32
+    outputs = rewriter([PROMPT + p for p in batch], max_length=max_len, truncation=True, batch_size=BATCH_SIZE)
+    return [o["generated_text"] for o in outputs]
+
+
+@telemetry.traced("polish.polish")
+def polish_many(texts: list[str]) -> list[str]:
+    """Polish several texts (e.g. report sections) with shared batches."""
+    if not USE_POLISH or not texts:
+        return list(texts)  # no op
+    stats = {"load_seconds": 0.0, "inference_seconds": 0.0, "sections": 0, "polished": 0, "cached": 0}
     try:
-        from transformers import pipeline
-        # small, local instr model; change to your own if desired
-        model_name = os.environ.get("POLISH_MODEL", "google/flan-t5-base")
-        rewriter = pipeline("text2text-generation", model=model_name, device=-1)
-        prompt = (
-            "Rewrite the following text in formal, concise third person style, "
-            "eliminate redundancy, and fix grammar:\n\n"
-        )
-        result = rewriter(prompt + text, max_length=len(text.split()) + 32, truncation=True)
-        return result[0]["generated_text"]
+        loaded = _rewriter is not None
+        rewriter = _get_rewriter()
+        if not loaded:
+            stats["load_seconds"] = last_stats["load_seconds"]
+
+        split = [_split(text) for text in texts]
+        todo: dict[str, str] = {}
+        for piece in (p for pieces in split for p in pieces):
+            if len(piece.split()) < MIN_WORDS:
+                continue
+            stats["sections"] += 1
+            key = _key(piece)
+            if _cached(key) is not None:
+                stats["cached"] += 1
+            else:
+                todo.setdefault(key, piece)
+
+        if todo:
+            started = time.perf_counter()
+            keys_, pending = list(todo), list(todo.values())
+            batches = [pending[i:i + BATCH_SIZE] for i in range(0, len(pending), BATCH_SIZE)]
+            if WORKERS > 1 and len(batches) > 1:
+                with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+                    results = list(pool.map(lambda b: _rewrite_batch(rewriter, b), batches))
+            else:
+                results = [_rewrite_batch(rewriter, b) for b in batches]
+            for key, out in zip(keys_, (o for batch in results for o in batch)):
+                _remember(key, out)
+            stats["inference_seconds"] = time.perf_counter() - started
+            stats["polished"] = len(todo)
+
+        last_stats.update(stats)
+        telemetry.annotate(**stats)
+        if stats["polished"] or stats["load_seconds"]:
+            print(
+                f"Polish: model load {stats['load_seconds']:.2f}s, inference {stats['inference_seconds']:.2f}s, "
+                f"{stats['polished']} polished / {stats['cached']} cached of {stats['sections']} sections"
+            )
+        return [
+            "".join((_cached(_key(p)) or p) if len(p.split()) >= MIN_WORDS else p for p in pieces)
+            for pieces in split
+        ]
     except Exception as e:
         # fallback to original in case model missing
         print("Polish skipped:", e)
-        return text
+        return list(texts)
+
+
+def polish(text: str) -> str:
+    return polish_many([text])[0]
@@ -0,0 +1,350 @@
+"""
+retrieval.py – pluggable vector retrieval for ``tools.semantic_search``.
+
+Two backends are available, selected with ``RETRIEVAL_BACKEND``:
+
+* ``local`` (default) – a float32 embedding matrix memory-mapped from
+  ``vault/index/`` plus a JSONL metadata store.  Search is an exact top-k over
+  batched dot products, or an IVF approximation (``RETRIEVAL_MODE=ivf``) that
+  only scans the closest clusters.  Appended rows join their nearest cluster;
+  the clusters are retrained after ``RETRIEVAL_IVF_REBUILD_GROWTH`` growth.
+* ``pinecone`` – the hosted index configured through secrets/env vars.
+
+Domain answers produced by the orchestrator are ingested automatically so later
+queries can retrieve them without a network round-trip for the search itself.
+"""
+
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from modules import embeddings, settings
+
+INDEX_DIR = Path(settings.get("RETRIEVAL_INDEX_DIR", "vault/index"))
+RETRIEVAL_MODE = settings.get("RETRIEVAL_MODE", "exact")  # or "ivf"
+IVF_PROBES = settings.get_int("RETRIEVAL_IVF_PROBES", 4)
+IVF_REBUILD_GROWTH = settings.get_float("RETRIEVAL_IVF_REBUILD_GROWTH", 0.5)  # retrain after 50% more rows
+SCAN_BATCH = 65536  # rows per dot-product batch
+CHUNK_CHARS = 800
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    if len(scores) <= k:
+        return np.argsort(-scores)
+    idx = np.argpartition(-scores, k)[:k]
+    return idx[np.argsort(-scores[idx])]
+
+
+class LocalIndex:
+    """Append-only embedding matrix on disk with a JSONL metadata sidecar.
+
+    Rows are L2-normalised so the dot product is the cosine similarity.  Writers
+    serialise on an ``flock`` and publish the new row count last, so concurrent
+    readers in other processes only ever map complete rows.
+    """
+
+    def __init__(self, path: Path = INDEX_DIR, mode: str = RETRIEVAL_MODE):
+        self.path = Path(path)
+        self.mode = mode
+        self.vectors_path = self.path / "embeddings.f32"
+        self.meta_path = self.path / "metadata.jsonl"
+        self.info_path = self.path / "index.json"
+        self.ivf_path = self.path / "ivf.npz"
+        self._lock = threading.Lock()
+        self._count = -1
+        self._matrix = None
+        self._metadata: list[dict] = []
+        self._hashes: set[str] = set()
+        self._ivf = None
+
+    # ---------------------------------------------------------------- #
+    # state
+    # ---------------------------------------------------------------- #
+    def _info(self) -> dict:
+        try:
+            return json.loads(self.info_path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {"dim": 0, "count": 0, "meta_bytes": 0}
+
+    def _refresh(self):
+        """Re-map the matrix and reload metadata if another writer appended rows."""
+        info = self._info()
+        if info["count"] == self._count:
+            return
+        count, dim = info["count"], info["dim"]
+        if count:
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(count, dim))
+        else:
+            self._matrix = None
+        metadata = []
+        if count:
+            with open(self.meta_path, encoding="utf-8") as f:
+                for line in f:
+                    if len(metadata) == count:
+                        break
+                    metadata.append(json.loads(line))
+        self._metadata = metadata
+        self._hashes = {m.get("hash") for m in metadata}
+        self._count = count
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return self._count
+
+    # ---------------------------------------------------------------- #
+    # writes
+    # ---------------------------------------------------------------- #
+    def contains(self, text_hash: str) -> bool:
+        with self._lock:
+            self._refresh()
+            return text_hash in self._hashes
+
+    def upsert(self, vectors, metadatas: list[dict]):
+        """Append normalised ``vectors`` with their ``metadatas`` (must carry ``hash``)."""
+        vectors = _normalize(vectors)
+        self.path.mkdir(parents=True, exist_ok=True)
+        with self._lock, open(self.path / ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._count = -1
+            self._refresh()
+            info = self._info()
+            if info["dim"] and info["dim"] != vectors.shape[1]:
+                raise ValueError(f"Embedding size {vectors.shape[1]} does not match index ({info['dim']}).")
+            keep = [i for i, m in enumerate(metadatas) if m.get("hash") not in self._hashes]
+            if not keep:
+                return
+            # truncate anything a crashed writer left past the published state, then append
+            with open(self.vectors_path, "r+b" if self.vectors_path.exists() else "wb") as f:
+                f.truncate(info["count"] * vectors.shape[1] * 4)
+                f.seek(0, os.SEEK_END)
+                f.write(vectors[keep].tobytes())
+            lines = "".join(json.dumps(metadatas[i]) + "\n" for i in keep).encode("utf-8")
+            with open(self.meta_path, "r+b" if self.meta_path.exists() else "wb") as f:
+                f.truncate(info["meta_bytes"])
+                f.seek(0, os.SEEK_END)
+                f.write(lines)
+            info = {
+                "dim": vectors.shape[1],
+                "count": info["count"] + len(keep),
+                "meta_bytes": info["meta_bytes"] + len(lines),
+            }
+            tmp = self.info_path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(info), encoding="utf-8")
+            os.replace(tmp, self.info_path)
+
+    # ---------------------------------------------------------------- #
+    # search
+    # ---------------------------------------------------------------- #
+    def _exact(self, query: np.ndarray, top_k: int, rows=None) -> list[tuple[int, float]]:
+        best_idx = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        candidates = np.arange(self._count) if rows is None else rows
+        for start in range(0, len(candidates), SCAN_BATCH):
+            batch = candidates[start:start + SCAN_BATCH]
+            if rows is None:
+                scores = self._matrix[batch[0]:batch[-1] + 1] @ query
+            else:
+                scores = self._matrix[batch] @ query
+            best_idx = np.concatenate([best_idx, batch])
+            best_scores = np.concatenate([best_scores, scores])
+            keep = _top_k(best_scores, top_k)
+            best_idx, best_scores = best_idx[keep], best_scores[keep]
+        return list(zip(best_idx.tolist(), best_scores.tolist()))
+
+    def _assign(self, centroids: np.ndarray, start: int = 0) -> np.ndarray:
+        """Nearest centroid of each row from ``start`` on."""
+        return np.concatenate([
+            np.argmax(self._matrix[s:min(s + SCAN_BATCH, self._count)] @ centroids.T, axis=1)
+            for s in range(start, self._count, SCAN_BATCH)
+        ])
+
+    def _build_ivf(self) -> tuple:
+        """sqrt(n) k-means centroids over a sample of the matrix, and every row's cluster."""
+        n_lists = max(1, int(np.sqrt(self._count)))
+        rng = np.random.default_rng(0)
+        sample = self._matrix[np.sort(rng.choice(self._count, size=min(self._count, n_lists * 64), replace=False))]
+        centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+        for _ in range(10):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(n_lists):
+                members = sample[labels == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = _normalize(centroids)
+        return centroids, self._assign(centroids), self._count
+
+    def _read_ivf(self) -> tuple | None:
+        try:
+            data = np.load(self.ivf_path)
+            return data["centroids"], data["assign"], int(data["built"])
+        except (FileNotFoundError, KeyError, ValueError, OSError):
+            return None
+
+    def _save_ivf(self, ivf: tuple):
+        """Publish ``ivf`` unless another process already saved clusters covering more rows."""
+        with open(self.path / ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            current = self._read_ivf()
+            if current is not None and len(current[1]) >= len(ivf[1]):
+                return
+            tmp = self.path / "ivf.tmp"
+            with open(tmp, "wb") as f:
+                np.savez(f, centroids=ivf[0], assign=ivf[1], built=ivf[2])
+            os.replace(tmp, self.ivf_path)
+
+    def _load_ivf(self):
+        """IVF clusters ``(centroids, assign, built)`` covering every row of the matrix.
+
+        Rows appended since the last update join their nearest existing
+        centroid; the centroids are retrained only once the index has grown by
+        ``IVF_REBUILD_GROWTH`` since they were built.
+        """
+        ivf = self._ivf if self._ivf is not None else self._read_ivf()
+        if ivf is not None and len(ivf[1]) > self._count:
+            # saved by a process that has seen more rows; usable if built on rows we have
+            ivf = (ivf[0], ivf[1][:self._count], ivf[2]) if ivf[2] <= self._count else None
+        if ivf is not None and len(ivf[1]) == self._count:
+            self._ivf = ivf
+            return ivf
+        if ivf is not None and self._count <= ivf[2] * (1 + IVF_REBUILD_GROWTH):
+            centroids, assign, built = ivf
+            ivf = (centroids, np.concatenate([assign, self._assign(centroids, len(assign))]), built)
+        else:
+            ivf = self._build_ivf()
+        self._save_ivf(ivf)
+        self._ivf = ivf
+        return ivf
+
+    def query(self, vector, top_k: int = 5) -> list[dict]:
+        """Return the ``top_k`` most similar entries as ``{"score", "metadata"}`` dicts."""
+        query = _normalize(vector)[0]
+        with self._lock:
+            self._refresh()
+            if not self._count:
+                return []
+            if self.mode == "ivf" and self._count > SCAN_BATCH // 16:
+                centroids, assign, _ = self._load_ivf()
+                probes = _top_k(centroids @ query, IVF_PROBES)
+                rows = np.flatnonzero(np.isin(assign, probes))
+                hits = self._exact(query, top_k, rows)
+            else:
+                hits = self._exact(query, top_k)
+            return [{"score": score, "metadata": self._metadata[i]} for i, score in hits]
+
+
+class PineconeBackend:
+    """Hosted Pinecone index configured from Streamlit secrets or env vars."""
+
+    def __init__(self):
+        try:
+            from pinecone import Pinecone
+        except ModuleNotFoundError:
+            raise ModuleNotFoundError(
+                "The 'pinecone' package is required for the pinecone retrieval backend."
+            )
+        api_key = settings.secret("pinecone_api_key") or settings.get("PINECONE_API_KEY")
+        index_name = settings.secret("pinecone_index") or settings.get("PINECONE_INDEX")
+        # an explicit data-plane host skips the index lookup (and allows local stand-ins)
+        host = settings.secret("pinecone_host") or settings.get("PINECONE_HOST")
+        if not api_key or not (host or index_name):
+            raise RuntimeError(
+                "Pinecone API key or index name not configured."
+            )
+        # current clients locate the index by name/host; ``environment`` is no longer accepted
+        self.client = Pinecone(api_key=api_key)
+        self.index = self.client.Index(host=host) if host else self.client.Index(index_name)
+
+    def contains(self, text_hash: str) -> bool:
+        return False  # upserts are idempotent by id
+
+    def upsert(self, vectors, metadatas: list[dict]):
+        self.index.upsert(vectors=[
+            {"id": m["hash"], "values": v.tolist(), "metadata": m}
+            for v, m in zip(np.atleast_2d(vectors), metadatas)
+        ])
+
+    def query(self, vector, top_k: int = 5) -> list[dict]:
+        result = self.index.query(vector=list(map(float, vector)), top_k=top_k, include_metadata=True)
+        matches = result.get("matches", []) if isinstance(result, dict) else getattr(result, "matches", [])
+        hits = []
+        for match in matches:
+            if isinstance(match, dict):
+                hits.append({"score": match.get("score"), "metadata": match.get("metadata") or {}})
+            else:
+                hits.append({"score": getattr(match, "score", None), "metadata": getattr(match, "metadata", None) or {}})
+        return hits
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Return the configured retrieval backend (process-wide singleton)."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            name = settings.get("RETRIEVAL_BACKEND", "local")
+            _backend = PineconeBackend() if name == "pinecone" else LocalIndex()
+    return _backend
+
+
+def _chunks(text: str) -> list[str]:
+    """Split ``text`` on paragraph boundaries into chunks of about CHUNK_CHARS."""
+    chunks, current = [], ""
+    for para in (p.strip() for p in text.split("\n\n")):
+        if not para:
+            continue
+        if current and len(current) + len(para) > CHUNK_CHARS:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{para}" if current else para
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def ingest(texts: list[str], metadata: dict | None = None) -> int:
+    """Chunk, embed and store ``texts``; already indexed chunks are skipped."""
+    backend = get_backend()
+    items = []
+    for text in texts:
+        for chunk in _chunks(text):
+            digest = hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+            if not backend.contains(digest):
+                items.append({**(metadata or {}), "text": chunk, "hash": digest})
+    if not items:
+        return 0
+    backend.upsert(embeddings.embed([m["text"] for m in items]), items)
+    return len(items)
+
+
+_ingest_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="retrieval-ingest")
+
+
+def ingest_in_background(domain: str, answer: str, source: str = ""):
+    """Queue a knowledge-base answer for ingestion without blocking the caller."""
+
+    def run():
+        try:
+            ingest([answer], {"domain": domain, "source": source})
+        except Exception as e:
+            print(f"Retrieval ingest skipped for {domain}: {e}")
+
+    return _ingest_pool.submit(run)
@@ -1,15 +1,31 @@
-import random
 import os
-import streamlit as st
-from functools import lru_cache
+import time
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from modules import tools  # to access semantic_search, fetch_image, summarize_text
+from modules import audit, cache, inflight, keys, memory, settings, summarizer, telemetry, tokens
 import json
 import datetime
+import uuid
+
+# openai/httpx are imported on first use to keep Streamlit reruns fast
+openai = None
+httpx = None
 
-try:
-    import openai
-except ModuleNotFoundError as e:
-    openai = None
+
+def _require_openai():
+    """Import the OpenAI SDK on first use and return it."""
+    global openai, httpx
+    if openai is None:
+        try:
+            import openai as openai_module
+            import httpx as httpx_module
+        except ModuleNotFoundError:
+            raise ModuleNotFoundError("The 'openai' package is required but not installed.")
+        openai, httpx = openai_module, httpx_module
+    return openai
 
 try:
     from config.config import OPENAI_API_KEYS as LOCAL_KEYS  # user-provided keys
@@ -21,7 +37,7 @@ except ImportError:
 
 def _load_api_keys() -> list:
     """Return API keys from Streamlit secrets, env vars or fallback config."""
-    keys = st.secrets.get("openai_api_keys")
+    keys = settings.secret("openai_api_keys")
     if isinstance(keys, str):
         keys = [k.strip() for k in keys.split(',') if k.strip()]
     if isinstance(keys, list) and keys:
@@ -35,222 +51,563 @@ def _load_api_keys() -> list:
 
     return LOCAL_KEYS
 
+MAX_CONCURRENCY_PER_KEY = settings.get_int("OPENAI_MAX_CONCURRENCY_PER_KEY", 4)
+REQUEST_TIMEOUT = settings.get_float("OPENAI_TIMEOUT", 120.0)
+TOOL_TIMEOUT = settings.get_float("TOOL_TIMEOUT", 30.0)  # seconds per tool call
+MAX_TOOL_ROUNDS = settings.get_int("MAX_TOOL_ROUNDS", 4)  # tool turns before an answer is forced
+TOOL_WORKERS = settings.get_int("TOOL_WORKERS", 8)
+
+# Tools block on network I/O, so they run here rather than on the caller's thread or event loop
+_tool_pool = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="tool")
+
+# Long-lived clients (and their HTTP connection pools), one per API key
+_sync_clients: dict = {}
+_async_clients: dict = {}
+_key_limits: dict = {}
+_clients_lock = threading.Lock()
+
+# Dedicated event loop so async clients keep their connections across rounds
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _event_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="router-loop", daemon=True).start()
+    return _loop
+
+
+def get_client(api_key: str):
+    """Return the shared synchronous client for ``api_key``."""
+    _require_openai()
+    with _clients_lock:
+        client = _sync_clients.get(api_key)
+        if client is None:
+            client = openai.OpenAI(
+                api_key=api_key,
+                timeout=REQUEST_TIMEOUT,
+                max_retries=0,  # retries are handled by the key scheduler
+                http_client=openai.DefaultHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=MAX_CONCURRENCY_PER_KEY,
+                        max_keepalive_connections=MAX_CONCURRENCY_PER_KEY,
+                    )
+                ),
+            )
+            _sync_clients[api_key] = client
+    return client
+
+
+def get_async_client(api_key: str):
+    """Return the shared async client for ``api_key`` (bound to the router loop)."""
+    _require_openai()
+    with _clients_lock:
+        client = _async_clients.get(api_key)
+        if client is None:
+            client = openai.AsyncOpenAI(
+                api_key=api_key,
+                timeout=REQUEST_TIMEOUT,
+                max_retries=0,  # retries are handled by the key scheduler
+                http_client=openai.DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=MAX_CONCURRENCY_PER_KEY,
+                        max_keepalive_connections=MAX_CONCURRENCY_PER_KEY,
+                    )
+                ),
+            )
+            _async_clients[api_key] = client
+    return client
+
+
+def complete(messages: list, model: str, temperature: float | None = None) -> str:
+    """One plain chat completion (no tools) on a scheduler-chosen key from the shared pool.
+
+    Blocking, with the scheduler's retries and backoff; call it off the router loop.
+    """
+    _require_openai()
+    api_keys = _load_api_keys()
+    if not api_keys:
+        raise RuntimeError("No OpenAI API keys found. Add them to Streamlit secrets or config/config.py.")
+    scheduler = keys.get_scheduler(api_keys)
+    est_tokens = _estimate_tokens(messages, model)
+    extra = {"temperature": temperature} if temperature is not None else {}
+    slot = scheduler.acquire(est_tokens)
+    try:
+        with telemetry.span("llm.completion", model=model, slot=slot) as sp:
+            client = get_client(api_keys[slot])
+            delay = scheduler.wait_time(slot)
+            for attempt in range(keys.MAX_RETRIES + 1):
+                if delay:
+                    time.sleep(delay)
+                try:
+                    raw = client.chat.completions.with_raw_response.create(model=model, messages=messages, **extra)
+                    break
+                except _retryable() as e:
+                    scheduler.record_failure(slot, _retry_after(e))
+                    if attempt == keys.MAX_RETRIES:
+                        raise
+                    sp.add("retries")
+                    delay = max(keys.backoff_delay(attempt + 1, _retry_after(e)), scheduler.wait_time(slot))
+            scheduler.record_headers(slot, raw.headers)
+            response = raw.parse()
+            usage = getattr(response, "usage", None)
+            scheduler.record_success(slot, getattr(usage, "total_tokens", 0) or 0, est_tokens)
+            sp.set(prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+                   completion_tokens=getattr(usage, "completion_tokens", 0) or 0)
+    finally:
+        scheduler.release(slot)
+    return response.choices[0].message.content or ""
+
+
+# Failed queries come back as answers with one of these prefixes
+ERROR_PREFIXES = ("Error: ", "Error after tool call: ")
+
+
+def is_error(answer: str) -> bool:
+    """Whether ``answer`` reports a failed query rather than model output."""
+    return answer.startswith(ERROR_PREFIXES)
+
+
+def _tool_timeout(name: str) -> float:
+    """Timeout for tool ``name``: ``TOOL_TIMEOUT_<NAME>`` if set, else ``TOOL_TIMEOUT``."""
+    return settings.get_float(f"TOOL_TIMEOUT_{name.upper()}", TOOL_TIMEOUT)
+
+
+def _key_limit(api_key: str) -> asyncio.Semaphore:
+    """Per-key semaphore capping concurrent in-flight requests on the router loop."""
+    limit = _key_limits.get(api_key)
+    if limit is None:
+        limit = _key_limits[api_key] = asyncio.Semaphore(MAX_CONCURRENCY_PER_KEY)
+    return limit
+
+
+def _estimate_tokens(messages: list, model: str = "gpt-4") -> int:
+    """Prompt size used to reserve token budget before the call."""
+    return tokens.count_messages(messages, model)
+
+
+def _retry_after(error) -> float | None:
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    return keys.parse_duration(response.headers.get("retry-after"))
+
+
+def _retryable():
+    return (
+        openai.RateLimitError,
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.InternalServerError,
+    )
+
+
+async def _collect_stream(stream, on_token) -> tuple[dict, object]:
+    """Consume a streamed completion, forwarding content deltas to ``on_token``.
+
+    Returns the assembled message and the usage block of the final chunk.
+    """
+    content, calls = [], {}  # tool call index -> {"id", "name", "arguments"}
+    usage = None
+    async for chunk in stream:
+        if chunk.usage:
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+            content.append(delta.content)
+            on_token(delta.content)
+        for part in delta.tool_calls or ():
+            call = calls.setdefault(part.index, {"id": None, "name": None, "arguments": []})
+            call["id"] = part.id or call["id"]
+            if part.function:
+                call["name"] = part.function.name or call["name"]
+                call["arguments"].append(part.function.arguments or "")
+    msg = {"role": "assistant", "content": "".join(content) or None}
+    if calls:
+        msg["tool_calls"] = [
+            _tool_call(c["id"], c["name"], "".join(c["arguments"])) for _, c in sorted(calls.items())
+        ]
+    return msg, usage
+
+
+def _tool_call(call_id: str, name: str, arguments: str) -> dict:
+    return {"id": call_id, "type": "function", "function": {"name": name, "arguments": arguments or "{}"}}
+
+
+def _message_dict(msg) -> dict:
+    """Normalize a completion message into a plain, JSON serialisable dict."""
+    if hasattr(msg, "model_dump"):
+        msg = msg.model_dump()
+    out = {"role": "assistant", "content": msg.get("content")}
+    calls = msg.get("tool_calls")
+    if calls:
+        out["tool_calls"] = [
+            _tool_call(c["id"], c["function"]["name"], c["function"].get("arguments")) for c in calls
+        ]
+    return out
+
+# Tool definitions and system prompt sent with every query.  Both are
+# module constants and come first in every request, so identical prefixes reach
+# the provider and its prompt cache can serve them.
+FUNCTION_SCHEMAS = [
+    {
+        "name": "semantic_search",
+        "description": "Search the knowledge base for relevant information by keyword.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "query": {"type": "string", "description": "The search query text."}
+            },
+            "required": ["query"],
+        },
+    },
+    {
+        "name": "fetch_image",
+        "description": "Fetch a relevant image URL for a given topic or query.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "query": {"type": "string", "description": "Description of the image to retrieve."}
+            },
+            "required": ["query"],
+        },
+    },
+    {
+        "name": "summarize_text",
+        "description": "Summarize a given text passage into a shorter form.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "text": {"type": "string", "description": "The text content to summarize."},
+                "sentences": {"type": "integer", "description": "Approximate number of sentences for the summary."},
+            },
+            "required": ["text"],
+        },
+    },
+]
+
+TOOL_SCHEMAS = [{"type": "function", "function": schema} for schema in FUNCTION_SCHEMAS]
+
+SYSTEM_PROMPT = (
+    "You are a knowledgeable R&D assistant. You have access to the following tools: "
+    "semantic_search (to lookup information), fetch_image (to find relevant images), "
+    "summarize_text (to condense information). Use these tools when appropriate, and provide clear, concise answers."
+)
+
+
 class QueryRouter:
     """Rotate through API keys (and optionally proxies) for each outbound query."""
 
-    def __init__(self):
-        if openai is None:
-            raise ModuleNotFoundError("The 'openai' package is required but not installed.")
+    def __init__(self, session_id: str | None = None):
+        _require_openai()
+        # Identifies the originating session in the audit log
+        self.session_id = session_id or uuid.uuid4().hex
         self.api_keys = _load_api_keys()
         if not self.api_keys:
             raise RuntimeError(
                 "No OpenAI API keys found. Add them to Streamlit secrets or config/config.py."
             )
-        self.key_index = random.randrange(len(self.api_keys))
-        # Register available tool functions for function calling:
+        # Shared scheduler picks the key with the most rate-limit headroom per query
+        self.scheduler = keys.get_scheduler(self.api_keys)
+        self.retries = 0
+        # Tools the model may call (see FUNCTION_SCHEMAS):
         self.tools = {
             "semantic_search": tools.semantic_search,
             "fetch_image": tools.fetch_image,
             "summarize_text": tools.summarize_text,
         }
-        # Define function schemas for GPT-4
-        self.function_schemas = [
-            {
-                "name": "semantic_search",
-                "description": "Search the knowledge base for relevant information by keyword.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "query": {"type": "string", "description": "The search query text."}
-                    },
-                    "required": ["query"],
-                },
-            },
-            {
-                "name": "fetch_image",
-                "description": "Fetch a relevant image URL for a given topic or query.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "query": {"type": "string", "description": "Description of the image to retrieve."}
-                    },
-                    "required": ["query"],
-                },
-            },
-            {
-                "name": "summarize_text",
-                "description": "Summarize a given text passage into a shorter form.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "text": {"type": "string", "description": "The text content to summarize."},
-                        "sentences": {"type": "integer", "description": "Approximate number of sentences for the summary."},
-                    },
-                    "required": ["text"],
-                },
-            },
-        ]
+        # Shared, byte-identical prefix: the provider's prompt cache can reuse it across sessions
+        self.tool_schemas = TOOL_SCHEMAS
+        self.base_system_prompt = SYSTEM_PROMPT
+        self.base_messages = [{"role": "system", "content": self.base_system_prompt}]
 
-        # Base system prompt describing assistant role and tools
-        self.base_system_prompt = (
-            "You are a knowledgeable R&D assistant. You have access to the following tools: "
-            "semantic_search (to lookup information), fetch_image (to find relevant images), "
-            "summarize_text (to condense information). Use these tools when appropriate, and provide clear, concise answers."
+        # Conversation history per domain, compacted by background summaries
+        self.memory = memory.ConversationMemory(self._summarize_history)
+
+        # Persistent response cache shared across sessions and processes
+        self.cache = cache.get_cache()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        # Identical requests in flight (this process or another) share one call
+        self.coalescer = inflight.get_coalescer()
+        self.coalesced_calls = 0
+        self.saved_tokens = 0
+
+
+    def _request_key(self, model_name: str, messages: list, tool_choice: str) -> str:
+        return cache.make_key(model_name, messages, self.tool_schemas, tool_choice=tool_choice)
+
+    async def _cache_lookup(self, model_name: str, messages: list, tool_choice: str = "auto",
+                            max_age: float | None = None):
+        """Return ``(key, message)`` from the response cache; message is None on a miss.
+
+        Cached responses older than ``max_age`` seconds count as misses.  The
+        SQLite read runs in a worker thread, off the shared event loop.
+        """
+        if self.cache is None:
+            return None, None
+        key = self._request_key(model_name, messages, tool_choice)
+        msg = await asyncio.to_thread(self.cache.get, key, max_age)
+        if msg is None:
+            self.cache_misses += 1
+        else:
+            self.cache_hits += 1
+        return key, msg
+
+    def _record_usage(self, slot: int, usage, est_tokens: int):
+        self.scheduler.record_success(slot, getattr(usage, "total_tokens", 0) or 0, est_tokens)
+        details = getattr(usage, "prompt_tokens_details", None)
+        telemetry.annotate(
+            prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+            completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+            cached_tokens=getattr(details, "cached_tokens", 0) or 0,  # served by the provider's prompt cache
         )
-        self.base_messages = [{"role": "system", "content": self.base_system_prompt}]
 
-        # Running conversation history (excluding the fixed system prompt)
-        self.conversation: list[dict] = []
+    def _coalesced(self, sp, msg: dict, model_name: str, messages: list) -> dict:
+        """Account for a result shared from an identical in-flight request."""
+        saved = _estimate_tokens(messages, model_name) + tokens.count(msg.get("content") or "", model_name)
+        self.coalesced_calls += 1
+        self.saved_tokens += saved
+        sp.set(coalesced=1, saved_tokens=saved)
+        return msg
+
+    def _record_response(self, slot: int, raw, est_tokens: int) -> dict:
+        self.scheduler.record_headers(slot, raw.headers)
+        response = raw.parse()
+        self._record_usage(slot, getattr(response, "usage", None), est_tokens)
+        return _message_dict(response.choices[0].message)
+
+    async def _acomplete(self, slot: int, model_name: str, messages: list, on_token=None,
+                         tool_choice: str = "auto", max_age: float | None = None) -> dict:
+        """Return the next assistant message, served from the response cache when possible.
+
+        Streams content to ``on_token`` when given.
+        """
+        with telemetry.span("llm.completion", model=model_name, slot=slot, streamed=bool(on_token)) as sp:
+            key, msg = await self._cache_lookup(model_name, messages, tool_choice, max_age)
+            sp.set(cache_hit=int(msg is not None))
+            if msg is None and self.coalescer is None:
+                return await self._arequest(sp, slot, model_name, messages, key, tool_choice, on_token)
+            if msg is None:
+                msg, streamed = await self._ashared(sp, slot, model_name, messages, key, tool_choice, on_token)
+                if streamed:
+                    return msg
+            if on_token and msg.get("content"):
+                on_token(msg["content"])
+            return msg
+
+    async def _ashared(self, sp, slot: int, model_name: str, messages: list, key: str | None,
+                       tool_choice: str, on_token=None) -> tuple[dict, bool]:
+        """Join an identical in-flight request, or lead it and share the result.
+
+        Also returns whether this call streamed the answer itself.  The
+        cross-process claim and polling use SQLite and run in worker threads.
+        """
+        flight = key or self._request_key(model_name, messages, tool_choice)
+        leader, shared = self.coalescer.join(flight)
+        if not leader:
+            return self._coalesced(sp, await asyncio.wrap_future(shared), model_name, messages), False
+        try:
+            msg, streamed = None, False
+            if self.cache is not None and not await asyncio.to_thread(self.coalescer.claim, flight):
+                msg = await self.coalescer.await_remote(flight, lambda: self.cache.get(key))
+                if msg is not None:
+                    msg = self._coalesced(sp, msg, model_name, messages)
+                else:
+                    await asyncio.to_thread(self.coalescer.claim, flight)  # the other process gave up
+            if msg is None:
+                msg = await self._arequest(sp, slot, model_name, messages, key, tool_choice, on_token)
+                streamed = True
+            shared.set_result(msg)
+            return msg, streamed
+        except BaseException as e:
+            shared.set_exception(e)
+            raise
+        finally:
+            self.coalescer.done(flight)
+            if self.cache is not None:
+                await asyncio.to_thread(self.coalescer.release, flight)
+
+    async def _arequest(self, sp, slot: int, model_name: str, messages: list, key: str | None,
+                        tool_choice: str, on_token=None) -> dict:
+        api_key = self.api_keys[slot]
+        client = get_async_client(api_key)
+        est_tokens = _estimate_tokens(messages, model_name)
+        stream_args = {"stream": True, "stream_options": {"include_usage": True}} if on_token else {}
+        streamed = []  # deltas forwarded by the current attempt
+
+        def forward(text):
+            streamed.append(text)
+            on_token(text)
+
+        delay = self.scheduler.wait_time(slot)
+        for attempt in range(keys.MAX_RETRIES + 1):
+            if delay:
+                await asyncio.sleep(delay)
+            try:
+                async with _key_limit(api_key):
+                    raw = await client.chat.completions.with_raw_response.create(
+                        model=model_name,
+                        messages=messages,
+                        tools=self.tool_schemas,
+                        tool_choice=tool_choice,
+                        **stream_args,
+                    )
+                    if on_token:
+                        self.scheduler.record_headers(slot, raw.headers)
+                        msg, usage = await _collect_stream(raw.parse(), forward)
+                        self._record_usage(slot, usage, est_tokens)
+                    else:
+                        msg = self._record_response(slot, raw, est_tokens)
+                break
+            except _retryable() as e:
+                self.scheduler.record_failure(slot, _retry_after(e))
+                if streamed:  # the retry streams from the start: drop the partial text
+                    on_token(None)
+                    streamed.clear()
+                if attempt == keys.MAX_RETRIES:
+                    raise
+                self.retries += 1
+                sp.add("retries")
+                delay = max(keys.backoff_delay(attempt + 1, _retry_after(e)),
+                            self.scheduler.wait_time(slot))
+        if key:
+            await asyncio.to_thread(self.cache.put, key, msg)
+        return msg
+
+    def cache_summary(self) -> str:
+        return (
+            f"Response cache: {self.cache_hits} hits, {self.cache_misses} misses; "
+            f"{self.coalesced_calls} identical in-flight calls coalesced (~{self.saved_tokens} tokens saved)"
+        )
 
-    @lru_cache(maxsize=128)
-    def _cached_completion(self, prompt: str, model_name: str) -> str:
-        client = openai.OpenAI(api_key=self.api_keys[self.key_index])
-        response = client.chat.completions.create(
-            model=model_name,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
+    def key_summary(self) -> str:
+        slots = ", ".join(
+            f"slot {s['slot']}: {s['served']} queries"
+            + (f", {s['retries']} retries" if s["retries"] else "")
+            + (" (cooling down)" if s["cooling_down"] else "")
+            for s in self.scheduler.snapshot()
         )
-        return response.choices[0].message.content.strip()
+        return f"Key usage: {slots}; {self.retries} retries this run"
 
     def call_tool(self, name: str, args: dict):
-        """Dispatch the function call to the appropriate tool and log the call."""
+        """Dispatch a tool call to the appropriate tool and log the call."""
         func = self.tools.get(name)
         if not func:
             raise ValueError(f"Unknown tool: {name}")
 
-        result = func(**args)
+        with telemetry.span("tool.call", key=name):
+            result = func(**args)
 
         log_entry = {
             "timestamp": datetime.datetime.now().isoformat(),
+            "session": self.session_id,
             "tool": name,
             "arguments": args,
             "result": result if len(str(result)) <= 200 else str(result)[:200] + "...",
         }
-        try:
-            log_path = "vault/audit_log.jsonl"
-            os.makedirs(os.path.dirname(log_path), exist_ok=True)
-            with open(log_path, "a", encoding="utf-8") as logf:
-                logf.write(json.dumps(log_entry) + "\n")
-        except Exception as e:
-            print(f"Logging error: {e}")
+        # queued for the background writer; never blocks the event loop
+        audit.get_log().record(log_entry)
 
         return result
 
-    def ask(self, prompt: str, domain: str, model_override: str | None = None) -> tuple[str, str]:
-        # Use GPT-4 by default for function-calling capable queries
-        model_name = model_override or "gpt-4"
+    def _safe_call(self, name: str, args: dict) -> str:
+        try:
+            return str(self.call_tool(name, args))
+        except Exception as e:  # reported back to the model instead of failing the query
+            return f"Tool error: {type(e).__name__}: {e}"
 
-        client = openai.OpenAI(api_key=self.api_keys[self.key_index])
-
-        # Build the message list with a fixed system prefix and running conversation
-        messages = self.base_messages + self.conversation + [{"role": "user", "content": prompt}]
-
-        # Summarize older conversation if it becomes too long
-        # Handle messages that may have `None` as the content (e.g. assistant
-        # function calls) by treating them as empty strings when counting
-        # characters.
-        total_chars = sum(len(m.get("content") or "") for m in messages)
-        if total_chars > 10000:
-            convo_text = ""
-            for m in self.conversation:
-                role = m.get("role")
-                content = m.get("content", "")
-                if role in ("user", "assistant") and content:
-                    convo_text += f"{role}: {content}\n"
-            summary = tools.summarize_text(convo_text, sentences=5)
-            summary_message = {
-                "role": "system",
-                "content": f"(Summary of earlier conversation: {summary})",
-            }
-            self.conversation = [summary_message]
-            messages = self.base_messages + self.conversation + [{"role": "user", "content": prompt}]
-
-        response = client.chat.completions.create(
-            model=model_name,
-            messages=messages,
-            functions=self.function_schemas,
-            function_call="auto",
+    def _submit_tool(self, call: dict):
+        function = call["function"]
+        try:
+            args = json.loads(function.get("arguments") or "{}")
+        except json.JSONDecodeError:
+            args = {}
+        # each call gets its own context copy so tool spans nest under the current query
+        return _tool_pool.submit(contextvars.copy_context().run, self._safe_call, function["name"], args)
+
+    async def arun_tools(self, calls: list) -> list[dict]:
+        """Run one turn's tool calls concurrently and return their ``tool`` messages.
+
+        Each call is bounded by its tool timeout; the event loop keeps serving
+        other queries meanwhile.
+        """
+        timeouts = [_tool_timeout(c["function"]["name"]) for c in calls]
+        results = await asyncio.gather(
+            *(asyncio.wait_for(asyncio.wrap_future(self._submit_tool(c)), t) for c, t in zip(calls, timeouts)),
+            return_exceptions=True,
         )
-        msg = response.choices[0].message
-
-        conversation = messages[:]
-        while getattr(msg, "function_call", None):
-            func_name = msg.function_call.name
-            args_json = getattr(msg.function_call, "arguments", "{}")
-            try:
-                args = json.loads(args_json)
-            except json.JSONDecodeError:
-                args = {}
-
-            result = self.call_tool(func_name, args)
-
-            conversation.append({"role": "assistant", "content": None, "function_call": msg.function_call.model_dump() if hasattr(msg.function_call, "model_dump") else {"name": msg.function_call.name, "arguments": args_json}})
-            conversation.append({"role": "function", "name": func_name, "content": str(result)})
-
-            response = client.chat.completions.create(
-                model=model_name,
-                messages=conversation,
-                functions=self.function_schemas,
-                function_call="auto",
-            )
-            msg = response.choices[0].message
-
-        answer = (msg.content or "").strip()
-        conversation.append({"role": "assistant", "content": answer})
-        # Persist conversation history (excluding the fixed system prompt)
-        self.conversation = conversation[1:]
+        messages = []
+        for call, timeout, result in zip(calls, timeouts, results):
+            if isinstance(result, TimeoutError):
+                result = f"Tool error: {call['function']['name']} timed out after {timeout:g}s"
+            elif isinstance(result, BaseException):
+                result = f"Tool error: {type(result).__name__}: {result}"
+            messages.append({"role": "tool", "tool_call_id": call["id"], "content": result})
+        return messages
+
+    def _summarize_history(self, transcript: str) -> str:
+        # compaction stays local: extractive, milliseconds, no network
+        return summarizer.summarize(transcript, sentences=5, escalate=False)
+
+    async def ask_async(self, prompt: str, domain: str, model_override: str | None = None,
+                        on_token=None, max_age: float | None = None) -> tuple[str, str]:
+        """Answer ``prompt`` in the context of ``domain``'s earlier turns.
+
+        The fixed system prefix comes first, then as much of the domain's
+        history as the model's token budget allows.  When ``on_token`` is
+        given the completion is streamed and each content delta is passed to
+        it as it arrives; if an interrupted stream is retried, ``on_token(None)``
+        is called first to discard the text received so far.  Cached
+        responses older than ``max_age`` seconds (the domain's freshness
+        policy) are not reused.
+        """
+        # Use GPT-4 by default for tool-calling capable queries
+        model_name = model_override or "gpt-4"
+        question = {"role": "user", "content": prompt}
+        fixed = tokens.count_messages(self.base_messages + [question], model_name, self.tool_schemas)
+        history = self.memory.window(domain, model_name, tokens.prompt_budget(model_name) - fixed)
+        messages = self.base_messages + history + [question]
 
-        self.key_index = (self.key_index + 1) % len(self.api_keys)
+        # One key serves every turn of this query
+        slot = self.scheduler.acquire(_estimate_tokens(messages, model_name))
+        try:
+            with telemetry.span("llm.ask", key=domain, model=model_name, slot=slot) as sp:
+                sp.set(history_tokens=tokens.count_messages(history, model_name) if history else 0)
+                answer, _ = await self._arun_turns(slot, model_name, messages, on_token, max_age)
+        finally:
+            self.scheduler.release(slot)
+
+        # Only the question and final answer are kept; tool transcripts are per-request scratch
+        if not is_error(answer):
+            self.memory.record(domain, prompt, answer, model_name)
         return answer, model_name
 
-    async def ask_async(self, prompt: str, domain: str) -> tuple[str, str]:
-        """Async version of ask() for concurrent execution."""
-        model_name = "gpt-4"
-        key = self.api_keys[self.key_index]
-        self.key_index = (self.key_index + 1) % len(self.api_keys)
-
-        messages = [
-            {"role": "system", "content": self.base_system_prompt},
-            {"role": "user", "content": prompt},
-        ]
-
+    async def _arun_turns(self, slot: int, model_name: str, messages: list, on_token=None,
+                          max_age: float | None = None) -> tuple[str, str]:
+        conversation = messages[:]
         try:
-            response = await openai.ChatCompletion.acreate(
-                model=model_name,
-                messages=messages,
-                functions=getattr(self, "function_schemas", None),
-                function_call="auto",
-                api_key=key,
-            )
+            msg = await self._acomplete(slot, model_name, conversation, on_token, max_age=max_age)
         except Exception as e:
             return f"Error: {e}", model_name
 
-        msg = response["choices"][0]["message"]
-        conversation = messages[:]
-        while getattr(msg, "function_call", None):
-            func_name = msg.function_call.name
-            args_json = getattr(msg.function_call, "arguments", "{}")
+        rounds = 0
+        while msg.get("tool_calls"):
+            conversation.append(msg)
+            conversation.extend(await self.arun_tools(msg["tool_calls"]))
+            rounds += 1
+            tool_choice = "none" if rounds >= MAX_TOOL_ROUNDS else "auto"
             try:
-                args = json.loads(args_json)
-            except json.JSONDecodeError:
-                args = {}
-
-            result = self.call_tool(func_name, args)
-            conversation.append({"role": "assistant", "content": None, "function_call": msg.function_call.model_dump() if hasattr(msg.function_call, "model_dump") else {"name": msg.function_call.name, "arguments": args_json}})
-            conversation.append({"role": "function", "name": func_name, "content": str(result)})
-
-            try:
-                response = await openai.ChatCompletion.acreate(
-                    model=model_name,
-                    messages=conversation,
-                    functions=self.function_schemas,
-                    function_call="auto",
-                    api_key=key,
-                )
+                msg = await self._acomplete(slot, model_name, conversation, on_token, tool_choice, max_age)
             except Exception as e:
-                return f"Error after function call: {e}", model_name
-
-            msg = response["choices"][0]["message"]
+                return f"Error after tool call: {e}", model_name
 
-        answer = (getattr(msg, "content", "") or "").strip()
+        telemetry.annotate(tool_rounds=rounds)
+        answer = (msg.get("content") or "").strip()
         return answer, model_name
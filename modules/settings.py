@@ -0,0 +1,50 @@
+"""Runtime settings lookup: environment first, then config/config.py, then a default."""
+
+import os
+
+
+def get(name: str, default=None):
+    """Return setting ``name`` from the environment or the local config module."""
+    value = os.environ.get(name)
+    if value is not None:
+        return value
+    for module in ("config.config", "config.config_template"):
+        try:
+            config = __import__(module, fromlist=[name])
+        except ImportError:
+            continue
+        if hasattr(config, name):
+            return getattr(config, name)
+    return default
+
+
+def secret(name: str, default=None):
+    """Return Streamlit secret ``name``, or ``default`` when no secrets are configured.
+
+    ``st.secrets`` raises when no ``secrets.toml`` exists (e.g. scripts and
+    benchmarks run outside ``streamlit run``), so lookups are guarded here.
+    """
+    try:
+        import streamlit as st
+
+        return st.secrets.get(name, default)
+    except Exception:
+        return default
+
+
+def get_int(name: str, default: int) -> int:
+    try:
+        return int(get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def get_float(name: str, default: float) -> float:
+    try:
+        return float(get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def get_bool(name: str, default: bool) -> bool:
+    return str(get(name, default)).lower() in ("1", "true", "yes")
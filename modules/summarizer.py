@@ -0,0 +1,148 @@
+"""
+summarizer.py – tiered text summarization.
+
+Texts up to ``SUMMARY_LOCAL_MAX_WORDS`` are summarized locally: sentences are
+scored with TextRank over TF-IDF vectors (NumPy) and the best ones are kept in
+their original order, which takes milliseconds and no network.  Longer texts,
+or local summaries that cover the text poorly (cosine similarity of the
+summary to the whole text below ``SUMMARY_MIN_QUALITY``), escalate to the LLM
+through the shared key pool; those results are cached by content hash in
+``vault/summaries.sqlite``.
+"""
+
+import functools
+import hashlib
+import re
+import threading
+
+import numpy as np
+
+from modules import cache, settings, telemetry
+
+LOCAL_MAX_WORDS = settings.get_int("SUMMARY_LOCAL_MAX_WORDS", 1500)
+MIN_QUALITY = settings.get_float("SUMMARY_MIN_QUALITY", 0.5)
+SUMMARY_CACHE_PATH = settings.get("SUMMARY_CACHE_PATH", "vault/summaries.sqlite")
+LLM_MODEL = "gpt-3.5-turbo"
+DAMPING = 0.85
+
+STOPWORDS = frozenset(
+    "a an and are as at be been but by can for from has have in into is it its may more most not of on or "
+    "such that the their them then there these they this to was were which while will with would also than "
+    "should could each other any all both over under very".split()
+)
+_SENTENCE = re.compile(r"(?<=[.!?])\s+(?=[\"'(\[A-Z0-9*-])|\n\s*\n|\n(?=\s*(?:[-*•]|\d+[.)])\s)")
+
+
+def split_sentences(text: str) -> list[str]:
+    """Sentences (and list items) of ``text``, stripped of bullet markers."""
+    parts = (re.sub(r"^\s*(?:[-*•]|\d+[.)])\s+", "", p).strip() for p in _SENTENCE.split(text))
+    return [p for p in parts if p]
+
+
+def _vectors(sentences: list[str]) -> np.ndarray:
+    """Row-normalized TF-IDF matrix of ``sentences``."""
+    vocab: dict[str, int] = {}
+    rows, cols = [], []
+    for i, sentence in enumerate(sentences):
+        for word in re.findall(r"[a-z0-9]+", sentence.lower()):
+            if word not in STOPWORDS and len(word) > 1:
+                rows.append(i)
+                cols.append(vocab.setdefault(word, len(vocab)))
+    counts = np.zeros((len(sentences), max(len(vocab), 1)), dtype=np.float32)
+    np.add.at(counts, (rows, cols), 1.0)
+    df = np.count_nonzero(counts, axis=0)
+    matrix = counts * (np.log((1 + len(sentences)) / (1 + df)) + 1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def _textrank(matrix: np.ndarray, iterations: int = 50) -> np.ndarray:
+    similarity = matrix @ matrix.T
+    np.fill_diagonal(similarity, 0.0)
+    totals = similarity.sum(axis=1, keepdims=True)
+    transition = np.divide(similarity, totals, out=np.zeros_like(similarity), where=totals > 0)
+    n = len(matrix)
+    scores = np.full(n, 1.0 / n, dtype=np.float32)
+    for _ in range(iterations):
+        updated = (1 - DAMPING) / n + DAMPING * (transition.T @ scores)
+        if np.abs(updated - scores).sum() < 1e-6:
+            return updated
+        scores = updated
+    return scores
+
+
+def _coverage(matrix: np.ndarray, picked: list[int]) -> float:
+    """Cosine similarity between the picked sentences and the whole text."""
+    whole, part = matrix.sum(axis=0), matrix[picked].sum(axis=0)
+    denom = np.linalg.norm(whole) * np.linalg.norm(part)
+    return float(whole @ part / denom) if denom else 0.0
+
+
+@functools.lru_cache(maxsize=512)
+def extract(text: str, sentences: int = 3) -> tuple[tuple[str, ...], float]:
+    """The ``sentences`` top-ranked sentences in text order, and their coverage score."""
+    parts = split_sentences(text)
+    if len(parts) <= sentences:
+        return tuple(parts), 1.0
+    matrix = _vectors(parts)
+    scores = _textrank(matrix)
+    picked = sorted(np.argsort(-scores, kind="stable")[:sentences].tolist())
+    return tuple(parts[i] for i in picked), _coverage(matrix, picked)
+
+
+def local(text: str, sentences: int = 3) -> list[str] | None:
+    """Extractive summary, or ``None`` when the text should go to the LLM."""
+    if len(text.split()) > LOCAL_MAX_WORDS:
+        return None
+    picked, quality = extract(text, sentences)
+    return list(picked) if quality >= MIN_QUALITY else None
+
+
+def bullets(text: str, count: int = 4) -> str | None:
+    """Local bullet-point summary, or ``None`` when the text needs the LLM."""
+    picked = local(text, count)
+    return "\n".join(f"- {sentence}" for sentence in picked) if picked is not None else None
+
+
+_cache = None
+_lock = threading.Lock()
+
+
+def _summary_cache() -> cache.ResponseCache:
+    global _cache
+    with _lock:
+        if _cache is None:
+            _cache = cache.ResponseCache(path=SUMMARY_CACHE_PATH)
+    return _cache
+
+
+def _llm_summary(text: str, sentences: int) -> str:
+    key = hashlib.sha256(f"{LLM_MODEL}\0{sentences}\0{text}".encode("utf-8")).hexdigest()
+    store = _summary_cache()
+    summary = store.get(key)
+    if summary is not None:
+        telemetry.annotate(tier="cache")
+        return summary
+    from modules import router  # late import: router imports tools, which import us
+
+    prompt = f"Please summarize the following text in about {sentences} sentences:\n\n{text}"
+    summary = router.complete([{"role": "user", "content": prompt}], LLM_MODEL, temperature=0.7).strip()
+    store.put(key, summary)
+    telemetry.annotate(tier="llm")
+    return summary
+
+
+@telemetry.traced("summarizer.summarize")
+def summarize(text: str, sentences: int = 3, escalate: bool = True) -> str:
+    """Summarize ``text`` locally when possible, otherwise with the LLM (cached).
+
+    With ``escalate=False`` the local summary is always used.
+    """
+    picked = local(text, sentences)
+    if picked is None and escalate:
+        try:
+            return _llm_summary(text, sentences)
+        except Exception as e:
+            print(f"LLM summary failed, using the extractive one: {e}")
+    telemetry.annotate(tier="local")
+    return " ".join(picked if picked is not None else extract(text, sentences)[0])
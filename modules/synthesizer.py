@@ -1,56 +1,247 @@
 """
 Advanced Synthesizer – multi format, template driven, with QA and versioning.
+
+Drafts are handled section by section (a section starts at a template heading
+or a markdown heading).  Polished sections are cached by content hash in
+``vault/sections.sqlite``, so a re-run only polishes the sections whose text
+changed, and ``vault/drafts`` stores each section once – a draft is a small
+manifest of section hashes.
+
+Templates are compiled once per process together with their metadata from
+``synthesizer_templates/manifest.json`` (selection keywords, required sections,
+context keys).  QA checks placeholders and required sections in one regex
+sweep; context keys that rendered empty are logged and recorded on the render
+span.  Render and QA are timed as their own spans.
 """
 
 import hashlib, datetime, os, re, json
+from functools import lru_cache
 from pathlib import Path
-from jinja2 import Environment, FileSystemLoader, select_autoescape
-from modules import polish
+from contextvars import ContextVar
+from jinja2 import Environment, FileSystemLoader, Undefined, meta, select_autoescape
+from modules import cache, polish, settings, telemetry
 
 TEMPLATE_DIR = Path("synthesizer_templates")
 DRAFT_DIR = Path("vault/drafts")
-DRAFT_DIR.mkdir(parents=True, exist_ok=True)
+SECTION_CACHE_PATH = settings.get("SECTION_CACHE_PATH", "vault/sections.sqlite")
+MARKDOWN_HEADING = re.compile(r"^#{1,6}\s")
+PLACEHOLDERS = re.compile(r"(?i:TBD|to be decided|<placeholder>|lorem ipsum|\?\?\?)")
+
+
+class RecordingUndefined(Undefined):
+    """Renders missing context values as empty text and records their names."""
+
+    def __str__(self):
+        _note_missing(self._undefined_name)
+        return ""
+
+    def __iter__(self):
+        _note_missing(self._undefined_name)
+        return iter(())
+
+
+_missing: ContextVar[set | None] = ContextVar("synthesizer_missing", default=None)
+
+
+def _note_missing(name):
+    seen = _missing.get()
+    if seen is not None and name:
+        seen.add(name)
+
+
+@lru_cache(maxsize=None)
+def get_env() -> Environment:
+    """Process-wide Jinja environment, created on first use."""
+    return Environment(
+        loader=FileSystemLoader(str(TEMPLATE_DIR)),
+        autoescape=select_autoescape(enabled_extensions=("html",)),
+        undefined=RecordingUndefined,
+    )
+
+
+def qa_pattern(required_sections=()) -> re.Pattern:
+    """One regex for placeholder text and required section names (anywhere in the text)."""
+    pattern = PLACEHOLDERS.pattern
+    if required_sections:
+        names = "|".join(re.escape(sec) for sec in sorted(required_sections, key=len, reverse=True))
+        pattern += f"|(?P<section>{names})"
+    return re.compile(pattern)
+
+
+class CompiledTemplate:
+    """A template compiled once, with the metadata declared in ``manifest.json``."""
+
+    def __init__(self, key: str, spec: dict):
+        env = get_env()
+        source = env.loader.get_source(env, f"{key}.md.j2")[0]
+        self.key = key
+        self.template = env.get_template(f"{key}.md.j2")
+        self.keywords = tuple(spec.get("keywords", ()))
+        self.required_sections = tuple(spec.get("required_sections", ()))
+        self.context = tuple(spec.get("context", ()))
+        self.optional = tuple(spec.get("optional", ()))
+        self.headings = frozenset(
+            line.strip() for line in source.splitlines()
+            if line.strip() and "{{" not in line and "{%" not in line
+        )
+        self.qa = qa_pattern(self.required_sections)
+        undeclared = meta.find_undeclared_variables(env.parse(source)) - set(self.context) - set(self.optional)
+        if undeclared:
+            print(f"Synthesizer: {key} uses undeclared context keys: {', '.join(sorted(undeclared))}")
+
+    def render(self, ctx: dict) -> tuple[str, list[str]]:
+        """Rendered text and the context keys that were missing (rendered empty)."""
+        token = _missing.set(set())
+        try:
+            text = self.template.render(ctx)
+            missing = sorted(_missing.get())
+        finally:
+            _missing.reset(token)
+        return text, missing
+
+    def check(self, text: str) -> list[str]:
+        return qa_check(text, self.required_sections, self.qa)
+
+
+@lru_cache(maxsize=None)
+def load_manifest() -> dict:
+    """Template metadata from ``manifest.json``: keywords, required sections, context keys."""
+    return json.loads((TEMPLATE_DIR / "manifest.json").read_text(encoding="utf-8"))
+
+
+@lru_cache(maxsize=None)
+def load_templates() -> dict[str, CompiledTemplate]:
+    """Compile every template in the manifest (once per process); call early to warm up."""
+    return {key: CompiledTemplate(key, spec) for key, spec in load_manifest()["templates"].items()}
+
+
+def get_template(template_key: str) -> CompiledTemplate:
+    """Compiled template for ``template_key``."""
+    return load_templates()[template_key]
 
-env = Environment(
-    loader=FileSystemLoader(str(TEMPLATE_DIR)),
-    autoescape=select_autoescape(enabled_extensions=("html",))
-)
+
+def template_headings(template_key: str) -> frozenset:
+    """Literal lines of the template (its section titles and footer)."""
+    return get_template(template_key).headings
+
+
+def split_sections(text: str, headings=frozenset()) -> list[str]:
+    """Split ``text`` before each heading line; ``"".join()`` of the result is ``text``."""
+    sections, current, fenced = [], [], False
+    for line in text.splitlines(keepends=True):
+        if line.lstrip().startswith("```"):
+            fenced = not fenced
+        elif current and not fenced and (MARKDOWN_HEADING.match(line) or line.strip() in headings):
+            sections.append("".join(current))
+            current = []
+        current.append(line)
+    if current:
+        sections.append("".join(current))
+    return sections
+
+
+def section_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
 # --------------------------------------------------------------------- #
 # Helper – template inference
 # --------------------------------------------------------------------- #
 def choose_template_type(prompt: str) -> str:
+    """First template (in manifest order) with a keyword in ``prompt``, else the default."""
     p = prompt.lower()
-    if "strategic plan" in p or "business plan" in p:
-        return "strategic_plan"
-    if "design spec" in p or "architecture" in p or any(k in p for k in ("design", "build", "develop")):
-        return "technical_spec"
-    if "prototype" in p or "code" in p:
-        return "code_prototype"
-    if "summary" in p or "research" in p:
-        return "research_summary"
-    if "slides" in p or "presentation" in p:
-        return "slide_deck"
-    return "research_summary"  # safe default
+    for key, compiled in load_templates().items():
+        if any(k in p for k in compiled.keywords):
+            return key
+    return load_manifest().get("default", "research_summary")
 
 # --------------------------------------------------------------------- #
 # Helper – QA checks
 # --------------------------------------------------------------------- #
-PLACEHOLDERS = re.compile(r"(TBD|to be decided|<placeholder>|lorem ipsum|\?\?\?)", re.I)
-
-def qa_check(text: str, required_sections=None):
-    issues = []
-    if PLACEHOLDERS.search(text):
-        issues.append("Placeholder text detected.")
-    if required_sections:
-        for sec in required_sections:
-            if sec not in text:
-                issues.append(f"Missing section: {sec}")
+def qa_check(text: str, required_sections=None, pattern: re.Pattern | None = None) -> list[str]:
+    """Placeholder and missing-section issues of ``text``, found in one sweep."""
+    required = tuple(required_sections or ())
+    pattern = pattern or qa_pattern(required)
+    placeholder, found = False, set()
+    for match in pattern.finditer(text):
+        if match.lastgroup == "section":
+            found.add(match.group("section"))
+        else:
+            placeholder = True
+        if placeholder and len(found) == len(required):
+            break
+    issues = ["Placeholder text detected."] if placeholder else []
+    issues += [f"Missing section: {sec}" for sec in required if sec not in found]
     return issues
 
+# --------------------------------------------------------------------- #
+# Helper – section cache and draft store
+# --------------------------------------------------------------------- #
+_section_cache = None
+
+
+def _get_section_cache() -> cache.ResponseCache:
+    global _section_cache
+    if _section_cache is None:
+        _section_cache = cache.ResponseCache(path=SECTION_CACHE_PATH)
+    return _section_cache
+
+
+def polish_sections(sections: list[str]) -> list[str]:
+    """Polish ``sections``, reusing the cached output of unchanged ones."""
+    if not polish.USE_POLISH:
+        return list(sections)
+    store = _get_section_cache()
+    keys = [section_hash(f"{polish.MODEL_NAME}\0{text}") for text in sections]
+    out = [store.get(key) for key in keys]
+    changed = [i for i, value in enumerate(out) if value is None]
+    if changed:
+        for i, value in zip(changed, polish.polish_many([sections[i] for i in changed])):
+            out[i] = value
+            store.put(keys[i], value)
+    telemetry.annotate(sections=len(sections), sections_changed=len(changed))
+    print(f"Synthesizer: {len(changed)} of {len(sections)} sections changed")
+    return out
+
+
+def save_draft(sections: list[str], template_key: str) -> Path:
+    """Store ``sections`` under ``DRAFT_DIR`` and log the draft's SHA256.
+
+    Section texts are content addressed (``sections/<sha256>.md``), so a
+    re-run writes only the sections that changed plus a small manifest.
+    """
+    chunk_dir = DRAFT_DIR / "sections"
+    chunk_dir.mkdir(parents=True, exist_ok=True)
+    hashes = []
+    for text in sections:
+        digest = section_hash(text)
+        path = chunk_dir / f"{digest}.md"
+        if not path.exists():
+            tmp = chunk_dir / f".{digest}.{os.getpid()}.tmp"
+            tmp.write_text(text, encoding="utf-8")
+            os.replace(tmp, path)
+        hashes.append(digest)
+    ts = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    sha = hashlib.sha256("".join(sections).encode()).hexdigest()
+    fname = DRAFT_DIR / f"draft_{ts}.json"
+    fname.write_text(json.dumps({"template": template_key, "sha256": sha, "sections": hashes}), encoding="utf-8")
+    with open(DRAFT_DIR / "drafts_log.txt", "a", encoding="utf-8") as log:
+        log.write(f"{ts} {fname.name} SHA256:{sha}\n")
+    return fname
+
+
+def load_draft(path) -> str:
+    """Reassemble a stored draft (``draft_<ts>.json``; older ``.md`` drafts are read as is)."""
+    path = Path(path)
+    if path.suffix == ".md":
+        return path.read_text(encoding="utf-8")
+    manifest = json.loads(path.read_text(encoding="utf-8"))
+    chunk_dir = path.parent / "sections"
+    return "".join((chunk_dir / f"{digest}.md").read_text(encoding="utf-8") for digest in manifest["sections"])
+
 # --------------------------------------------------------------------- #
 # Main synthesize entry point
 # --------------------------------------------------------------------- #
+@telemetry.traced("synthesizer.synthesize")
 def synthesize(project_name: str,
                user_prompt: str,
                data: dict,
@@ -63,37 +254,34 @@ def synthesize(project_name: str,
     Returns markdown string.
     """
     template_key = choose_template_type(user_prompt)
-    template_path = f"{template_key}.md.j2"
-    template = env.get_template(template_path)
+    template = get_template(template_key)
 
     ctx = {"project_name": project_name, **data, **(artifacts or {})}
-    draft = template.render(ctx)
+    with telemetry.span("synthesizer.render", template=template_key) as sp:
+        draft, missing = template.render(ctx)
+        sp.set(missing_context=len(missing))
+        if missing:
+            sp.set(missing_keys=", ".join(missing))
+            print(f"Synthesizer: {template_key} rendered without context: {', '.join(missing)}")
 
     # ----------------------------------------------------- #
-    # internal QA / placeholder scan
+    # internal QA – placeholders and sections in one sweep
     # ----------------------------------------------------- #
-    required = None
-    if template_key == "technical_spec":
-        required = ["Requirements", "Architecture", "Feasibility"]
-    issues = qa_check(draft, required)
+    with telemetry.span("synthesizer.qa", template=template_key) as sp:
+        issues = template.check(draft)
+        sp.set(issues=len(issues))
 
     if issues:
-        warn_block = "\n".join(f"> **QA Warning:** {issue}" for issue in issues)
-        draft += "\n\n" + warn_block
+        draft = "\n\n".join([draft, "\n".join(f"> **QA Warning:** {issue}" for issue in issues)])
 
     # ----------------------------------------------------- #
-    # optional local LLM polish
+    # optional local LLM polish – only changed sections
     # ----------------------------------------------------- #
-    draft = polish.polish(draft)
+    sections = polish_sections(split_sections(draft, template_headings(template_key)))
 
     # ----------------------------------------------------- #
     # versioning
     # ----------------------------------------------------- #
-    ts = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
-    fname = DRAFT_DIR / f"draft_{ts}.md"
-    fname.write_text(draft, encoding="utf-8")
-    sha = hashlib.sha256(draft.encode()).hexdigest()
-    with open(DRAFT_DIR / "drafts_log.txt", "a", encoding="utf-8") as log:
-        log.write(f"{ts} {fname.name} SHA256:{sha}\n")
+    save_draft(sections, template_key)
 
-    return draft
+    return "".join(sections)
@@ -0,0 +1,270 @@
+"""
+telemetry.py – lightweight tracing and metrics for the research loop.
+
+Spans nest through ``contextvars`` (so concurrent asyncio tasks each get their
+own parent) and are collected on the active ``Trace`` for the per-run waterfall.
+Finished spans are exported to ``vault/traces.jsonl`` by the batched JSONL
+writer and folded into Prometheus-style metrics, which are written to
+``vault/metrics.prom`` and optionally served over HTTP (``TELEMETRY_PORT``).
+
+Span attributes never include API keys – only the key *slot*.
+"""
+
+import contextvars
+import datetime
+import functools
+import inspect
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from modules import audit, settings
+
+TRACE_PATH = Path(settings.get("TELEMETRY_TRACE_PATH", "vault/traces.jsonl"))
+METRICS_PATH = Path(settings.get("TELEMETRY_METRICS_PATH", "vault/metrics.prom"))
+METRICS_PORT = settings.get_int("TELEMETRY_PORT", 0)
+
+# numeric span attributes that are also accumulated as counters
+COUNTED = ("prompt_tokens", "completion_tokens", "cached_tokens", "cache_hit", "coalesced", "saved_tokens", "retries")
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Span:
+    def __init__(self, name: str, trace, parent, attrs: dict):
+        self.name = name
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.depth = parent.depth + 1 if parent else 0
+        self.attrs = dict(attrs)
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        self.duration = None
+        self.status = "ok"
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, key: str, amount=1):
+        self.attrs[key] = self.attrs.get(key, 0) + amount
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace.trace_id if self.trace else None,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            # local ISO time like audit records, so AuditLog can rotate and filter traces by age
+            "timestamp": datetime.datetime.fromtimestamp(self.start).isoformat(),
+            "duration": self.duration,
+            "status": self.status,
+            "attrs": self.attrs,
+        }
+
+
+class Trace:
+    """Collects the spans of one run for the waterfall view."""
+
+    def __init__(self, name: str, **attrs):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.attrs = attrs
+        self.started = time.time()
+        self.spans: list[Span] = []
+        self._lock = threading.Lock()
+
+    def _add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def waterfall(self) -> list[dict]:
+        """Finished spans as rows with offsets (ms) relative to the trace start."""
+        with self._lock:
+            spans = [s for s in self.spans if s.duration is not None]
+        rows = []
+        for s in sorted(spans, key=lambda s: s.start):
+            offset = (s.start - self.started) * 1000
+            rows.append({
+                "span": s.name,
+                "depth": s.depth,
+                "label": "  " * s.depth + s.name + (f" [{s.attrs['key']}]" if "key" in s.attrs else ""),
+                "start_ms": round(offset, 1),
+                "end_ms": round(offset + s.duration * 1000, 1),
+                "duration_ms": round(s.duration * 1000, 1),
+                "attrs": s.attrs,
+            })
+        return rows
+
+    def totals(self) -> dict:
+        """Sum of the counted attributes over every span of the run."""
+        out = dict.fromkeys(COUNTED, 0)
+        with self._lock:
+            for s in self.spans:
+                if s.name != "llm.completion":
+                    continue  # tokens are recorded once, on the completion span
+                for key in COUNTED:
+                    value = s.attrs.get(key)
+                    if isinstance(value, (int, float)):
+                        out[key] += value
+        return out
+
+    def usage_by_model(self) -> dict:
+        """Prompt and completion tokens of the run's completions, per model."""
+        out: dict[str, dict] = {}
+        with self._lock:
+            for s in self.spans:
+                if s.name != "llm.completion":
+                    continue
+                usage = out.setdefault(s.attrs.get("model", "unknown"), {"prompt_tokens": 0, "completion_tokens": 0})
+                for key in usage:
+                    value = s.attrs.get(key)
+                    if isinstance(value, (int, float)):
+                        usage[key] += value
+        return out
+
+
+@contextmanager
+def activate(trace: Trace):
+    """Make ``trace`` the collector for spans opened in this context."""
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time a block as a child of the current span."""
+    parent = _current_span.get()
+    trace = _current_trace.get()
+    s = Span(name, trace, parent, attrs)
+    if trace is not None:
+        trace._add(s)
+    token = _current_span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.status = f"error: {type(e).__name__}"
+        raise
+    finally:
+        s.duration = time.perf_counter() - s._t0
+        _current_span.reset(token)
+        _export(s)
+
+
+def current() -> Span | None:
+    return _current_span.get()
+
+
+def current_trace() -> Trace | None:
+    return _current_trace.get()
+
+
+def annotate(**attrs):
+    """Set attributes on the current span, if any."""
+    s = _current_span.get()
+    if s is not None:
+        s.set(**attrs)
+
+
+def traced(name: str):
+    """Decorator wrapping a sync or async function in a span."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# --------------------------------------------------------------------- #
+# export: JSONL spans + Prometheus text metrics
+# --------------------------------------------------------------------- #
+_writer = None
+_metrics_lock = threading.Lock()
+_histograms: dict = {}  # span name -> [count, sum]
+_counters: dict = {}  # (metric, span name) -> value
+
+
+def _export(s: Span):
+    global _writer
+    with _metrics_lock:
+        count_sum = _histograms.setdefault(s.name, [0, 0.0])
+        count_sum[0] += 1
+        count_sum[1] += s.duration
+        for key in COUNTED:
+            value = s.attrs.get(key)
+            if isinstance(value, (int, float)) and value:
+                _counters[(key, s.name)] = _counters.get((key, s.name), 0) + value
+        if _writer is None:
+            _writer = audit.AuditLog(path=TRACE_PATH)
+            if METRICS_PORT:
+                serve_metrics(METRICS_PORT)
+        root = s.parent_id is None
+    _writer.record(s.to_dict())
+    if root:
+        write_metrics()
+
+
+def metrics_text() -> str:
+    """Render the collected metrics in the Prometheus text exposition format."""
+    lines = [
+        "# HELP pilot_span_seconds Latency of instrumented operations.",
+        "# TYPE pilot_span_seconds summary",
+    ]
+    with _metrics_lock:
+        for name, (count, total) in sorted(_histograms.items()):
+            lines.append(f'pilot_span_seconds_count{{span="{name}"}} {count}')
+            lines.append(f'pilot_span_seconds_sum{{span="{name}"}} {total:.6f}')
+        for key in COUNTED:
+            lines.append(f"# TYPE pilot_{key}_total counter")
+            for (metric, name), value in sorted(_counters.items()):
+                if metric == key:
+                    lines.append(f'pilot_{key}_total{{span="{name}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path: Path = METRICS_PATH):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(metrics_text(), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def serve_metrics(port: int):
+    """Serve ``/metrics`` on ``port`` from a daemon thread."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics_text().encode("utf-8")
+            self.send_response(200 if self.path.startswith("/metrics") else 404)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    except OSError as e:  # another process already serves it
+        print(f"Metrics endpoint not started: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
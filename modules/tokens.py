@@ -0,0 +1,115 @@
+"""
+tokens.py – token counting, per-model context budgets and prices.
+
+Counts use ``tiktoken`` when it is installed (and its encoding files can be
+loaded); otherwise a local estimate of about four characters per token – never
+fewer than the word count – which errs on the high side.
+"""
+
+import functools
+import json
+
+from modules import settings
+
+try:
+    import tiktoken
+except ModuleNotFoundError:
+    tiktoken = None
+
+# Context window per model family; the longest matching prefix wins
+CONTEXT_WINDOWS = {
+    "gpt-4o": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4-32k": 32768,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 16385,
+}
+DEFAULT_WINDOW = 8192
+# USD per 1K (prompt, completion) tokens, longest matching prefix; LLM_PRICES overrides
+PRICES = {
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4-32k": (0.06, 0.12),
+    "gpt-4": (0.03, 0.06),
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+}
+COMPLETION_RESERVE = settings.get_int("LLM_COMPLETION_RESERVE", 1024)  # tokens kept free for the answer
+
+MESSAGE_OVERHEAD = 4  # role and separators of each chat message
+REPLY_PRIMER = 3  # every reply is primed with <|start|>assistant<|message|>
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        pass
+    except Exception:
+        return None  # encoding files unavailable (e.g. offline)
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def count(text: str, model: str = "gpt-4") -> int:
+    """Number of tokens in ``text`` for ``model``."""
+    if not text:
+        return 0
+    encoding = _encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return max(len(text) // 4, len(text.split())) + 1
+
+
+def count_message(message: dict, model: str = "gpt-4") -> int:
+    tokens = MESSAGE_OVERHEAD + count(message.get("content") or "", model)
+    if message.get("name"):
+        tokens += count(message["name"], model) + 1
+    for call in message.get("tool_calls") or ():
+        function = call.get("function") or {}
+        tokens += count(function.get("name") or "", model) + count(function.get("arguments") or "", model)
+    return tokens
+
+
+def count_messages(messages: list, model: str = "gpt-4", tools: list | None = None) -> int:
+    """Prompt tokens of a chat request, including tool definitions."""
+    tokens = sum(count_message(m, model) for m in messages) + REPLY_PRIMER
+    if tools:
+        tokens += count(json.dumps(tools, separators=(",", ":")), model)
+    return tokens
+
+
+def context_window(model: str) -> int:
+    matches = [prefix for prefix in CONTEXT_WINDOWS if model.startswith(prefix)]
+    return CONTEXT_WINDOWS[max(matches, key=len)] if matches else DEFAULT_WINDOW
+
+
+def prompt_budget(model: str) -> int:
+    """Tokens a prompt may use while leaving room for the completion."""
+    return context_window(model) - COMPLETION_RESERVE
+
+
+@functools.lru_cache(maxsize=1)
+def _prices() -> dict:
+    overrides = settings.get("LLM_PRICES", {}) or {}
+    if isinstance(overrides, str):
+        try:
+            overrides = json.loads(overrides)
+        except ValueError:
+            print("LLM_PRICES is not valid JSON; using the built-in prices.")
+            overrides = {}
+    return {**PRICES, **{model: tuple(price) for model, price in overrides.items()}}
+
+
+def cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Estimated USD cost of a completion; 0.0 for models without a price."""
+    prices = _prices()
+    matches = [prefix for prefix in prices if model.startswith(prefix)]
+    if not matches:
+        return 0.0
+    prompt_price, completion_price = prices[max(matches, key=len)]
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
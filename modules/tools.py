@@ -2,84 +2,27 @@
 
 from __future__ import annotations
 
-import os
-import json
-import streamlit as st
-
-try:
-    import openai
-except ModuleNotFoundError:
-    openai = None
-
-try:
-    from pinecone import Pinecone
-except ModuleNotFoundError:
-    Pinecone = None
-
-# Global Pinecone index handle
-_pinecone_index = None
-_pinecone_client = None
-
-
-def _init_pinecone():
-    """Initialize Pinecone client using credentials from secrets or env vars."""
-    global _pinecone_index, _pinecone_client
-    if Pinecone is None:
-        raise ModuleNotFoundError(
-            "The 'pinecone' package is required for semantic_search."
-        )
-
-    api_key = st.secrets.get("pinecone_api_key") or os.environ.get("PINECONE_API_KEY")
-    env = st.secrets.get("pinecone_env") or os.environ.get("PINECONE_ENV")
-    index_name = st.secrets.get("pinecone_index") or os.environ.get("PINECONE_INDEX")
-    if not api_key or not env or not index_name:
-        raise RuntimeError(
-            "Pinecone API key, environment, or index name not configured."
-        )
-
-    _pinecone_client = Pinecone(api_key=api_key, environment=env)
-    _pinecone_index = _pinecone_client.Index(index_name)
+from modules import embeddings, retrieval, summarizer, telemetry
 
 
+@telemetry.traced("tools.semantic_search")
 def semantic_search(query: str) -> str:
     """Search the vector knowledge base for text relevant to the query."""
-    if openai is None:
-        raise ModuleNotFoundError("The 'openai' package is required for semantic_search.")
-
-    global _pinecone_index
-    if _pinecone_index is None:
-        _init_pinecone()
-
     try:
-        client = openai.OpenAI()
-        embed_resp = client.embeddings.create(
-            input=[query], model="text-embedding-ada-002"
-        )
+        backend = retrieval.get_backend()
+        vector = embeddings.embed([query])[0]
     except Exception as e:
         return f"Embedding error: {e}"
 
-    vector = embed_resp.data[0].embedding
-
     try:
-        result = _pinecone_index.query(vector=vector, top_k=5, include_metadata=True)
+        matches = backend.query(vector, top_k=5)
     except Exception as e:
         return f"Vector search error: {e}"
 
-    matches = result.get("matches", []) if isinstance(result, dict) else getattr(result, "matches", [])
     if not matches:
         return "No relevant documents found."
 
-    snippets = []
-    for match in matches:
-        text = None
-        if isinstance(match, dict):
-            text = match.get("metadata", {}).get("text")
-        else:
-            meta = getattr(match, "metadata", None)
-            if meta:
-                text = meta.get("text")
-        if text:
-            snippets.append(text)
+    snippets = [m["metadata"].get("text") for m in matches if m["metadata"].get("text")]
 
     content = "\n".join(snippets)
     if len(content) > 1000:
@@ -87,28 +30,17 @@ def semantic_search(query: str) -> str:
     return content or "No relevant documents found."
 
 
+@telemetry.traced("tools.fetch_image")
 def fetch_image(query: str) -> str:
     """Return a URL of an image loosely related to the query."""
     keywords = query.strip().replace(" ", "%20")
     return f"https://source.unsplash.com/featured/?{keywords}"
 
 
+@telemetry.traced("tools.summarize_text")
 def summarize_text(text: str, sentences: int = 3) -> str:
-    """Summarize the provided text using the OpenAI API."""
-    if openai is None:
-        raise ModuleNotFoundError("The 'openai' package is required for summarize_text.")
-
-    summary_prompt = (
-        f"Please summarize the following text in about {sentences} sentences:\n\n" """{text}"""
-    )
+    """Summarize the provided text; short texts are summarized locally (see ``summarizer``)."""
     try:
-        client = openai.OpenAI()
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": summary_prompt}],
-            temperature=0.7,
-        )
+        return summarizer.summarize(text, sentences)
     except Exception as e:
         return f"Summarization error: {e}"
-
-    return response.choices[0].message.content.strip()